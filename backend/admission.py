@@ -0,0 +1,174 @@
+"""
+Admission Control
+Bounds the scoring work the prediction service accepts at once, so that a flood of
+packets (e.g. a DoS against the monitored network) degrades the IDS gracefully instead
+of queueing unbounded work that the client has long given up on.
+
+- At most max_in_flight requests are scored at a time; up to max_queue more wait for a
+  slot, each for at most queue_timeout_ms (and never past its own deadline).
+- Requests carrying a packet from a recently flagged source are admitted before the
+  others, and may push the newest ordinary waiter out of a full queue.
+- A request that cannot be admitted raises Overloaded with the reason; the caller
+  decides whether to answer rule-only or reject it.
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+
+class Overloaded(Exception):
+    """A request was shed; reason is 'queue_full', 'queue_timeout', 'evicted' or 'deadline'"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Prediction service overloaded ({reason})")
+        self.reason = reason
+
+
+def deadline_expired(deadline: Optional[float]) -> bool:
+    """True once a time.monotonic() deadline has passed (None never expires)"""
+    return deadline is not None and time.monotonic() >= deadline
+
+
+class _Waiter:
+    __slots__ = ('event', 'priority', 'granted', 'cancelled', 'evicted')
+
+    def __init__(self, priority: bool):
+        self.event = threading.Event()
+        self.priority = priority
+        self.granted = False
+        self.cancelled = False
+        self.evicted = False
+
+
+class AdmissionController:
+    """Slot pool with a priority wait queue; slots are handed directly to the next waiter"""
+
+    def __init__(self, max_in_flight: int = 32, max_queue: int = 128, queue_timeout_ms: float = 1000,
+                 flagged_ttl: float = 300.0, max_flagged: int = 10000):
+        """
+        Args:
+            max_in_flight: Requests scored concurrently
+            max_queue: Requests waiting for a slot; beyond this new requests are shed at once
+            queue_timeout_ms: Longest a request waits for a slot
+            flagged_ttl: Seconds a source stays prioritized after its last malicious verdict
+            max_flagged: Flagged sources remembered (least recently flagged are forgotten first)
+        """
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = max(0.0, float(queue_timeout_ms)) / 1000.0
+        self.flagged_ttl = float(flagged_ttl)
+        self.max_flagged = int(max_flagged)
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queued = 0
+        self._waiters: List = []  # heap of (0 = flagged source / 1 = ordinary, arrival, _Waiter)
+        self._arrivals = itertools.count()
+        self._flagged: "OrderedDict[str, float]" = OrderedDict()  # source -> flag expiry (monotonic)
+
+        # Counters for monitoring
+        self.admitted = 0
+        self.shed: Dict[str, int] = {}
+
+    def acquire(self, priority: bool = False, deadline: Optional[float] = None):
+        """
+        Take a slot, waiting in the queue if all are busy.
+
+        Raises:
+            Overloaded: If the request was shed instead
+        """
+        with self._lock:
+            if self._in_flight < self.max_in_flight:
+                self._in_flight += 1
+                self.admitted += 1
+                return
+            if self._queued >= self.max_queue and not (priority and self._evict_ordinary()):
+                self._count_shed('queue_full')
+                raise Overloaded('queue_full')
+            waiter = _Waiter(priority)
+            heapq.heappush(self._waiters, (0 if priority else 1, next(self._arrivals), waiter))
+            self._queued += 1
+
+        timeout = self.queue_timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        waiter.event.wait(max(0.0, timeout))
+
+        with self._lock:
+            if waiter.granted:
+                self.admitted += 1
+                return
+            if waiter.evicted:
+                reason = 'evicted'
+            else:
+                waiter.cancelled = True  # Left in the heap, skipped by release()
+                self._queued -= 1
+                reason = 'deadline' if deadline_expired(deadline) else 'queue_timeout'
+            self._count_shed(reason)
+        raise Overloaded(reason)
+
+    def release(self):
+        """Return a slot, handing it to the highest-priority waiter if there is one"""
+        with self._lock:
+            while self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                if waiter.cancelled:
+                    continue
+                waiter.granted = True
+                self._queued -= 1
+                waiter.event.set()
+                return
+            self._in_flight -= 1
+
+    def _evict_ordinary(self) -> bool:
+        """Shed the newest ordinary waiter to make room for a flagged one (lock held)"""
+        victim = None
+        for priority, arrival, waiter in self._waiters:
+            if priority == 1 and not waiter.cancelled and (victim is None or arrival > victim[0]):
+                victim = (arrival, waiter)
+        if victim is None:
+            return False
+        waiter = victim[1]
+        waiter.cancelled = waiter.evicted = True
+        self._queued -= 1
+        waiter.event.set()
+        return True
+
+    def _count_shed(self, reason: str):
+        self.shed[reason] = self.shed.get(reason, 0) + 1
+
+    def flag(self, sources: Iterable[str]):
+        """Prioritize these sources (e.g. after a malicious verdict) for flagged_ttl seconds"""
+        expiry = time.monotonic() + self.flagged_ttl
+        with self._lock:
+            for source in sources:
+                self._flagged[source] = expiry
+                self._flagged.move_to_end(source)
+            while len(self._flagged) > self.max_flagged:
+                self._flagged.popitem(last=False)
+
+    def is_flagged(self, sources: Iterable[str]) -> bool:
+        """True if any of the sources was flagged within flagged_ttl"""
+        if not self._flagged:
+            return False
+        now = time.monotonic()
+        flagged = self._flagged
+        return any(flagged.get(source, 0.0) > now for source in sources)
+
+    def snapshot(self) -> Dict[str, int]:
+        """Requests being scored (in_flight) and waiting for a slot (queued) right now"""
+        with self._lock:
+            return {'in_flight': self._in_flight, 'queued': self._queued}
+
+    def describe(self) -> Dict[str, object]:
+        return {
+            **self.snapshot(),
+            'max_in_flight': self.max_in_flight,
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'shed': dict(self.shed),
+            'flagged_sources': len(self._flagged)
+        }
@@ -1,170 +1,453 @@
 """
 Comprehensive Attack Detection System
 Detects multiple attack types: DoS, Port Scan, R2L, U2R, etc.
+
+All window state of one source address lives in a single SourceState record, so a
+packet costs one table lookup. Windows are per-bucket counters in array buffers (a
+RateWheel for the port scan / DoS packet window, CountWindows for the login / R2L / U2R
+events), so per-source memory is bounded however fast a source floods.
+The SourceTable is bounded: idle sources are reaped in the background and beyond
+max_sources the least recently seen source is evicted. The sources are striped over
+several tables by address hash, each with its own lock, so concurrent requests for
+different sources rarely wait for each other.
 """
-from collections import defaultdict
-from datetime import datetime, timedelta
+from array import array
+from collections import OrderedDict
 import threading
 import math
+import os
+import time
+from typing import Dict, Optional
+
+from service_logging import get_logger
+
+log = get_logger('attack_detectors')
+
+# Detector clock, in float seconds: time.monotonic() for live traffic. Offline replay
+# (pcap_replay.py) pins it to each packet's capture time (epoch seconds), so windows and
+# rates reflect the original traffic timing.
+_pinned_time = None
+
+
+def detector_now() -> float:
+    return _pinned_time if _pinned_time is not None else time.monotonic()
+
+
+def pin_detector_time(timestamp=None):
+    """Make detector_now() return this epoch time (None: back to time.monotonic())"""
+    global _pinned_time
+    _pinned_time = float(timestamp) if timestamp is not None else None
+
+
+def score_port_scan(unique_ports: int, unique_dest_ips: int, total_packets: int,
+                    time_span: float, sequential_score: float) -> dict:
+    """Port scan features and verdict from one source's window counters"""
+    packets_per_second = total_packets / time_span
+    port_scan_rate = unique_ports / time_span
+    
+    # Port scan detection
+    is_port_scan = False
+    port_scan_score = 0.0
+    
+    # High unique ports + high rate = port scan
+    if unique_ports >= 10 and packets_per_second > 5:
+        port_scan_score = min(1.0, (unique_ports / 100.0) * (packets_per_second / 50.0))
+        is_port_scan = port_scan_score > 0.3
+    elif unique_ports >= 5 and packets_per_second > 10:
+        port_scan_score = min(1.0, (unique_ports / 50.0) * (packets_per_second / 100.0))
+        is_port_scan = port_scan_score > 0.2
+    elif unique_ports >= 20:
+        port_scan_score = min(1.0, unique_ports / 200.0)
+        is_port_scan = port_scan_score > 0.4
+    
+    # Sequential ports boost score
+    if sequential_score > 0.5:
+        port_scan_score = min(1.0, port_scan_score + 0.2)
+        is_port_scan = True
+    
+    return {
+        'unique_ports': unique_ports,
+        'port_scan_rate': port_scan_rate,
+        'unique_dest_ips': unique_dest_ips,
+        'packets_per_second': packets_per_second,
+        'is_port_scan': is_port_scan,
+        'port_scan_score': port_scan_score,
+        'sequential_score': sequential_score
+    }
+
+
+def sequential_port_score(ports) -> float:
+    """Fraction of adjacent (sorted) recent ports that are consecutive"""
+    if len(ports) < 5:
+        return 0.0
+    
+    ports = sorted(ports)
+    sequential_count = 0
+    total_sequences = 0
+    
+    for i in range(len(ports) - 1):
+        if ports[i+1] - ports[i] == 1:
+            sequential_count += 1
+        total_sequences += 1
+    
+    return sequential_count / max(total_sequences, 1) if total_sequences > 0 else 0.0
+
+
+def score_dos(packet_count: int, total_bytes: float, time_span: float,
+              unique_dest_ips: int, syn_packets: int) -> dict:
+    """DoS features and verdict from one source's window counters"""
+    packets_per_second = packet_count / time_span
+    bytes_per_second = total_bytes / time_span
+    avg_packet_size = total_bytes / packet_count if packet_count > 0 else 0
+    
+    # DoS detection heuristics
+    is_dos = False
+    dos_score = 0.0
+    
+    # High packet rate to single/multiple destinations = DoS
+    if packets_per_second > 100:  # Very high packet rate
+        dos_score = min(1.0, packets_per_second / 1000.0)
+        is_dos = dos_score > 0.5
+    elif packets_per_second > 50 and unique_dest_ips <= 3:
+        # High rate to few destinations = targeted DoS
+        dos_score = min(1.0, (packets_per_second / 200.0) * (3.0 / unique_dest_ips))
+        is_dos = dos_score > 0.4
+    elif syn_packets > 50 and packets_per_second > 20:
+        # SYN flood
+        dos_score = min(1.0, (syn_packets / 100.0) * (packets_per_second / 50.0))
+        is_dos = dos_score > 0.5
+    
+    # Small packets at high rate = flood attack
+    if avg_packet_size < 100 and packets_per_second > 30:
+        dos_score = min(1.0, dos_score + 0.3)
+        is_dos = True
+    
+    return {
+        'packets_per_second': packets_per_second,
+        'bytes_per_second': bytes_per_second,
+        'packet_count': packet_count,
+        'unique_dest_ips': unique_dest_ips,
+        'syn_packets': syn_packets,
+        'is_dos': is_dos,
+        'dos_score': dos_score,
+        'avg_packet_size': avg_packet_size
+    }
+
+
+def score_brute_force(login_attempts: int, failed_attempts: int, success_after_failures: int,
+                      target_ports: int) -> dict:
+    """Brute force features and verdict from one source's window counters"""
+    is_brute_force = False
+    brute_force_score = 0.0
+    
+    # Multiple failed login attempts = brute force
+    if failed_attempts >= 10:
+        brute_force_score = min(1.0, failed_attempts / 50.0)
+        is_brute_force = True
+    elif failed_attempts >= 5 and login_attempts >= 8:
+        # High failure rate
+        failure_rate = failed_attempts / login_attempts if login_attempts > 0 else 0
+        brute_force_score = min(1.0, failure_rate * (failed_attempts / 10.0))
+        is_brute_force = brute_force_score > 0.4
+    elif success_after_failures >= 1 and failed_attempts >= 3:
+        # Successful login after multiple failures = likely compromised
+        brute_force_score = 0.9
+        is_brute_force = True
+    elif login_attempts >= 20:
+        # Many login attempts
+        brute_force_score = min(1.0, login_attempts / 100.0)
+        is_brute_force = brute_force_score > 0.3
+    
+    return {
+        'login_attempts': login_attempts,
+        'failed_attempts': failed_attempts,
+        'success_after_failures': success_after_failures,
+        'target_ports': target_ports,
+        'is_brute_force': is_brute_force,
+        'brute_force_score': brute_force_score
+    }
+
+
+class CountWindow:
+    """
+    Event count over a sliding window of time buckets: (bucket number, events) pairs in
+    array buffers, oldest first, and their running total. There is one entry per busy
+    bucket, so memory does not grow with the event rate; expired buckets are skipped by
+    advancing head and the consumed prefix is deleted once it is half the buffer.
+    """
+    __slots__ = ('ticks', 'counts', 'head', 'total')
+
+    def __init__(self):
+        self.ticks = array('q')
+        self.counts = array('I')
+        self.head = 0
+        self.total = 0
+
+    def __len__(self):
+        return self.total
+
+    def add(self, tick: int):
+        if len(self.ticks) > self.head and self.ticks[-1] >= tick:
+            self.counts[-1] += 1
+        else:
+            self.ticks.append(tick)
+            self.counts.append(1)
+        self.total += 1
+
+    def expire(self, oldest_tick: int):
+        """Drop the buckets before oldest_tick"""
+        ticks, head = self.ticks, self.head
+        end = len(ticks)
+        while head < end and ticks[head] < oldest_tick:
+            self.total -= self.counts[head]
+            head += 1
+        if head and head * 2 >= end:
+            del ticks[:head]
+            del self.counts[:head]
+            head = 0
+        self.head = head
+
+
+class RateWheel:
+    """
+    One source's packet window as time buckets: per bucket the packet, byte and SYN
+    counts, the first packet time and the destination ports seen, plus running totals
+    over the live buckets (and the recent-port multiset behind the sequential-scan check).
+    Memory grows with the number of live buckets (at most window / bucket width), never
+    with the packet rate; adding a packet and reading the totals are amortized O(1).
+    """
+    __slots__ = ('ticks', 'counts', 'sizes', 'syns', 'firsts', 'ports', 'head', 'count', 'bytes', 'syn',
+                 'last', 'port_counts', 'n_ports', 'adjacent_ports')
+
+    def __init__(self):
+        self.ticks = array('q')  # Bucket number (time // bucket width), increasing
+        self.counts = array('I')
+        self.sizes = array('Q')
+        self.syns = array('I')
+        self.firsts = array('d')  # First packet time in the bucket
+        self.ports = []  # {port: packets} per bucket, None if no port was seen
+        self.head = 0  # First live bucket
+        self.count = 0
+        self.bytes = 0
+        self.syn = 0
+        self.last = 0.0  # Latest packet time
+        self.port_counts: Dict[int, int] = {}  # port -> packets in the live buckets
+        self.n_ports = 0  # Packets with a port in the live buckets
+        self.adjacent_ports = 0  # Distinct ports p in port_counts with p + 1 also present
+
+    def __len__(self):
+        return self.count
+
+    def first(self) -> float:
+        """First packet time of the oldest live bucket"""
+        return self.firsts[self.head]
+
+    def add(self, tick: int, now: float, size: int, syn: bool = False):
+        if len(self.ticks) == self.head or self.ticks[-1] < tick:
+            self.ticks.append(tick)
+            self.counts.append(0)
+            self.sizes.append(0)
+            self.syns.append(0)
+            self.firsts.append(now)
+            self.ports.append(None)
+        # A packet older than the newest bucket (clock step back) is counted in the newest
+        self.counts[-1] += 1
+        self.sizes[-1] += size
+        self.count += 1
+        self.bytes += size
+        if syn:
+            self.syns[-1] += 1
+            self.syn += 1
+        if now > self.last:
+            self.last = now
+
+    def add_port(self, port: int):
+        """Record the destination port of the packet just added"""
+        if len(self.ticks) == self.head:
+            return
+        bucket = self.ports[-1]
+        if bucket is None:
+            bucket = self.ports[-1] = {}
+        bucket[port] = bucket.get(port, 0) + 1
+        counts = self.port_counts
+        if port not in counts:
+            counts[port] = 0
+            self.adjacent_ports += (port - 1 in counts) + (port + 1 in counts)
+        counts[port] += 1
+        self.n_ports += 1
+
+    def expire(self, oldest_tick: int):
+        """Drop the buckets before oldest_tick, subtracting them from the totals"""
+        ticks, head = self.ticks, self.head
+        end = len(ticks)
+        if head == end or ticks[head] >= oldest_tick:
+            return
+        counts = self.port_counts
+        while head < end and ticks[head] < oldest_tick:
+            self.count -= self.counts[head]
+            self.bytes -= self.sizes[head]
+            self.syn -= self.syns[head]
+            bucket = self.ports[head]
+            if bucket:
+                for port, n in bucket.items():
+                    self.n_ports -= n
+                    counts[port] -= n
+                    if not counts[port]:
+                        del counts[port]
+                        self.adjacent_ports -= (port - 1 in counts) + (port + 1 in counts)
+            head += 1
+        if head * 2 >= end:
+            for buffer in (ticks, self.counts, self.sizes, self.syns, self.firsts, self.ports):
+                del buffer[:head]
+            head = 0
+        self.head = head
+
+
+class SourceState:
+    """
+    Every detector's window state for one source address. The port scan and DoS detectors
+    share the packet window, destination set and port set (they always recorded the same
+    packets); R2L / U2R / login windows are created on first use, as most sources never
+    need them.
+    """
+    __slots__ = ('last_seen', 'packets', 'ports', 'dest_ips', 'logins', 'r2l', 'u2r')
+
+    def __init__(self):
+        self.last_seen = 0.0
+        self.packets = RateWheel()
+        self.ports = set()
+        self.dest_ips = set()
+        self.logins = None  # (login_attempts, failed_attempts, successful_after_failures)
+        self.r2l = None  # (failed_logins, privilege_escalation, suspicious_commands, dest_ips)
+        self.u2r = None  # (root_commands, setuid_attempts, buffer_overflow_patterns, suspicious_file_access)
+
+
+class SourceTable:
+    """
+    SourceState records in least recently seen order. Sources not seen for idle_ttl
+    seconds (by default the longest detector window, after which every window is empty)
+    are removed by reap(); beyond max_sources the least recently seen source is evicted
+    at once, so a flood of spoofed sources cannot grow the table without bound.
+    """
+
+    def __init__(self, max_sources: int = 100000, idle_ttl: float = 300.0):
+        self.max_sources = max(1, int(max_sources))
+        self.idle_ttl = float(idle_ttl)
+        self.lock = threading.Lock()
+        self._states: "OrderedDict[str, SourceState]" = OrderedDict()
+        self.evicted = {'idle': 0, 'capacity': 0}
+        # Lock acquisitions that had to wait, and the total wait (updated with the lock held)
+        self.contended = 0
+        self.wait_seconds = 0.0
+
+    def __len__(self):
+        return len(self._states)
+
+    def acquire(self):
+        """Take the lock: a non-blocking attempt first, timing the wait only when it is contended"""
+        lock = self.lock
+        if lock.acquire(False):
+            return
+        started = time.perf_counter()
+        lock.acquire()
+        self.contended += 1
+        self.wait_seconds += time.perf_counter() - started
+
+    def touch(self, source_ip: str, now: float) -> SourceState:
+        """The record of a source seen now, created if needed (lock held)"""
+        states = self._states
+        state = states.get(source_ip)
+        if state is None:
+            state = states[source_ip] = SourceState()
+            if len(states) > self.max_sources:
+                states.popitem(last=False)
+                self.evicted['capacity'] += 1
+        else:
+            states.move_to_end(source_ip)
+        state.last_seen = now
+        return state
+
+    def peek(self, source_ip: str) -> Optional[SourceState]:
+        """The record of a source without refreshing it (lock held)"""
+        return self._states.get(source_ip)
+
+    def reap(self, now: float, batch: int = 1024) -> int:
+        """Remove sources idle for idle_ttl; the lock is taken per batch to keep packets flowing"""
+        cutoff = now - self.idle_ttl
+        reaped = 0
+        while True:
+            with self.lock:
+                states = self._states
+                n = 0
+                while n < batch and states:
+                    state = next(iter(states.values()))
+                    if state.last_seen > cutoff:
+                        break
+                    states.popitem(last=False)
+                    n += 1
+                self.evicted['idle'] += n
+            reaped += n
+            if n < batch:
+                return reaped
+
 
 class AttackDetectorBase:
-    """Base class for attack detectors"""
-    def __init__(self, time_window_seconds=60):
+    """
+    Base class for attack detectors. Detectors keep no state of their own: they update
+    and score a source's SourceState, with its SourceTable lock held.
+    """
+    def __init__(self, time_window_seconds=60, bucket_seconds=1.0):
         self.time_window = time_window_seconds
-        self.lock = threading.Lock()
-    
-    def _cleanup_old_data(self, tracking_dict, timestamp_key='timestamp'):
-        """Remove old tracking data"""
-        now = datetime.now()
-        cutoff_time = now - timedelta(seconds=self.time_window)
-        
-        keys_to_remove = []
-        for key, data in tracking_dict.items():
-            if isinstance(data, dict) and timestamp_key in data:
-                if data[timestamp_key] < cutoff_time:
-                    keys_to_remove.append(key)
-            elif isinstance(data, list):
-                # Filter list items
-                tracking_dict[key] = [item for item in data 
-                                    if getattr(item, timestamp_key, item) > cutoff_time]
-                if not tracking_dict[key]:
-                    keys_to_remove.append(key)
-        
-        for key in keys_to_remove:
-            del tracking_dict[key]
+        # Window resolution: the window spans n_buckets buckets of bucket_seconds
+        self.bucket_seconds = float(bucket_seconds)
+        self.n_buckets = max(1, math.ceil(time_window_seconds / self.bucket_seconds))
+
+    def _oldest_tick(self, now: float):
+        """(bucket of now, oldest bucket still in the window)"""
+        tick = int(now // self.bucket_seconds)
+        return tick, tick - self.n_buckets + 1
 
 
 class PortScanDetector(AttackDetectorBase):
     """Detects port scanning and reconnaissance attacks"""
     
-    def __init__(self, time_window_seconds=60):
-        super().__init__(time_window_seconds)
-        self.port_tracking = defaultdict(lambda: {
-            'ports': set(),
-            'timestamps': [],
-            'unique_dest_ips': set(),
-            'total_packets': 0,
-            'sequential_ports': []
-        })
-    
-    def add_packet(self, source_ip: str, dest_ip: str, dest_port: int = None, 
-                   protocol: str = 'TCP'):
-        """Add packet to tracking"""
-        try:
-            # Validate inputs
-            if not source_ip or not isinstance(source_ip, str):
-                return
-            if not dest_ip or not isinstance(dest_ip, str):
-                return
-            if dest_port is not None:
-                try:
-                    dest_port = int(dest_port)
-                    if dest_port < 1 or dest_port > 65535:
-                        dest_port = None
-                except (ValueError, TypeError):
-                    dest_port = None
-            
-            now = datetime.now()
-            cutoff_time = now - timedelta(seconds=self.time_window)
-            
-            with self.lock:
-                data = self.port_tracking[source_ip]
-                
-                # Clean old data
-                try:
-                    data['timestamps'] = [ts for ts in data['timestamps'] if isinstance(ts, datetime) and ts > cutoff_time]
-                except Exception as e:
-                    print(f"⚠️ Error cleaning timestamps: {e}")
-                    data['timestamps'] = []
-                
-                # Add new data
-                data['timestamps'].append(now)
-                if dest_ip:
-                    data['unique_dest_ips'].add(dest_ip)
-                data['total_packets'] = max(0, data.get('total_packets', 0) + 1)
-                
-                if dest_port:
-                    try:
-                        data['ports'].add(dest_port)
-                        data['sequential_ports'].append((dest_port, now))
-                        # Keep only recent ports
-                        data['sequential_ports'] = [(p, t) for p, t in data['sequential_ports'] 
-                                                  if isinstance(t, datetime) and t > cutoff_time]
-                    except Exception as e:
-                        print(f"⚠️ Error adding port data: {e}")
-        except Exception as e:
-            print(f"⚠️ Error in PortScanDetector.add_packet: {e}")
+    def add_packet(self, state: SourceState, now: float, dest_ip: str, dest_port: int = None):
+        """Add packet to tracking (the packet itself is counted by DoSDetector, just before)"""
+        if dest_ip:
+            state.dest_ips.add(dest_ip)
+        if dest_port:
+            state.ports.add(dest_port)
+            state.packets.add_port(dest_port)
     
-    def get_features(self, source_ip: str) -> dict:
+    def get_features(self, state: Optional[SourceState], now: float) -> dict:
         """Get port scan detection features"""
-        with self.lock:
-            if source_ip not in self.port_tracking:
-                return self._default_features()
-            
-            data = self.port_tracking[source_ip]
-            now = datetime.now()
-            cutoff_time = now - timedelta(seconds=self.time_window)
-            
-            recent_timestamps = [ts for ts in data['timestamps'] if ts > cutoff_time]
-            if not recent_timestamps:
-                return self._default_features()
-            
-            unique_ports = len(data['ports'])
-            unique_dest_ips = len(data['unique_dest_ips'])
-            total_packets = len(recent_timestamps)
-            time_span = (recent_timestamps[-1] - recent_timestamps[0]).total_seconds() or 1
-            
-            packets_per_second = total_packets / time_span
-            port_scan_rate = unique_ports / time_span
-            
-            # Check for sequential port patterns
-            sequential_score = self._check_sequential_ports(data['sequential_ports'])
-            
-            # Port scan detection
-            is_port_scan = False
-            port_scan_score = 0.0
-            
-            # High unique ports + high rate = port scan
-            if unique_ports >= 10 and packets_per_second > 5:
-                port_scan_score = min(1.0, (unique_ports / 100.0) * (packets_per_second / 50.0))
-                is_port_scan = port_scan_score > 0.3
-            elif unique_ports >= 5 and packets_per_second > 10:
-                port_scan_score = min(1.0, (unique_ports / 50.0) * (packets_per_second / 100.0))
-                is_port_scan = port_scan_score > 0.2
-            elif unique_ports >= 20:
-                port_scan_score = min(1.0, unique_ports / 200.0)
-                is_port_scan = port_scan_score > 0.4
-            
-            # Sequential ports boost score
-            if sequential_score > 0.5:
-                port_scan_score = min(1.0, port_scan_score + 0.2)
-                is_port_scan = True
-            
-            return {
-                'unique_ports': unique_ports,
-                'port_scan_rate': port_scan_rate,
-                'unique_dest_ips': unique_dest_ips,
-                'packets_per_second': packets_per_second,
-                'is_port_scan': is_port_scan,
-                'port_scan_score': port_scan_score,
-                'sequential_score': sequential_score
-            }
-    
-    def _check_sequential_ports(self, port_timestamps):
-        """Check if ports are being scanned sequentially"""
-        if len(port_timestamps) < 5:
-            return 0.0
+        if state is None:
+            return self._default_features()
+        
+        packets = state.packets
+        packets.expire(self._oldest_tick(now)[1])
+        if not packets:
+            return self._default_features()
         
-        ports = sorted([p for p, t in port_timestamps])
-        sequential_count = 0
-        total_sequences = 0
+        unique_ports = len(state.ports)
+        unique_dest_ips = len(state.dest_ips)
+        total_packets = len(packets)
+        time_span = (packets.last - packets.first()) or 1
         
-        for i in range(len(ports) - 1):
-            if ports[i+1] - ports[i] == 1:
-                sequential_count += 1
-            total_sequences += 1
+        # Check for sequential port patterns
+        sequential_score = self._check_sequential_ports(packets)
         
-        return sequential_count / max(total_sequences, 1) if total_sequences > 0 else 0.0
+        return score_port_scan(unique_ports, unique_dest_ips, total_packets, time_span, sequential_score)
+    
+    def _check_sequential_ports(self, packets: RateWheel):
+        """
+        Check if ports are being scanned sequentially: sequential_port_score of the recent
+        ports, from the running counters. In the sorted recent ports every distinct port p
+        with p + 1 also present contributes exactly one consecutive pair.
+        """
+        if packets.n_ports < 5:
+            return 0.0
+        return packets.adjacent_ports / (packets.n_ports - 1)
     
     def _default_features(self):
         return {
@@ -181,118 +464,33 @@ class PortScanDetector(AttackDetectorBase):
 class DoSDetector(AttackDetectorBase):
     """Detects Denial of Service (DoS) attacks"""
     
-    def __init__(self, time_window_seconds=60):
-        super().__init__(time_window_seconds)
-        self.dos_tracking = defaultdict(lambda: {
-            'packets': [],
-            'bytes': [],
-            'dest_ips': set(),
-            'syn_packets': 0,
-            'failed_connections': 0
-        })
-    
-    def add_packet(self, source_ip: str, dest_ip: str, packet_size: int,
-                   protocol: str = 'TCP', is_syn: bool = False, 
-                   connection_failed: bool = False):
+    def add_packet(self, state: SourceState, now: float, dest_ip: str, packet_size: int,
+                   is_syn: bool = False):
         """Add packet to DoS tracking"""
         try:
-            # Validate inputs
-            if not source_ip or not isinstance(source_ip, str):
-                return
-            if not dest_ip or not isinstance(dest_ip, str):
-                return
-            try:
-                packet_size = int(packet_size)
-                packet_size = max(0, min(packet_size, 65535))  # Cap at max packet size
-            except (ValueError, TypeError):
-                packet_size = 0
-            
-            now = datetime.now()
-            cutoff_time = now - timedelta(seconds=self.time_window)
-            
-            with self.lock:
-                data = self.dos_tracking[source_ip]
-                
-                # Clean old data
-                try:
-                    data['packets'] = [(ts, size) for ts, size in data['packets'] 
-                                     if isinstance(ts, datetime) and ts > cutoff_time]
-                    data['bytes'] = [(ts, size) for ts, size in data['bytes'] 
-                                    if isinstance(ts, datetime) and ts > cutoff_time]
-                except Exception as e:
-                    print(f"⚠️ Error cleaning DoS data: {e}")
-                    data['packets'] = []
-                    data['bytes'] = []
-                
-                # Add new data
-                data['packets'].append((now, 1))
-                data['bytes'].append((now, packet_size))
-                if dest_ip:
-                    data['dest_ips'].add(dest_ip)
-                
-                if is_syn:
-                    data['syn_packets'] = max(0, data.get('syn_packets', 0) + 1)
-                if connection_failed:
-                    data['failed_connections'] = max(0, data.get('failed_connections', 0) + 1)
-        except Exception as e:
-            print(f"⚠️ Error in DoSDetector.add_packet: {e}")
+            packet_size = max(0, min(int(packet_size), 65535))  # Cap at max packet size
+        except (ValueError, TypeError):
+            packet_size = 0
+        
+        tick, oldest = self._oldest_tick(now)
+        state.packets.expire(oldest)
+        state.packets.add(tick, now, packet_size, is_syn)
+        if dest_ip:
+            state.dest_ips.add(dest_ip)
     
-    def get_features(self, source_ip: str) -> dict:
+    def get_features(self, state: Optional[SourceState], now: float) -> dict:
         """Get DoS detection features"""
-        with self.lock:
-            if source_ip not in self.dos_tracking:
-                return self._default_features()
-            
-            data = self.dos_tracking[source_ip]
-            now = datetime.now()
-            cutoff_time = now - timedelta(seconds=self.time_window)
-            
-            recent_packets = [(ts, size) for ts, size in data['packets'] if ts > cutoff_time]
-            recent_bytes = [(ts, size) for ts, size in data['bytes'] if ts > cutoff_time]
-            
-            if not recent_packets:
-                return self._default_features()
-            
-            time_span = (recent_packets[-1][0] - recent_packets[0][0]).total_seconds() or 1
-            packet_count = len(recent_packets)
-            total_bytes = sum(size for _, size in recent_bytes)
-            
-            packets_per_second = packet_count / time_span
-            bytes_per_second = total_bytes / time_span
-            avg_packet_size = total_bytes / packet_count if packet_count > 0 else 0
-            
-            # DoS detection heuristics
-            is_dos = False
-            dos_score = 0.0
-            
-            # High packet rate to single/multiple destinations = DoS
-            if packets_per_second > 100:  # Very high packet rate
-                dos_score = min(1.0, packets_per_second / 1000.0)
-                is_dos = dos_score > 0.5
-            elif packets_per_second > 50 and len(data['dest_ips']) <= 3:
-                # High rate to few destinations = targeted DoS
-                dos_score = min(1.0, (packets_per_second / 200.0) * (3.0 / len(data['dest_ips'])))
-                is_dos = dos_score > 0.4
-            elif data['syn_packets'] > 50 and packets_per_second > 20:
-                # SYN flood
-                dos_score = min(1.0, (data['syn_packets'] / 100.0) * (packets_per_second / 50.0))
-                is_dos = dos_score > 0.5
-            
-            # Small packets at high rate = flood attack
-            if avg_packet_size < 100 and packets_per_second > 30:
-                dos_score = min(1.0, dos_score + 0.3)
-                is_dos = True
-            
-            return {
-                'packets_per_second': packets_per_second,
-                'bytes_per_second': bytes_per_second,
-                'packet_count': packet_count,
-                'unique_dest_ips': len(data['dest_ips']),
-                'syn_packets': data['syn_packets'],
-                'is_dos': is_dos,
-                'dos_score': dos_score,
-                'avg_packet_size': avg_packet_size
-            }
+        if state is None:
+            return self._default_features()
+        
+        packets = state.packets
+        packets.expire(self._oldest_tick(now)[1])
+        if not packets:
+            return self._default_features()
+        
+        time_span = (packets.last - packets.first()) or 1
+        
+        return score_dos(len(packets), packets.bytes, time_span, len(state.dest_ips), packets.syn)
     
     def _default_features(self):
         return {
@@ -310,77 +508,67 @@ class DoSDetector(AttackDetectorBase):
 class R2LDetector(AttackDetectorBase):
     """Detects Remote to Local (R2L) attacks - unauthorized access attempts"""
     
-    def __init__(self, time_window_seconds=300):  # Longer window for R2L
-        super().__init__(time_window_seconds)
-        self.r2l_tracking = defaultdict(lambda: {
-            'failed_logins': [],
-            'privilege_escalation': [],
-            'suspicious_commands': [],
-            'dest_ips': set(),
-            'access_patterns': []
-        })
-    
-    def add_packet(self, source_ip: str, dest_ip: str, is_failed_login: bool = False,
+    def __init__(self, time_window_seconds=300, bucket_seconds=1.0):  # Longer window for R2L
+        super().__init__(time_window_seconds, bucket_seconds)
+    
+    def add_packet(self, state: SourceState, now: float, dest_ip: str, is_failed_login: bool = False,
                    is_privilege_attempt: bool = False, suspicious_command: bool = False):
         """Add packet to R2L tracking"""
-        now = datetime.now()
-        cutoff_time = now - timedelta(seconds=self.time_window)
+        if state.r2l is None:
+            state.r2l = (CountWindow(), CountWindow(), CountWindow(), set())
+        failed_logins, privilege_escalation, suspicious_commands, dest_ips = state.r2l
         
-        with self.lock:
-            data = self.r2l_tracking[source_ip]
-            
-            # Clean old data
-            data['failed_logins'] = [ts for ts in data['failed_logins'] if ts > cutoff_time]
-            data['privilege_escalation'] = [ts for ts in data['privilege_escalation'] if ts > cutoff_time]
-            data['suspicious_commands'] = [ts for ts in data['suspicious_commands'] if ts > cutoff_time]
-            
-            # Add new data
-            data['dest_ips'].add(dest_ip)
-            
-            if is_failed_login:
-                data['failed_logins'].append(now)
-            if is_privilege_attempt:
-                data['privilege_escalation'].append(now)
-            if suspicious_command:
-                data['suspicious_commands'].append(now)
-    
-    def get_features(self, source_ip: str) -> dict:
+        # Clean old data
+        tick, oldest = self._oldest_tick(now)
+        failed_logins.expire(oldest)
+        privilege_escalation.expire(oldest)
+        suspicious_commands.expire(oldest)
+        
+        # Add new data
+        dest_ips.add(dest_ip)
+        
+        if is_failed_login:
+            failed_logins.add(tick)
+        if is_privilege_attempt:
+            privilege_escalation.add(tick)
+        if suspicious_command:
+            suspicious_commands.add(tick)
+    
+    def get_features(self, state: Optional[SourceState], now: float) -> dict:
         """Get R2L detection features"""
-        with self.lock:
-            if source_ip not in self.r2l_tracking:
-                return self._default_features()
-            
-            data = self.r2l_tracking[source_ip]
-            
-            failed_logins = len(data['failed_logins'])
-            privilege_attempts = len(data['privilege_escalation'])
-            suspicious_commands = len(data['suspicious_commands'])
-            
-            # R2L detection
-            is_r2l = False
-            r2l_score = 0.0
-            
-            # Multiple failed logins = brute force
-            if failed_logins >= 5:
-                r2l_score = min(1.0, failed_logins / 20.0)
-                is_r2l = r2l_score > 0.4
-            elif privilege_attempts >= 3:
-                # Privilege escalation attempts
-                r2l_score = min(1.0, privilege_attempts / 10.0)
-                is_r2l = True
-            elif suspicious_commands >= 5:
-                # Suspicious command execution
-                r2l_score = min(1.0, suspicious_commands / 15.0)
-                is_r2l = r2l_score > 0.3
-            
-            return {
-                'failed_logins': failed_logins,
-                'privilege_attempts': privilege_attempts,
-                'suspicious_commands': suspicious_commands,
-                'unique_dest_ips': len(data['dest_ips']),
-                'is_r2l': is_r2l,
-                'r2l_score': r2l_score
-            }
+        if state is None or state.r2l is None:
+            return self._default_features()
+        
+        failed_logins_window, privilege_window, commands_window, dest_ips = state.r2l
+        failed_logins = len(failed_logins_window)
+        privilege_attempts = len(privilege_window)
+        suspicious_commands = len(commands_window)
+        
+        # R2L detection
+        is_r2l = False
+        r2l_score = 0.0
+        
+        # Multiple failed logins = brute force
+        if failed_logins >= 5:
+            r2l_score = min(1.0, failed_logins / 20.0)
+            is_r2l = r2l_score > 0.4
+        elif privilege_attempts >= 3:
+            # Privilege escalation attempts
+            r2l_score = min(1.0, privilege_attempts / 10.0)
+            is_r2l = True
+        elif suspicious_commands >= 5:
+            # Suspicious command execution
+            r2l_score = min(1.0, suspicious_commands / 15.0)
+            is_r2l = r2l_score > 0.3
+        
+        return {
+            'failed_logins': failed_logins,
+            'privilege_attempts': privilege_attempts,
+            'suspicious_commands': suspicious_commands,
+            'unique_dest_ips': len(dest_ips),
+            'is_r2l': is_r2l,
+            'r2l_score': r2l_score
+        }
     
     def _default_features(self):
         return {
@@ -396,80 +584,63 @@ class R2LDetector(AttackDetectorBase):
 class U2RDetector(AttackDetectorBase):
     """Detects User to Root (U2R) attacks - privilege escalation"""
     
-    def __init__(self, time_window_seconds=300):
-        super().__init__(time_window_seconds)
-        self.u2r_tracking = defaultdict(lambda: {
-            'root_commands': [],
-            'setuid_attempts': [],
-            'buffer_overflow_patterns': [],
-            'suspicious_file_access': []
-        })
+    def __init__(self, time_window_seconds=300, bucket_seconds=1.0):
+        super().__init__(time_window_seconds, bucket_seconds)
     
-    def add_packet(self, source_ip: str, is_root_command: bool = False,
+    def add_packet(self, state: SourceState, now: float, is_root_command: bool = False,
                    is_setuid_attempt: bool = False, is_buffer_overflow: bool = False,
                    suspicious_file: bool = False):
         """Add packet to U2R tracking"""
-        now = datetime.now()
-        cutoff_time = now - timedelta(seconds=self.time_window)
+        if state.u2r is None:
+            state.u2r = (CountWindow(), CountWindow(), CountWindow(), CountWindow())
+        root_commands, setuid_attempts, buffer_overflow_patterns, suspicious_file_access = state.u2r
         
-        with self.lock:
-            data = self.u2r_tracking[source_ip]
-            
-            # Clean old data
-            data['root_commands'] = [ts for ts in data['root_commands'] if ts > cutoff_time]
-            data['setuid_attempts'] = [ts for ts in data['setuid_attempts'] if ts > cutoff_time]
-            data['buffer_overflow_patterns'] = [ts for ts in data['buffer_overflow_patterns'] 
-                                                if ts > cutoff_time]
-            data['suspicious_file_access'] = [ts for ts in data['suspicious_file_access'] 
-                                            if ts > cutoff_time]
-            
-            if is_root_command:
-                data['root_commands'].append(now)
-            if is_setuid_attempt:
-                data['setuid_attempts'].append(now)
-            if is_buffer_overflow:
-                data['buffer_overflow_patterns'].append(now)
-            if suspicious_file:
-                data['suspicious_file_access'].append(now)
-    
-    def get_features(self, source_ip: str) -> dict:
+        # Clean old data
+        tick, oldest = self._oldest_tick(now)
+        for window in state.u2r:
+            window.expire(oldest)
+        
+        if is_root_command:
+            root_commands.add(tick)
+        if is_setuid_attempt:
+            setuid_attempts.add(tick)
+        if is_buffer_overflow:
+            buffer_overflow_patterns.add(tick)
+        if suspicious_file:
+            suspicious_file_access.add(tick)
+    
+    def get_features(self, state: Optional[SourceState], now: float) -> dict:
         """Get U2R detection features"""
-        with self.lock:
-            if source_ip not in self.u2r_tracking:
-                return self._default_features()
-            
-            data = self.u2r_tracking[source_ip]
-            
-            root_commands = len(data['root_commands'])
-            setuid_attempts = len(data['setuid_attempts'])
-            buffer_overflow = len(data['buffer_overflow_patterns'])
-            suspicious_files = len(data['suspicious_file_access'])
-            
-            # U2R detection
-            is_u2r = False
-            u2r_score = 0.0
-            
-            if root_commands >= 3:
-                u2r_score = min(1.0, root_commands / 10.0)
-                is_u2r = True
-            elif setuid_attempts >= 2:
-                u2r_score = min(1.0, setuid_attempts / 5.0)
-                is_u2r = True
-            elif buffer_overflow >= 1:
-                u2r_score = 0.8  # Buffer overflow is serious
-                is_u2r = True
-            elif suspicious_files >= 5:
-                u2r_score = min(1.0, suspicious_files / 15.0)
-                is_u2r = u2r_score > 0.3
-            
-            return {
-                'root_commands': root_commands,
-                'setuid_attempts': setuid_attempts,
-                'buffer_overflow_patterns': buffer_overflow,
-                'suspicious_file_access': suspicious_files,
-                'is_u2r': is_u2r,
-                'u2r_score': u2r_score
-            }
+        if state is None or state.u2r is None:
+            return self._default_features()
+        
+        root_commands, setuid_attempts, buffer_overflow, suspicious_files = (len(window) for window in state.u2r)
+        
+        # U2R detection
+        is_u2r = False
+        u2r_score = 0.0
+        
+        if root_commands >= 3:
+            u2r_score = min(1.0, root_commands / 10.0)
+            is_u2r = True
+        elif setuid_attempts >= 2:
+            u2r_score = min(1.0, setuid_attempts / 5.0)
+            is_u2r = True
+        elif buffer_overflow >= 1:
+            u2r_score = 0.8  # Buffer overflow is serious
+            is_u2r = True
+        elif suspicious_files >= 5:
+            u2r_score = min(1.0, suspicious_files / 15.0)
+            is_u2r = u2r_score > 0.3
+        
+        return {
+            'root_commands': root_commands,
+            'setuid_attempts': setuid_attempts,
+            'buffer_overflow_patterns': buffer_overflow,
+            'suspicious_file_access': suspicious_files,
+            'is_u2r': is_u2r,
+            'u2r_score': u2r_score
+        }
     
     def _default_features(self):
         return {
@@ -485,110 +656,42 @@ class U2RDetector(AttackDetectorBase):
 class BruteForceDetector(AttackDetectorBase):
     """Detects Brute Force attacks - repeated login attempts"""
     
-    def __init__(self, time_window_seconds=300):
-        super().__init__(time_window_seconds)
-        self.brute_force_tracking = defaultdict(lambda: {
-            'login_attempts': [],
-            'failed_attempts': [],
-            'successful_after_failures': [],
-            'target_ports': set(),
-            'username_guessing': []
-        })
-    
-    def add_packet(self, source_ip: str, dest_port: int = None, 
-                   is_login_attempt: bool = False, is_failed: bool = False,
-                   is_success_after_failures: bool = False):
-        """Add packet to brute force tracking"""
-        try:
-            # Validate inputs
-            if not source_ip or not isinstance(source_ip, str):
+    def __init__(self, time_window_seconds=300, bucket_seconds=1.0):
+        super().__init__(time_window_seconds, bucket_seconds)
+    
+    def add_packet(self, state: SourceState, now: float, is_login_attempt: bool = False,
+                   is_failed: bool = False, is_success_after_failures: bool = False):
+        """Add packet to brute force tracking (target ports are the shared SourceState.ports)"""
+        if state.logins is None:
+            if not is_login_attempt:
                 return
-            if dest_port is not None:
-                try:
-                    dest_port = int(dest_port)
-                    if dest_port < 1 or dest_port > 65535:
-                        dest_port = None
-                except (ValueError, TypeError):
-                    dest_port = None
-            
-            now = datetime.now()
-            cutoff_time = now - timedelta(seconds=self.time_window)
-            
-            with self.lock:
-                data = self.brute_force_tracking[source_ip]
-                
-                # Clean old data
-                try:
-                    data['login_attempts'] = [ts for ts in data['login_attempts'] 
-                                            if isinstance(ts, datetime) and ts > cutoff_time]
-                    data['failed_attempts'] = [ts for ts in data['failed_attempts'] 
-                                             if isinstance(ts, datetime) and ts > cutoff_time]
-                    data['successful_after_failures'] = [ts for ts in data['successful_after_failures'] 
-                                                        if isinstance(ts, datetime) and ts > cutoff_time]
-                except Exception as e:
-                    print(f"⚠️ Error cleaning brute force data: {e}")
-                    data['login_attempts'] = []
-                    data['failed_attempts'] = []
-                    data['successful_after_failures'] = []
-                
-                if dest_port:
-                    try:
-                        data['target_ports'].add(dest_port)
-                    except Exception:
-                        pass
-                
-                if is_login_attempt:
-                    data['login_attempts'].append(now)
-                    if is_failed:
-                        data['failed_attempts'].append(now)
-                    if is_success_after_failures:
-                        data['successful_after_failures'].append(now)
-        except Exception as e:
-            print(f"⚠️ Error in BruteForceDetector.add_packet: {e}")
+            state.logins = (CountWindow(), CountWindow(), CountWindow())
+        login_attempts, failed_attempts, successful_after_failures = state.logins
+        
+        # Clean old data
+        tick, oldest = self._oldest_tick(now)
+        login_attempts.expire(oldest)
+        failed_attempts.expire(oldest)
+        successful_after_failures.expire(oldest)
+        
+        if is_login_attempt:
+            login_attempts.add(tick)
+            if is_failed:
+                failed_attempts.add(tick)
+            if is_success_after_failures:
+                successful_after_failures.add(tick)
     
-    def get_features(self, source_ip: str) -> dict:
+    def get_features(self, state: Optional[SourceState], now: float) -> dict:
         """Get brute force detection features"""
-        with self.lock:
-            if source_ip not in self.brute_force_tracking:
-                return self._default_features()
-            
-            data = self.brute_force_tracking[source_ip]
-            
-            login_attempts = len(data['login_attempts'])
-            failed_attempts = len(data['failed_attempts'])
-            success_after_failures = len(data['successful_after_failures'])
-            target_ports = len(data['target_ports'])
-            
-            # Brute force detection
-            is_brute_force = False
-            brute_force_score = 0.0
-            
-            # Multiple failed login attempts = brute force
-            if failed_attempts >= 10:
-                brute_force_score = min(1.0, failed_attempts / 50.0)
-                is_brute_force = True
-            elif failed_attempts >= 5 and login_attempts >= 8:
-                # High failure rate
-                failure_rate = failed_attempts / login_attempts if login_attempts > 0 else 0
-                brute_force_score = min(1.0, failure_rate * (failed_attempts / 10.0))
-                is_brute_force = brute_force_score > 0.4
-            elif success_after_failures >= 1 and failed_attempts >= 3:
-                # Successful login after multiple failures = likely compromised
-                brute_force_score = 0.9
-                is_brute_force = True
-            elif login_attempts >= 20:
-                # Many login attempts
-                brute_force_score = min(1.0, login_attempts / 100.0)
-                is_brute_force = brute_force_score > 0.3
-            
-            return {
-                'login_attempts': login_attempts,
-                'failed_attempts': failed_attempts,
-                'success_after_failures': success_after_failures,
-                'target_ports': target_ports,
-                'is_brute_force': is_brute_force,
-                'brute_force_score': brute_force_score
-            }
+        if state is None:
+            return self._default_features()
+        
+        login_attempts, failed_attempts, success_after_failures = (
+            (len(window) for window in state.logins) if state.logins is not None else (0, 0, 0)
+        )
+        target_ports = len(state.ports)
+        
+        return score_brute_force(login_attempts, failed_attempts, success_after_failures, target_ports)
     
     def _default_features(self):
         return {
@@ -604,12 +707,33 @@ class BruteForceDetector(AttackDetectorBase):
 class ComprehensiveAttackDetector:
     """Main class that coordinates all attack detectors"""
     
-    def __init__(self):
-        self.port_scan_detector = PortScanDetector(time_window_seconds=60)
-        self.dos_detector = DoSDetector(time_window_seconds=60)
-        self.r2l_detector = R2LDetector(time_window_seconds=300)
-        self.u2r_detector = U2RDetector(time_window_seconds=300)
-        self.brute_force_detector = BruteForceDetector(time_window_seconds=300)
+    def __init__(self, max_sources: int = 100000, idle_ttl: float = None, lock_stripes: int = 16,
+                 bucket_seconds: float = 1.0):
+        """
+        Args:
+            max_sources: Sources tracked at once; the least recently seen is evicted beyond this
+                (enforced per stripe, each holding max_sources / lock_stripes)
+            idle_ttl: Seconds after which an idle source is forgotten (default: the longest window)
+            lock_stripes: Independently locked source tables, chosen by address hash
+            bucket_seconds: Bucket width of every detector window
+        """
+        # The two share each source's packet window, so they must agree on its buckets
+        self.port_scan_detector = PortScanDetector(time_window_seconds=60, bucket_seconds=bucket_seconds)
+        self.dos_detector = DoSDetector(time_window_seconds=60, bucket_seconds=bucket_seconds)
+        self.r2l_detector = R2LDetector(time_window_seconds=300, bucket_seconds=bucket_seconds)
+        self.u2r_detector = U2RDetector(time_window_seconds=300, bucket_seconds=bucket_seconds)
+        self.brute_force_detector = BruteForceDetector(time_window_seconds=300, bucket_seconds=bucket_seconds)
+        # One record per source address, shared by all detectors
+        if idle_ttl is None:
+            idle_ttl = max(detector.time_window for detector in (
+                self.port_scan_detector, self.dos_detector, self.r2l_detector,
+                self.u2r_detector, self.brute_force_detector))
+        n_stripes = max(1, int(lock_stripes))
+        per_stripe = -(-max(1, int(max_sources)) // n_stripes)
+        self.stripes = [SourceTable(per_stripe, idle_ttl) for _ in range(n_stripes)]
+        self._reaper = None
+        # Replay mode: windows follow each packet's 'timestamp' instead of the wall clock
+        self.packet_clock = False
     
     def analyze_packet(self, packet: dict) -> dict:
         """
@@ -626,6 +750,9 @@ class ComprehensiveAttackDetector:
             if not isinstance(packet, dict):
                 return self._default_detection_result()
             
+            if self.packet_clock and packet.get('timestamp') is not None:
+                pin_detector_time(packet['timestamp'])  # Packets without one keep the previous time
+
             source_ip = str(packet.get('start_ip', '')).strip()
             dest_ip = str(packet.get('end_ip', '')).strip()
             protocol = str(packet.get('protocol', 'TCP')).upper()
@@ -638,9 +765,17 @@ class ComprehensiveAttackDetector:
             packet_size = max(0, min(packet_size, 65535))  # Cap at max packet size
             
             # Extract destination port from description with error handling
+            # (binary-format packets carry it directly as dest_port)
             dest_port = None
             description = str(packet.get('description', '')).strip()
-            if '->' in description:
+            if packet.get('dest_port') is not None:
+                try:
+                    dest_port = int(packet['dest_port'])
+                    if dest_port < 1 or dest_port > 65535:
+                        dest_port = None
+                except (ValueError, TypeError):
+                    dest_port = None
+            elif '->' in description:
                 try:
                     port_str = description.split('->')[1].strip().split()[0]  # Get port, remove any trailing text
                     dest_port = int(port_str)
@@ -648,62 +783,19 @@ class ComprehensiveAttackDetector:
                 except (ValueError, IndexError):
                     dest_port = None
             
-            # Add to all detectors with error handling
-            try:
-                self.port_scan_detector.add_packet(source_ip, dest_ip, dest_port, protocol)
-            except Exception as e:
-                print(f"⚠️ Error in port_scan_detector.add_packet: {e}")
-            
-            try:
-                self.dos_detector.add_packet(source_ip, dest_ip, packet_size, protocol)
-            except Exception as e:
-                print(f"⚠️ Error in dos_detector.add_packet: {e}")
-            
             # Check if this looks like a login attempt (common ports: 22 SSH, 23 Telnet, 80/443 HTTP/HTTPS, 3306 MySQL, 5432 PostgreSQL)
             is_login_attempt = dest_port in [22, 23, 80, 443, 3306, 5432, 3389, 5900] if dest_port else False
             # For brute force, we'll track failed login attempts from the packet description or status
             is_failed = 'failed' in description.lower() or 'denied' in description.lower() or 'refused' in description.lower()
+            is_failed = is_failed or bool(packet.get('login_failed', False))
+            # Connection attempt: SYN without ACK (binary-format and replayed packets carry tcp_flags)
+            tcp_flags = packet.get('tcp_flags')
+            is_syn = protocol == 'TCP' and tcp_flags is not None and (int(tcp_flags) & 0x12) == 0x02
             
-            try:
-                self.brute_force_detector.add_packet(
-                    source_ip=source_ip,
-                    dest_port=dest_port,
-                    is_login_attempt=is_login_attempt,
-                    is_failed=is_failed
-                )
-            except Exception as e:
-                print(f"⚠️ Error in brute_force_detector.add_packet: {e}")
-            
-            # Get features from all detectors with error handling
-            try:
-                port_scan_features = self.port_scan_detector.get_features(source_ip)
-            except Exception as e:
-                print(f"⚠️ Error in port_scan_detector.get_features: {e}")
-                port_scan_features = self.port_scan_detector._default_features()
-            
-            try:
-                dos_features = self.dos_detector.get_features(source_ip)
-            except Exception as e:
-                print(f"⚠️ Error in dos_detector.get_features: {e}")
-                dos_features = self.dos_detector._default_features()
-            
-            try:
-                r2l_features = self.r2l_detector.get_features(source_ip)
-            except Exception as e:
-                print(f"⚠️ Error in r2l_detector.get_features: {e}")
-                r2l_features = self.r2l_detector._default_features()
-            
-            try:
-                u2r_features = self.u2r_detector.get_features(source_ip)
-            except Exception as e:
-                print(f"⚠️ Error in u2r_detector.get_features: {e}")
-                u2r_features = self.u2r_detector._default_features()
-            
-            try:
-                brute_force_features = self.brute_force_detector.get_features(source_ip)
-            except Exception as e:
-                print(f"⚠️ Error in brute_force_detector.get_features: {e}")
-                brute_force_features = self.brute_force_detector._default_features()
+            (port_scan_features, dos_features, r2l_features,
+             u2r_features, brute_force_features) = self._update_and_get_features(
+                source_ip, dest_ip, dest_port, packet_size, protocol, is_login_attempt, is_failed, is_syn
+            )
             
             # Safely extract scores with defaults
             try:
@@ -721,7 +813,7 @@ class ComprehensiveAttackDetector:
                     if not isinstance(value, (int, float)) or (isinstance(value, float) and (math.isnan(value) or math.isinf(value))):
                         attack_scores[key] = 0.0
             except Exception as e:
-                print(f"⚠️ Error calculating attack_scores: {e}")
+                log.warning("⚠️ Error calculating attack_scores: %s", e)
                 attack_scores = {'probe': 0.0, 'dos': 0.0, 'r2l': 0.0, 'u2r': 0.0, 'brute_force': 0.0, 'normal': 0.0}
             
             # Find highest scoring attack
@@ -731,7 +823,7 @@ class ComprehensiveAttackDetector:
                 confidence = float(max_attack[1])
                 confidence = max(0.0, min(1.0, confidence))  # Clamp to [0, 1]
             except Exception as e:
-                print(f"⚠️ Error finding max attack: {e}")
+                log.warning("⚠️ Error finding max attack: %s", e)
                 attack_type = 'normal'
                 confidence = 0.0
             
@@ -747,7 +839,7 @@ class ComprehensiveAttackDetector:
                     attack_type != 'normal'
                 )
             except Exception as e:
-                print(f"⚠️ Error determining is_malicious: {e}")
+                log.warning("⚠️ Error determining is_malicious: %s", e)
                 is_malicious = attack_type != 'normal'
             
             # If malicious but type is unclear, use "unknown_attack"
@@ -759,7 +851,7 @@ class ComprehensiveAttackDetector:
                     confidence = float(max(non_zero_scores)) if non_zero_scores else 0.5
                     confidence = max(0.0, min(1.0, confidence))  # Clamp to [0, 1]
                 except Exception as e:
-                    print(f"⚠️ Error calculating unknown_attack confidence: {e}")
+                    log.warning("⚠️ Error calculating unknown_attack confidence: %s", e)
                     confidence = 0.5
             
             return {
@@ -774,11 +866,133 @@ class ComprehensiveAttackDetector:
                 'all_scores': attack_scores
             }
         except Exception as e:
-            print(f"❌ CRITICAL ERROR in analyze_packet: {e}")
-            import traceback
-            traceback.print_exc()
+            log.exception("❌ CRITICAL ERROR in analyze_packet: %s", e)
             return self._default_detection_result()
     
+    def _update_and_get_features(self, source_ip: str, dest_ip: str, dest_port, packet_size: int,
+                                 protocol: str, is_login_attempt: bool, is_failed: bool, is_syn: bool = False):
+        """
+        Record one packet for its source and read back every detector's features.
+        
+        Returns:
+            (port_scan_features, dos_features, r2l_features, u2r_features, brute_force_features)
+        """
+        now = detector_now()
+        sources = self.source_table(source_ip)
+        sources.acquire()
+        try:
+            state = sources.touch(source_ip, now)
+            
+            # Add to all detectors with error handling
+            try:
+                self.dos_detector.add_packet(state, now, dest_ip, packet_size, is_syn)
+            except Exception as e:
+                log.warning("⚠️ Error in dos_detector.add_packet: %s", e)
+            
+            try:
+                self.port_scan_detector.add_packet(state, now, dest_ip, dest_port)
+            except Exception as e:
+                log.warning("⚠️ Error in port_scan_detector.add_packet: %s", e)
+            
+            try:
+                self.brute_force_detector.add_packet(
+                    state, now,
+                    is_login_attempt=is_login_attempt,
+                    is_failed=is_failed
+                )
+            except Exception as e:
+                log.warning("⚠️ Error in brute_force_detector.add_packet: %s", e)
+            
+            # Get features from all detectors with error handling
+            try:
+                port_scan_features = self.port_scan_detector.get_features(state, now)
+            except Exception as e:
+                log.warning("⚠️ Error in port_scan_detector.get_features: %s", e)
+                port_scan_features = self.port_scan_detector._default_features()
+            
+            try:
+                dos_features = self.dos_detector.get_features(state, now)
+            except Exception as e:
+                log.warning("⚠️ Error in dos_detector.get_features: %s", e)
+                dos_features = self.dos_detector._default_features()
+            
+            try:
+                r2l_features = self.r2l_detector.get_features(state, now)
+            except Exception as e:
+                log.warning("⚠️ Error in r2l_detector.get_features: %s", e)
+                r2l_features = self.r2l_detector._default_features()
+            
+            try:
+                u2r_features = self.u2r_detector.get_features(state, now)
+            except Exception as e:
+                log.warning("⚠️ Error in u2r_detector.get_features: %s", e)
+                u2r_features = self.u2r_detector._default_features()
+            
+            try:
+                brute_force_features = self.brute_force_detector.get_features(state, now)
+            except Exception as e:
+                log.warning("⚠️ Error in brute_force_detector.get_features: %s", e)
+                brute_force_features = self.brute_force_detector._default_features()
+        finally:
+            sources.lock.release()
+        
+        return port_scan_features, dos_features, r2l_features, u2r_features, brute_force_features
+    
+    def source_table(self, source_ip: str) -> SourceTable:
+        """The stripe holding a source's record"""
+        return self.stripes[hash(source_ip) % len(self.stripes)]
+
+    def tracked_sources(self) -> dict:
+        """Number of source IPs with a state record (shared by all detectors)"""
+        return {'all': sum(len(stripe) for stripe in self.stripes)}
+
+    def evictions(self) -> dict:
+        """Sources forgotten so far: reaped when idle / evicted at max_sources"""
+        return {reason: sum(stripe.evicted[reason] for stripe in self.stripes) for reason in ('idle', 'capacity')}
+
+    def lock_contention(self) -> dict:
+        """Stripe lock acquisitions that had to wait, and the seconds spent waiting"""
+        return {
+            'contended': sum(stripe.contended for stripe in self.stripes),
+            'wait_seconds': sum(stripe.wait_seconds for stripe in self.stripes)
+        }
+
+    def start_reaper(self, interval: float = 10.0):
+        """
+        Reap idle sources every interval seconds in a daemon thread. The thread is
+        restarted in forked children (threads do not survive fork), and the stripe locks
+        are held across fork so a child never inherits one locked.
+        """
+        if interval <= 0 or self._reaper is not None:
+            return
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    now = detector_now()
+                    for stripe in self.stripes:
+                        stripe.reap(now)
+                except Exception as e:
+                    log.warning("⚠️ Error reaping idle sources: %s", e)
+
+        def start():
+            self._reaper = threading.Thread(target=run, name='detector-reaper', daemon=True)
+            self._reaper.start()
+
+        def lock_all():
+            for stripe in self.stripes:
+                stripe.lock.acquire()
+
+        def release_all():
+            for stripe in self.stripes:
+                stripe.lock.release()
+
+        start()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(before=lock_all, after_in_parent=release_all,
+                                after_in_child=lambda: (release_all(), start()))
+
     def _default_detection_result(self) -> dict:
         """Return a safe default detection result when errors occur"""
         return {
@@ -794,6 +1008,32 @@ class ComprehensiveAttackDetector:
         }
 
 
+def create_detector() -> ComprehensiveAttackDetector:
+    """
+    Detector selected by DETECTOR_BACKEND: 'memory' (per-process state, default) or
+    'shared' (windows in shared memory, see shared_state.py)
+    """
+    backend = os.getenv('DETECTOR_BACKEND', 'memory').lower()
+    bounds = {'max_sources': int(os.getenv('DETECTOR_MAX_SOURCES', '100000')),
+              'lock_stripes': int(os.getenv('DETECTOR_LOCK_STRIPES', '16')),
+              'bucket_seconds': float(os.getenv('DETECTOR_BUCKET_SECONDS', '1'))}
+    if os.getenv('DETECTOR_IDLE_TTL'):
+        bounds['idle_ttl'] = float(os.getenv('DETECTOR_IDLE_TTL'))
+    detector = None
+    if backend == 'shared':
+        try:
+            from shared_state import SharedMemoryAttackDetector
+            detector = SharedMemoryAttackDetector.from_env(**bounds)
+        except Exception as e:
+            log.warning("⚠️ Shared detector state unavailable, using per-process state: %s", e)
+    elif backend != 'memory':
+        log.warning("⚠️ Unknown DETECTOR_BACKEND '%s', using per-process state", backend)
+    if detector is None:
+        detector = ComprehensiveAttackDetector(**bounds)
+    detector.start_reaper(float(os.getenv('DETECTOR_REAP_INTERVAL', '10')))
+    return detector
+
+
 # Global instance
-comprehensive_detector = ComprehensiveAttackDetector()
+comprehensive_detector = create_detector()
 
@@ -0,0 +1,305 @@
+"""
+Compiled Random Forest Evaluator
+Flattens fitted sklearn tree ensembles into contiguous NumPy node arrays and
+evaluates every tree of the forest level by level for a whole batch of rows,
+without going through sklearn's per-call validation and joblib dispatch.
+
+A compiled forest can be saved as an uncompressed joblib artifact next to its model
+file (model.pkl -> model.compiled.joblib). Loading it memory-maps the node arrays, so
+it needs neither sklearn nor a copy of the arrays per process: every worker reads the
+same page-cache pages. The artifact records a digest of the model file it was compiled
+from (source_digest), so a replaced model file is detected whatever its mtime.
+
+Usage:
+    python3 compiled_forest.py                  # verify + benchmark the default model files
+    python3 compiled_forest.py model_a.pkl ...  # verify + benchmark specific model files
+    python3 compiled_forest.py --export [...]   # also write the memory-mappable artifacts
+"""
+import hashlib
+import os
+import sys
+import time
+from typing import List, Optional
+
+import numpy as np
+
+# Rows evaluated per block; bounds the (rows x trees) index matrices
+BLOCK_ROWS = 4096
+
+ARTIFACT_SUFFIX = '.compiled.joblib'
+_ARRAY_FIELDS = ('feature', 'threshold', 'children_left', 'children_right', 'leaf_index', 'leaf_value', 'roots')
+
+
+def artifact_path(model_path: str) -> str:
+    """Compiled artifact belonging to a model file"""
+    return os.path.splitext(model_path)[0] + ARTIFACT_SUFFIX
+
+
+def file_digest(path: str) -> str:
+    """blake2b digest of a file's content"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CompiledForest:
+    """
+    Flat-array form of a fitted tree classifier ensemble.
+
+    All trees are stored back to back in the same node arrays. Child indices are
+    global, and leaves point at themselves, so a traversal step is the same
+    branch-free gather for every (row, tree) pair. Descending max_depth levels
+    therefore lands every pair on its leaf.
+    """
+
+    def __init__(self, feature, threshold, children_left, children_right, leaf_index,
+                 leaf_value, roots, max_depth, classes, n_features_in, feature_names_in=None):
+        self.feature = feature                  # int32 (n_nodes,), 0 for leaves
+        self.threshold = threshold              # float64 (n_nodes,), +inf for leaves
+        self.children_left = children_left      # int32 (n_nodes,), self for leaves
+        self.children_right = children_right    # int32 (n_nodes,), self for leaves
+        self.leaf_index = leaf_index            # int32 (n_nodes,), row in leaf_value, -1 for splits
+        self.leaf_value = leaf_value            # float64 (n_leaves, n_classes), normalized per leaf
+        self.roots = roots                      # int32 (n_trees,)
+        self.max_depth = int(max_depth)
+        self.classes_ = classes
+        self.n_classes_ = len(classes)
+        self.n_features_in_ = int(n_features_in)
+        if feature_names_in is not None:
+            self.feature_names_in_ = feature_names_in
+        self.source_digest: Optional[str] = None  # file_digest() of the model file compiled from
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.feature)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in _ARRAY_FIELDS)
+
+    def save(self, path: str):
+        """
+        Write an uncompressed joblib artifact (compressed files cannot be memory-mapped).
+        The file is replaced atomically: processes mapping the old one keep reading it.
+        """
+        import joblib
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            joblib.dump(self, tmp_path, compress=0)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = 'r') -> 'CompiledForest':
+        """
+        Load an artifact written by save(). With mmap_mode='r' the node arrays are read-only
+        views of the file's page cache, shared by every process that maps it.
+
+        Raises:
+            ValueError: If the file does not hold a CompiledForest
+        """
+        import joblib
+        compiled = joblib.load(path, mmap_mode=mmap_mode)
+        if not isinstance(compiled, cls):
+            raise ValueError(f"{path} does not contain a CompiledForest")
+        # Plain ndarray views of the maps: indexing np.memmap would wrap every result
+        for name in _ARRAY_FIELDS:
+            setattr(compiled, name, np.asarray(getattr(compiled, name)))
+        return compiled
+
+    @classmethod
+    def from_sklearn(cls, model) -> 'CompiledForest':
+        """
+        Compile a fitted RandomForestClassifier / ExtraTreesClassifier / DecisionTreeClassifier.
+
+        Raises:
+            ValueError: If the model is not a fitted single-output tree classifier
+        """
+        estimators = getattr(model, 'estimators_', None)
+        if estimators is None:
+            estimators = [model]
+        if not estimators or not all(hasattr(est, 'tree_') for est in estimators):
+            raise ValueError(f"Cannot compile {type(model).__name__}: not a fitted tree ensemble")
+        if getattr(model, 'n_outputs_', 1) != 1:
+            raise ValueError("Only single-output classifiers can be compiled")
+
+        features, thresholds, lefts, rights, leaf_indexes, leaf_values, roots = [], [], [], [], [], [], []
+        offset = 0
+        n_leaves = 0
+        max_depth = 0
+        for est in estimators:
+            tree = est.tree_
+            n = tree.node_count
+            node_ids = np.arange(n, dtype=np.int64)
+            is_leaf = tree.children_left == -1
+
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, node_ids, tree.children_right) + offset)
+
+            leaf_rows = np.full(n, -1, dtype=np.int64)
+            leaf_rows[is_leaf] = np.arange(n_leaves, n_leaves + int(is_leaf.sum()))
+            leaf_indexes.append(leaf_rows)
+
+            # Same normalization as DecisionTreeClassifier.predict_proba
+            value = tree.value[is_leaf, 0, :].astype(np.float64)
+            normalizer = value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            leaf_values.append(value / normalizer)
+
+            roots.append(offset)
+            offset += n
+            n_leaves += int(is_leaf.sum())
+            max_depth = max(max_depth, tree.max_depth)
+
+        if offset >= np.iinfo(np.int32).max:
+            raise ValueError("Forest too large to compile with 32-bit node indices")
+
+        return cls(
+            feature=np.ascontiguousarray(np.concatenate(features), dtype=np.int32),
+            threshold=np.ascontiguousarray(np.concatenate(thresholds), dtype=np.float64),
+            children_left=np.ascontiguousarray(np.concatenate(lefts), dtype=np.int32),
+            children_right=np.ascontiguousarray(np.concatenate(rights), dtype=np.int32),
+            leaf_index=np.ascontiguousarray(np.concatenate(leaf_indexes), dtype=np.int32),
+            leaf_value=np.ascontiguousarray(np.vstack(leaf_values), dtype=np.float64),
+            roots=np.asarray(roots, dtype=np.int32),
+            max_depth=max_depth,
+            classes=np.asarray(model.classes_),
+            n_features_in=model.n_features_in_,
+            feature_names_in=getattr(model, 'feature_names_in_', None)
+        )
+
+    def predict_proba(self, X) -> np.ndarray:
+        """
+        Class probabilities averaged over all trees, like RandomForestClassifier.predict_proba.
+
+        Args:
+            X: Array-like of shape (n_rows, n_features_in_)
+        """
+        # Trees compare float32 feature values against float64 thresholds, exactly as sklearn does
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected {self.n_features_in_} features, got shape {X.shape}")
+
+        proba = np.empty((len(X), self.n_classes_), dtype=np.float64)
+        for start in range(0, len(X), BLOCK_ROWS):
+            block = X[start:start + BLOCK_ROWS]
+            proba[start:start + len(block)] = self._evaluate(block)
+        return proba
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+    def _evaluate(self, X: np.ndarray) -> np.ndarray:
+        n = len(X)
+        flat_X = X.ravel()
+        # Offset of each row's first feature, broadcast across trees
+        row_base = (np.arange(n, dtype=np.int64) * X.shape[1])[:, None]
+        node = np.broadcast_to(self.roots, (n, self.n_trees)).copy()
+
+        for _ in range(self.max_depth):
+            go_left = flat_X[row_base + self.feature[node]] <= self.threshold[node]
+            next_node = np.where(go_left, self.children_left[node], self.children_right[node])
+            if np.array_equal(next_node, node):
+                break  # Every (row, tree) pair already sits on a leaf
+            node = next_node
+
+        # Sum the per-tree leaf distributions, then average over trees
+        return self.leaf_value[self.leaf_index[node]].sum(axis=1) / self.n_trees
+
+
+def compile_forest(model, verify_rows: int = 256, atol: float = 1e-9,
+                   X_check: Optional[np.ndarray] = None) -> CompiledForest:
+    """
+    Compile a fitted forest and check it reproduces sklearn's predict_proba.
+
+    Args:
+        model: Fitted sklearn tree classifier ensemble
+        verify_rows: Number of synthetic rows to compare on when X_check is not given
+        atol: Maximum allowed absolute difference between probabilities
+        X_check: Optional rows to compare on (e.g. real feature rows)
+
+    Raises:
+        ValueError: If the compiled forest disagrees with sklearn
+    """
+    compiled = CompiledForest.from_sklearn(model)
+    if X_check is None:
+        X_check = synthetic_rows(model, verify_rows)
+    max_diff = max_abs_difference(model, compiled, X_check)
+    if max_diff > atol:
+        raise ValueError(f"Compiled forest differs from sklearn by {max_diff:.3g} (tolerance {atol:.3g})")
+    return compiled
+
+
+def synthetic_rows(model, n_rows: int, seed: int = 0) -> np.ndarray:
+    """
+    Rows that exercise many paths: each feature is sampled around the model's own split thresholds.
+    """
+    compiled = model if isinstance(model, CompiledForest) else CompiledForest.from_sklearn(model)
+    rng = np.random.default_rng(seed)
+    X = np.zeros((n_rows, compiled.n_features_in_), dtype=np.float32)
+    is_split = compiled.leaf_index == -1
+    split_features = compiled.feature[is_split]
+    split_thresholds = compiled.threshold[is_split]
+    for column in range(compiled.n_features_in_):
+        candidates = split_thresholds[split_features == column]
+        if len(candidates) == 0:
+            continue
+        picks = rng.choice(candidates, size=n_rows)
+        # Land on either side of a threshold, sometimes exactly on it
+        X[:, column] = picks + rng.choice([-1.0, 0.0, 1.0], size=n_rows) * rng.uniform(0, 1, size=n_rows)
+    return X
+
+
+def max_abs_difference(model, compiled: CompiledForest, X: np.ndarray) -> float:
+    expected = model.predict_proba(X)
+    actual = compiled.predict_proba(X)
+    return float(np.max(np.abs(expected - actual))) if len(X) else 0.0
+
+
+def _benchmark(predict_proba, X: np.ndarray, repeats: int = 200) -> float:
+    """Median seconds per call of predict_proba on single rows of X"""
+    timings = []
+    for i in range(repeats):
+        row = X[i % len(X):i % len(X) + 1]
+        start = time.perf_counter()
+        predict_proba(row)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def main(paths: List[str], export: bool = False):
+    from inference_engine import load_model
+
+    for path in paths:
+        print(f"\n🌲 {path}")
+        model = load_model(path)
+        compiled = CompiledForest.from_sklearn(model)
+        X = synthetic_rows(compiled, 2000)
+        max_diff = max_abs_difference(model, compiled, X)
+        status = "✅ equivalent" if max_diff <= 1e-9 else "❌ MISMATCH"
+        print(f"   {compiled.n_trees} trees, {compiled.n_nodes} nodes, max depth {compiled.max_depth}, "
+              f"{compiled.nbytes / 1e6:.1f} MB")
+        print(f"   max |sklearn - compiled| = {max_diff:.3g} over {len(X)} rows: {status}")
+        sklearn_s = _benchmark(model.predict_proba, X)
+        compiled_s = _benchmark(compiled.predict_proba, X)
+        print(f"   single-row predict_proba: sklearn {sklearn_s * 1e3:.3f} ms, "
+              f"compiled {compiled_s * 1e3:.3f} ms ({sklearn_s / compiled_s:.1f}x)")
+        if export and max_diff <= 1e-9:
+            compiled.source_digest = file_digest(path)
+            compiled.save(artifact_path(path))
+            print(f"   💾 Saved {artifact_path(path)}")
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--export']
+    main(args or ['binary_attack_model.pkl', 'multiclass_attack_model.pkl'], export='--export' in sys.argv[1:])
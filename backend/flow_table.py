@@ -0,0 +1,435 @@
+"""
+Bidirectional Flow Table
+Tracks packets per bidirectional 5-tuple flow and keeps CIC-IDS style running
+statistics for each flow, so the feature row of a packet describes the flow it belongs
+to instead of copies of its own byte counts.
+
+Every statistic is updated in O(1) per packet (Welford mean / variance, min / max,
+totals); no per-flow packet lists are kept. Flows live in an OrderedDict in
+least-recently-seen order, which makes LRU eviction (max_flows) and idle expiry
+(idle_timeout) O(1) amortized per packet. A flow older than active_timeout, or one
+that saw a TCP FIN or RST, is closed and the next packet of its 5-tuple starts a new
+flow (as CICFlowMeter does).
+
+Units follow CIC-IDS2017: durations and inter-arrival times in microseconds, rates per
+second, lengths in bytes. Bulk features are not computed (they stay 0).
+
+Packet fields used (all optional except start_ip / end_ip / protocol):
+    src_port, dest_port   ports (otherwise parsed from 'TCP 40000 -> 443' descriptions)
+    timestamp             capture time in epoch seconds (otherwise the arrival time)
+    tcp_flags             TCP flag bits (FIN 0x01, SYN 0x02, RST 0x04, PSH 0x08, ACK 0x10, URG 0x20, ECE 0x40, CWR 0x80)
+    tcp_window            TCP window of the packet
+    header_length         transport header bytes (otherwise 20 for TCP, 8 for UDP / ICMP)
+    start_bytes           captured packet length
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from packet_features import FEATURE_INDEX
+
+FIN, SYN, RST, PSH, ACK, URG, ECE, CWR = 0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, 0x80
+
+LINK_AND_IP_HEADER = 34        # Ethernet + IPv4 header bytes included in captured lengths
+DEFAULT_HEADER_LENGTH = {'TCP': 20, 'UDP': 8, 'ICMP': 8}
+ACTIVITY_TIMEOUT = 5.0         # seconds of silence that end an active period (CICFlowMeter)
+SUBFLOW_GAP = 1.0              # seconds of silence that start a new subflow (CICFlowMeter)
+
+
+def _ports(packet: Dict[str, Any]) -> Tuple[int, int]:
+    """(source port, destination port), 0 where unknown"""
+    src_port = packet.get('src_port')
+    dst_port = packet.get('dest_port')
+    if src_port is None or dst_port is None:
+        description = str(packet.get('description', ''))
+        if '->' in description:
+            left, right = description.split('->', 1)
+            try:
+                src_port = src_port if src_port is not None else int(left.split()[-1])
+            except (ValueError, IndexError):
+                pass
+            try:
+                dst_port = dst_port if dst_port is not None else int(right.split()[0])
+            except (ValueError, IndexError):
+                pass
+    try:
+        src_port = int(src_port or 0)
+    except (ValueError, TypeError):
+        src_port = 0
+    try:
+        dst_port = int(dst_port or 0)
+    except (ValueError, TypeError):
+        dst_port = 0
+    return src_port, dst_port
+
+
+class Flow:
+    """Running statistics of one bidirectional flow; forward is the direction of its first packet"""
+
+    __slots__ = (
+        'src_ip', 'src_port', 'dst_port', 'first_seen', 'last_seen', 'last_fwd', 'last_bwd',
+        # Packet lengths: all packets, forward, backward (count, mean, M2, min, max, total)
+        'n', 'len_mean', 'len_m2', 'len_min', 'len_max',
+        'fwd_n', 'fwd_mean', 'fwd_m2', 'fwd_min', 'fwd_max', 'fwd_bytes',
+        'bwd_n', 'bwd_mean', 'bwd_m2', 'bwd_min', 'bwd_max', 'bwd_bytes',
+        # Inter-arrival times in microseconds: flow, forward, backward
+        'iat_mean', 'iat_m2', 'iat_min', 'iat_max',
+        'fwd_iat_mean', 'fwd_iat_m2', 'fwd_iat_min', 'fwd_iat_max', 'fwd_iat_total',
+        'bwd_iat_mean', 'bwd_iat_m2', 'bwd_iat_min', 'bwd_iat_max', 'bwd_iat_total',
+        # Active / idle periods in microseconds
+        'active_start', 'active_n', 'active_mean', 'active_m2', 'active_min', 'active_max',
+        'idle_n', 'idle_mean', 'idle_m2', 'idle_min', 'idle_max',
+        # Flags and headers
+        'fin', 'syn', 'rst', 'psh', 'ack', 'urg', 'cwr', 'ece',
+        'fwd_psh', 'bwd_psh', 'fwd_urg', 'bwd_urg',
+        'fwd_header', 'bwd_header', 'min_seg_fwd', 'init_win_fwd', 'init_win_bwd',
+        'act_data_fwd', 'subflows', 'closed',
+    )
+    _columns = None  # Row indices of the written features, in write_features order
+
+    def __init__(self, src_ip: str, src_port: int, dst_port: int, now: float):
+        self.src_ip = src_ip
+        self.src_port = src_port
+        self.dst_port = dst_port
+        self.first_seen = self.last_seen = self.active_start = now
+        self.last_fwd = self.last_bwd = None
+        self.n = self.fwd_n = self.bwd_n = 0
+        self.len_mean = self.len_m2 = self.fwd_mean = self.fwd_m2 = self.bwd_mean = self.bwd_m2 = 0.0
+        self.len_min = self.fwd_min = self.bwd_min = math.inf
+        self.len_max = self.fwd_max = self.bwd_max = 0.0
+        self.fwd_bytes = self.bwd_bytes = 0.0
+        self.iat_mean = self.iat_m2 = self.iat_max = 0.0
+        self.fwd_iat_mean = self.fwd_iat_m2 = self.fwd_iat_max = self.fwd_iat_total = 0.0
+        self.bwd_iat_mean = self.bwd_iat_m2 = self.bwd_iat_max = self.bwd_iat_total = 0.0
+        self.iat_min = self.fwd_iat_min = self.bwd_iat_min = math.inf
+        self.active_n = self.idle_n = 0
+        self.active_mean = self.active_m2 = self.active_max = 0.0
+        self.idle_mean = self.idle_m2 = self.idle_max = 0.0
+        self.active_min = self.idle_min = math.inf
+        self.fin = self.syn = self.rst = self.psh = self.ack = self.urg = self.cwr = self.ece = 0
+        self.fwd_psh = self.bwd_psh = self.fwd_urg = self.bwd_urg = 0
+        self.fwd_header = self.bwd_header = 0
+        self.min_seg_fwd = math.inf
+        self.init_win_fwd = self.init_win_bwd = None
+        self.act_data_fwd = 0
+        self.subflows = 1
+        self.closed = False
+
+    def add(self, forward: bool, now: float, length: float, header_length: int, flags: int,
+            window: Optional[int]):
+        """Account one packet of this flow (O(1))"""
+        gap = now - self.last_seen
+        if self.n:
+            # Flow inter-arrival time, active / idle periods and subflows
+            iat = gap * 1e6
+            k = self.n  # IATs so far + 1
+            delta = iat - self.iat_mean
+            self.iat_mean += delta / k
+            self.iat_m2 += delta * (iat - self.iat_mean)
+            if iat < self.iat_min:
+                self.iat_min = iat
+            if iat > self.iat_max:
+                self.iat_max = iat
+            if gap > ACTIVITY_TIMEOUT:
+                self._period('active', (self.last_seen - self.active_start) * 1e6)
+                self._period('idle', iat)
+                self.active_start = now
+            if gap > SUBFLOW_GAP:
+                self.subflows += 1
+
+        self.n += 1
+        delta = length - self.len_mean
+        self.len_mean += delta / self.n
+        self.len_m2 += delta * (length - self.len_mean)
+        if length < self.len_min:
+            self.len_min = length
+        if length > self.len_max:
+            self.len_max = length
+
+        if forward:
+            if self.last_fwd is not None:
+                iat = (now - self.last_fwd) * 1e6
+                k = self.fwd_n  # Forward IATs so far + 1
+                delta = iat - self.fwd_iat_mean
+                self.fwd_iat_mean += delta / k
+                self.fwd_iat_m2 += delta * (iat - self.fwd_iat_mean)
+                self.fwd_iat_total += iat
+                if iat < self.fwd_iat_min:
+                    self.fwd_iat_min = iat
+                if iat > self.fwd_iat_max:
+                    self.fwd_iat_max = iat
+            self.last_fwd = now
+            self.fwd_n += 1
+            delta = length - self.fwd_mean
+            self.fwd_mean += delta / self.fwd_n
+            self.fwd_m2 += delta * (length - self.fwd_mean)
+            if length < self.fwd_min:
+                self.fwd_min = length
+            if length > self.fwd_max:
+                self.fwd_max = length
+            self.fwd_bytes += length
+            self.fwd_header += header_length
+            if header_length < self.min_seg_fwd:
+                self.min_seg_fwd = header_length
+            if length - LINK_AND_IP_HEADER - header_length >= 1:
+                self.act_data_fwd += 1
+            if self.init_win_fwd is None and window is not None:
+                self.init_win_fwd = window
+            if flags & PSH:
+                self.fwd_psh += 1
+            if flags & URG:
+                self.fwd_urg += 1
+        else:
+            if self.last_bwd is not None:
+                iat = (now - self.last_bwd) * 1e6
+                k = self.bwd_n
+                delta = iat - self.bwd_iat_mean
+                self.bwd_iat_mean += delta / k
+                self.bwd_iat_m2 += delta * (iat - self.bwd_iat_mean)
+                self.bwd_iat_total += iat
+                if iat < self.bwd_iat_min:
+                    self.bwd_iat_min = iat
+                if iat > self.bwd_iat_max:
+                    self.bwd_iat_max = iat
+            self.last_bwd = now
+            self.bwd_n += 1
+            delta = length - self.bwd_mean
+            self.bwd_mean += delta / self.bwd_n
+            self.bwd_m2 += delta * (length - self.bwd_mean)
+            if length < self.bwd_min:
+                self.bwd_min = length
+            if length > self.bwd_max:
+                self.bwd_max = length
+            self.bwd_bytes += length
+            self.bwd_header += header_length
+            if self.init_win_bwd is None and window is not None:
+                self.init_win_bwd = window
+            if flags & PSH:
+                self.bwd_psh += 1
+            if flags & URG:
+                self.bwd_urg += 1
+
+        if flags:
+            self.fin += bool(flags & FIN)
+            self.syn += bool(flags & SYN)
+            self.rst += bool(flags & RST)
+            self.psh += bool(flags & PSH)
+            self.ack += bool(flags & ACK)
+            self.urg += bool(flags & URG)
+            self.ece += bool(flags & ECE)
+            self.cwr += bool(flags & CWR)
+            if flags & (FIN | RST):
+                self.closed = True
+        self.last_seen = now
+
+    def _period(self, kind: str, value: float):
+        """Welford update of the active or idle period statistics"""
+        n = getattr(self, kind + '_n') + 1
+        mean = getattr(self, kind + '_mean')
+        delta = value - mean
+        mean += delta / n
+        setattr(self, kind + '_n', n)
+        setattr(self, kind + '_mean', mean)
+        setattr(self, kind + '_m2', getattr(self, kind + '_m2') + delta * (value - mean))
+        setattr(self, kind + '_min', min(getattr(self, kind + '_min'), value))
+        setattr(self, kind + '_max', max(getattr(self, kind + '_max'), value))
+
+    def write_features(self, out: np.ndarray):
+        """Write this flow's CIC-style columns into a FEATURE_NAMES-ordered row"""
+        duration = (self.last_seen - self.first_seen) * 1e6
+        seconds = duration / 1e6
+        fwd_std = math.sqrt(self.fwd_m2 / (self.fwd_n - 1)) if self.fwd_n > 1 else 0.0
+        bwd_std = math.sqrt(self.bwd_m2 / (self.bwd_n - 1)) if self.bwd_n > 1 else 0.0
+        len_var = self.len_m2 / (self.n - 1) if self.n > 1 else 0.0
+        n_iat = self.n - 1
+        n_fwd_iat = self.fwd_n - 1
+        n_bwd_iat = self.bwd_n - 1
+        # The current active period counts as one more period
+        active = (self.last_seen - self.active_start) * 1e6
+        active_n = self.active_n + 1
+        active_delta = active - self.active_mean
+        active_mean = self.active_mean + active_delta / active_n
+        active_m2 = self.active_m2 + active_delta * (active - active_mean)
+
+        values = {
+            'Destination Port': self.dst_port,
+            'Flow Duration': duration,
+            'Total Fwd Packets': self.fwd_n,
+            'Total Backward Packets': self.bwd_n,
+            'Total Length of Fwd Packets': self.fwd_bytes,
+            'Total Length of Bwd Packets': self.bwd_bytes,
+            'Fwd Packet Length Max': self.fwd_max,
+            'Fwd Packet Length Min': self.fwd_min if self.fwd_n else 0.0,
+            'Fwd Packet Length Mean': self.fwd_mean,
+            'Fwd Packet Length Std': fwd_std,
+            'Bwd Packet Length Max': self.bwd_max,
+            'Bwd Packet Length Min': self.bwd_min if self.bwd_n else 0.0,
+            'Bwd Packet Length Mean': self.bwd_mean,
+            'Bwd Packet Length Std': bwd_std,
+            'Flow Packets/s': self.n / seconds if seconds > 0 else 0.0,
+            'Flow IAT Mean': self.iat_mean,
+            'Flow IAT Std': math.sqrt(self.iat_m2 / (n_iat - 1)) if n_iat > 1 else 0.0,
+            'Flow IAT Max': self.iat_max,
+            'Flow IAT Min': self.iat_min if n_iat else 0.0,
+            'Fwd IAT Total': self.fwd_iat_total,
+            'Fwd IAT Mean': self.fwd_iat_mean,
+            'Fwd IAT Std': math.sqrt(self.fwd_iat_m2 / (n_fwd_iat - 1)) if n_fwd_iat > 1 else 0.0,
+            'Fwd IAT Max': self.fwd_iat_max,
+            'Fwd IAT Min': self.fwd_iat_min if n_fwd_iat > 0 else 0.0,
+            'Bwd IAT Total': self.bwd_iat_total,
+            'Bwd IAT Mean': self.bwd_iat_mean,
+            'Bwd IAT Std': math.sqrt(self.bwd_iat_m2 / (n_bwd_iat - 1)) if n_bwd_iat > 1 else 0.0,
+            'Bwd IAT Max': self.bwd_iat_max,
+            'Bwd IAT Min': self.bwd_iat_min if n_bwd_iat > 0 else 0.0,
+            'Fwd PSH Flags': self.fwd_psh,
+            'Bwd PSH Flags': self.bwd_psh,
+            'Fwd URG Flags': self.fwd_urg,
+            'Bwd URG Flags': self.bwd_urg,
+            'Fwd Header Length': self.fwd_header,
+            'Bwd Header Length': self.bwd_header,
+            'Fwd Packets/s': self.fwd_n / seconds if seconds > 0 else 0.0,
+            'Bwd Packets/s': self.bwd_n / seconds if seconds > 0 else 0.0,
+            'Min Packet Length': self.len_min if self.n else 0.0,
+            'Max Packet Length': self.len_max,
+            'Packet Length Mean': self.len_mean,
+            'Packet Length Std': math.sqrt(len_var),
+            'Packet Length Variance': len_var,
+            'FIN Flag Count': self.fin,
+            'SYN Flag Count': self.syn,
+            'RST Flag Count': self.rst,
+            'PSH Flag Count': self.psh,
+            'ACK Flag Count': self.ack,
+            'URG Flag Count': self.urg,
+            'CWE Flag Count': self.cwr,
+            'ECE Flag Count': self.ece,
+            'Down/Up Ratio': self.bwd_n // self.fwd_n if self.fwd_n else 0,
+            'Average Packet Size': (self.fwd_bytes + self.bwd_bytes) / self.n if self.n else 0.0,
+            'Avg Fwd Segment Size': self.fwd_mean,
+            'Avg Bwd Segment Size': self.bwd_mean,
+            'Fwd Header Length.1': self.fwd_header,
+            'Subflow Fwd Packets': self.fwd_n / self.subflows,
+            'Subflow Fwd Bytes': self.fwd_bytes / self.subflows,
+            'Subflow Bwd Packets': self.bwd_n / self.subflows,
+            'Subflow Bwd Bytes': self.bwd_bytes / self.subflows,
+            'Init_Win_bytes_forward': self.init_win_fwd if self.init_win_fwd is not None else 0,
+            'Init_Win_bytes_backward': self.init_win_bwd if self.init_win_bwd is not None else 0,
+            'act_data_pkt_fwd': self.act_data_fwd,
+            'min_seg_size_forward': self.min_seg_fwd if self.fwd_n else 0,
+            'Active Mean': active_mean,
+            'Active Std': math.sqrt(active_m2 / (active_n - 1)) if active_n > 1 else 0.0,
+            'Active Max': max(self.active_max, active),
+            'Active Min': min(self.active_min, active),
+            'Idle Mean': self.idle_mean,
+            'Idle Std': math.sqrt(self.idle_m2 / (self.idle_n - 1)) if self.idle_n > 1 else 0.0,
+            'Idle Max': self.idle_max,
+            'Idle Min': self.idle_min if self.idle_n else 0.0,
+        }
+        if Flow._columns is None:
+            Flow._columns = np.array([FEATURE_INDEX[name] for name in values])
+        out[Flow._columns] = list(values.values())
+
+
+class FlowTable:
+    """Bounded table of live flows keyed on the direction-independent 5-tuple"""
+
+    def __init__(self, max_flows: int = 262144, idle_timeout: float = 120.0, active_timeout: float = 1800.0):
+        """
+        Args:
+            max_flows: Flows kept; the least recently seen flow is evicted beyond this
+            idle_timeout: Seconds without a packet after which a flow expires
+            active_timeout: Seconds after which a long-lived flow is closed and restarted
+        """
+        self.max_flows = max(1, int(max_flows))
+        self.idle_timeout = float(idle_timeout)
+        self.active_timeout = float(active_timeout)
+        self._flows: "OrderedDict[tuple, Flow]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters for monitoring
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def update(self, packet: Dict[str, Any], now: Optional[float] = None,
+               out: Optional[np.ndarray] = None) -> Flow:
+        """
+        Account a sanitized packet in its flow and return the flow (already including the packet).
+
+        Args:
+            now: Packet time in epoch seconds (defaults to the packet's timestamp, then the clock)
+            out: FEATURE_NAMES-ordered row to write the flow's columns into. They are written
+                under the table lock: the returned flow keeps changing as other threads
+                account packets in it, so read its statistics through out, not afterwards.
+        """
+        if now is None:
+            try:
+                now = float(packet.get('timestamp') or 0) or time.time()
+            except (TypeError, ValueError):
+                now = time.time()
+        src_ip = str(packet.get('start_ip', ''))
+        dst_ip = str(packet.get('end_ip', ''))
+        protocol = str(packet.get('protocol', '')).upper()
+        src_port, dst_port = _ports(packet)
+        length = float(packet.get('start_bytes', 0) or 0)
+        try:
+            flags = int(packet.get('tcp_flags') or 0)
+        except (TypeError, ValueError):
+            flags = 0
+        window = packet.get('tcp_window')
+        header_length = packet.get('header_length')
+        if header_length is None:
+            header_length = DEFAULT_HEADER_LENGTH.get(protocol, 0)
+
+        # Same key for both directions
+        a, b = (src_ip, src_port), (dst_ip, dst_port)
+        key = (protocol,) + (a + b if a <= b else b + a)
+
+        with self._lock:
+            flows = self._flows
+            self._expire(now)
+            flow = flows.get(key)
+            if flow is not None and (flow.closed or now - flow.first_seen > self.active_timeout):
+                del flows[key]
+                flow = None
+            if flow is None:
+                flow = Flow(src_ip, src_port, dst_port, now)
+                flows[key] = flow
+                self.created += 1
+                if len(flows) > self.max_flows:
+                    flows.popitem(last=False)
+                    self.evicted += 1
+            else:
+                flows.move_to_end(key)
+            forward = src_ip == flow.src_ip and src_port == flow.src_port
+            flow.add(forward, max(now, flow.last_seen), length, int(header_length), flags,
+                     int(window) if window is not None else None)
+            if out is not None:
+                flow.write_features(out)
+        return flow
+
+    def _expire(self, now: float):
+        """Drop flows idle for more than idle_timeout (oldest first; lock held)"""
+        flows = self._flows
+        limit = now - self.idle_timeout
+        while flows:
+            oldest = next(iter(flows.values()))
+            if oldest.last_seen >= limit:
+                break
+            flows.popitem(last=False)
+            self.expired += 1
+
+    def __len__(self):
+        return len(self._flows)
+
+    def describe(self) -> Dict[str, object]:
+        return {
+            'flows': len(self._flows),
+            'max_flows': self.max_flows,
+            'created': self.created,
+            'expired': self.expired,
+            'evicted': self.evicted
+        }
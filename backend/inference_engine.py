@@ -0,0 +1,261 @@
+"""
+ML Inference Engine
+Owns the binary and multiclass models and scores whole feature matrices with a
+single predict_proba call per model. Labels, confidences and the full attack type
+distribution are all derived from those two probability matrices.
+"""
+import os
+import pickle
+import time
+import warnings
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from packet_features import FEATURE_NAMES
+from prediction_cache import PredictionCache
+from service_logging import get_logger
+
+log = get_logger('inference_engine')
+
+# Multiclass label space (class value == index): 6 types
+ATTACK_TYPE_NAMES = ['normal', 'dos', 'probe', 'r2l', 'u2r', 'brute_force']
+
+# Models are fitted on a DataFrame but scored on plain float32 arrays laid out in FEATURE_NAMES order
+warnings.filterwarnings('ignore', message='X does not have valid feature names')
+
+
+def load_model(path: str):
+    """Load a pickled model, trying joblib first and falling back to pickle"""
+    try:
+        import joblib
+        return joblib.load(path)
+    except Exception:
+        # Fall back to pickle if joblib fails
+        log.warning("⚠️ Joblib loading failed for %s, trying pickle...", path)
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+def _compile_or_keep(model, name: str):
+    """Swap a sklearn forest for its verified compiled form, keeping the original on failure"""
+    from compiled_forest import compile_forest
+    try:
+        compiled = compile_forest(model)
+        log.info("✅ %s model compiled: %d trees, %d nodes (matches sklearn predict_proba)",
+                 name, compiled.n_trees, compiled.n_nodes)
+        return compiled
+    except Exception as e:
+        log.warning("⚠️ Could not compile %s model, using sklearn: %s", name.lower(), e)
+        return model
+
+
+def _load_compiled(path: str, name: str):
+    """
+    Compiled forest for a model file. A memory-mapped artifact (see compiled_forest.py) is
+    used when it was compiled from a file with the model file's exact content (mtimes are
+    not trusted: cp -p, rsync -t or tar keep them); otherwise the model is loaded and
+    compiled, and the artifact is written for the next start.
+    """
+    from compiled_forest import CompiledForest, artifact_path, file_digest
+    artifact = artifact_path(path)
+    digest = file_digest(path) if os.path.exists(path) else None
+    if os.path.exists(artifact):
+        try:
+            compiled = CompiledForest.load(artifact)
+            if digest is None or getattr(compiled, 'source_digest', None) == digest:
+                log.info("📎 %s model memory-mapped from %s: %d trees, %d nodes",
+                         name, artifact, compiled.n_trees, compiled.n_nodes)
+                return compiled
+            log.info("🔄 %s was not compiled from the current %s, recompiling", artifact, path)
+        except Exception as e:
+            log.warning("⚠️ Could not load %s, compiling %s instead: %s", artifact, path, e)
+
+    model = _compile_or_keep(load_model(path), name)
+    if isinstance(model, CompiledForest):
+        model.source_digest = digest
+        try:
+            model.save(artifact)
+            log.info("💾 Saved %s (memory-mapped on the next start)", artifact)
+        except Exception as e:
+            log.warning("⚠️ Could not save %s: %s", artifact, e)
+    return model
+
+
+class InferenceResult:
+    """Per-batch model output, converted to plain Python lists once for the whole batch"""
+
+    def __init__(self, is_malicious, binary_confidence, attack_types,
+                 multiclass_confidence, class_probabilities, cache_hits: int = 0):
+        self.is_malicious: List[bool] = is_malicious
+        self.binary_confidence: List[float] = binary_confidence
+        self.attack_types: List[str] = attack_types
+        self.multiclass_confidence: List[float] = multiclass_confidence
+        self.class_probabilities: List[List[float]] = class_probabilities  # ATTACK_TYPE_NAMES order
+        self.cache_hits = cache_hits  # Rows answered from the prediction cache
+
+    def __len__(self):
+        return len(self.is_malicious)
+
+    def verdict(self, row: int):
+        """
+        Returns:
+            (binary_label, attack_type, binary_confidence, multiclass_confidence,
+             attack_type_probabilities) for one row of the batch
+        """
+        return (
+            'malicious' if self.is_malicious[row] else 'benign',
+            self.attack_types[row],
+            self.binary_confidence[row],
+            self.multiclass_confidence[row],
+            dict(zip(ATTACK_TYPE_NAMES, self.class_probabilities[row]))
+        )
+
+
+class InferenceEngine:
+    """Evaluates each forest once per batch and derives every output from that one pass"""
+
+    def __init__(self, binary_model, multiclass_model, binary_threshold: float = 0.5,
+                 attack_type_threshold: float = 0.0, cache: Optional[PredictionCache] = None):
+        """
+        Args:
+            binary_model: Fitted classifier with predict_proba (classes 0=benign, 1=malicious)
+            multiclass_model: Fitted classifier with predict_proba (classes index ATTACK_TYPE_NAMES)
+            binary_threshold: A packet is malicious when P(malicious) is strictly greater than this.
+                0.5 reproduces the models' own predict()
+            attack_type_threshold: Minimum winning-class probability for the attack type;
+                below it the type is reported as 'unknown'
+            cache: Prediction cache for this engine's models only (see prediction_cache.py)
+        """
+        for name, model in (('Binary', binary_model), ('Multiclass', multiclass_model)):
+            if not hasattr(model, 'predict_proba'):
+                raise AttributeError(f"{name} model does not have predict_proba method")
+            # The featurizer writes columns in FEATURE_NAMES order; refuse models trained on another layout
+            trained_names = getattr(model, 'feature_names_in_', None)
+            if trained_names is not None and list(trained_names) != FEATURE_NAMES:
+                raise ValueError(f"{name} model feature names do not match packet_features.FEATURE_NAMES")
+
+        self.binary_model = binary_model
+        self.multiclass_model = multiclass_model
+        self.binary_threshold = float(binary_threshold)
+        self.attack_type_threshold = float(attack_type_threshold)
+        self.cache = cache
+
+        # Column of P(malicious) in the binary probability matrix
+        binary_classes = list(binary_model.classes_)
+        self._malicious_column = binary_classes.index(1) if 1 in binary_classes else 0
+
+        # Map every multiclass column onto its slot in ATTACK_TYPE_NAMES
+        multiclass_classes = [int(c) for c in multiclass_model.classes_]
+        self._class_names = np.array(
+            [ATTACK_TYPE_NAMES[c] if 0 <= c < len(ATTACK_TYPE_NAMES) else 'unknown'
+             for c in multiclass_classes] + ['unknown'],
+            dtype=object
+        )
+        self._class_slots = np.array(
+            [c if 0 <= c < len(ATTACK_TYPE_NAMES) else -1 for c in multiclass_classes]
+        )
+        # Seconds spent loading each model, filled in by load()
+        self.load_timings: Dict[str, float] = {}
+
+    @classmethod
+    def load(cls, binary_path: str = 'binary_attack_model.pkl',
+             multiclass_path: str = 'multiclass_attack_model.pkl', backend: str = 'sklearn',
+             **kwargs) -> 'InferenceEngine':
+        """
+        Load both models from disk and build an engine around them.
+
+        Args:
+            backend: 'sklearn' to score with the models as loaded, or 'compiled' to convert
+                each forest to a CompiledForest (verified against sklearn first; a model that
+                cannot be compiled or does not match stays on sklearn). Compiled forests are
+                cached as memory-mapped artifacts next to the model files
+        """
+        if backend == 'compiled':
+            load = _load_compiled
+        elif backend == 'sklearn':
+            load = lambda path, name: load_model(path)
+        else:
+            raise ValueError(f"Unknown ML backend: {backend}")
+
+        timings = {}
+        started = time.perf_counter()
+        binary_model = load(binary_path, 'Binary')
+        timings['binary'] = time.perf_counter() - started
+        started = time.perf_counter()
+        multiclass_model = load(multiclass_path, 'Multiclass')
+        timings['multiclass'] = time.perf_counter() - started
+        log.info("Binary model type: %s", type(binary_model))
+        log.info("Multiclass model type: %s", type(multiclass_model))
+
+        engine = cls(binary_model, multiclass_model, **kwargs)
+        engine.load_timings = timings
+        return engine
+
+    def predict(self, features: np.ndarray) -> InferenceResult:
+        """
+        Score a batch with one predict_proba call per model.
+
+        Args:
+            features: float32 matrix of shape (n_packets, N_FEATURES)
+        """
+        if self.cache is None:
+            binary_proba = self.binary_model.predict_proba(features)
+            multiclass_proba = self.multiclass_model.predict_proba(features)
+            return self._derive(binary_proba, multiclass_proba)
+        return self._predict_cached(features)
+
+    def _predict_cached(self, features: np.ndarray) -> InferenceResult:
+        """predict() that evaluates the forests only on rows missing from the cache (each distinct key once)"""
+        keys = self.cache.keys(features)
+        cached = self.cache.get_many(keys)
+
+        missing: Dict[bytes, int] = {}  # key -> row of the first packet with it
+        for row, (key, value) in enumerate(zip(keys, cached)):
+            if value is None and key not in missing:
+                missing[key] = row
+
+        computed = {}
+        if missing:
+            rows = list(missing.values())
+            binary_proba = self.binary_model.predict_proba(features[rows])
+            multiclass_proba = self.multiclass_model.predict_proba(features[rows])
+            self.cache.put_many(list(missing), binary_proba, multiclass_proba)
+            computed = {key: (binary_proba[i], multiclass_proba[i]) for i, key in enumerate(missing)}
+
+        outputs = [value if value is not None else computed[key] for key, value in zip(keys, cached)]
+        result = self._derive(np.array([binary for binary, _ in outputs]),
+                              np.array([multiclass for _, multiclass in outputs]))
+        result.cache_hits = len(keys) - sum(1 for value in cached if value is None)
+        return result
+
+    def _derive(self, binary_proba: np.ndarray, multiclass_proba: np.ndarray) -> InferenceResult:
+        """Turn the two probability matrices into labels, confidences and distributions"""
+        n = len(binary_proba)
+        malicious_proba = binary_proba[:, self._malicious_column]
+
+        best_column = np.argmax(multiclass_proba, axis=1)
+        best_proba = multiclass_proba[np.arange(n), best_column]
+        type_index = np.where(best_proba >= self.attack_type_threshold, best_column, -1)
+
+        # Full distribution in ATTACK_TYPE_NAMES order (classes the model never saw stay at 0)
+        class_probabilities = np.zeros((n, len(ATTACK_TYPE_NAMES)))
+        known = self._class_slots >= 0
+        class_probabilities[:, self._class_slots[known]] = multiclass_proba[:, known]
+
+        return InferenceResult(
+            is_malicious=(malicious_proba > self.binary_threshold).tolist(),
+            binary_confidence=malicious_proba.tolist(),
+            attack_types=self._class_names[type_index].tolist(),
+            multiclass_confidence=best_proba.tolist(),
+            class_probabilities=class_probabilities.tolist()
+        )
+
+    def describe(self) -> Dict[str, object]:
+        return {
+            'binary_model': type(self.binary_model).__name__,
+            'multiclass_model': type(self.multiclass_model).__name__,
+            'binary_threshold': self.binary_threshold,
+            'attack_type_threshold': self.attack_type_threshold,
+            'cache': self.cache.describe() if self.cache is not None else None
+        }
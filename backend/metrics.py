@@ -0,0 +1,295 @@
+"""
+Service Metrics
+Dependency-free counters, gauges and fixed-bucket histograms rendered in the Prometheus
+text exposition format (GET /metrics).
+
+Instruments are cheap enough for the per-packet path: a labelled series is looked up
+once and kept, an observation is one bisect plus a few additions under a lock, and
+observe_many() records a whole batch under a single lock acquisition.
+
+snapshot() returns plain dicts and tuples, so snapshots can be sent between processes
+and merged (supervisor mode sums the snapshots of its workers, see merge()).
+"""
+import bisect
+import math
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Latencies from 10 µs to 5 s
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _CounterSeries:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def reset(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+
+class _HistogramSeries:
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def observe_many(self, values: Sequence[float]):
+        buckets = self.buckets
+        indices = [bisect.bisect_left(buckets, value) for value in values]
+        total = sum(values)
+        with self._lock:
+            counts = self.counts
+            for index in indices:
+                counts[index] += 1
+            self.sum += total
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def labels(self, *values: Any):
+        """Series for one combination of label values (create it once and keep it on hot paths)"""
+        key = tuple(str(value) for value in values)
+        series = self._series.get(key)
+        if series is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                series = self._series.setdefault(key, self._new_series())
+        return series
+
+    def reset(self):
+        """Zero every series in place (series handles kept by callers stay valid)"""
+        self._lock = threading.Lock()
+        for series in self._series.values():
+            series.reset()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Callable[[], Any] = None):
+        """
+        Args:
+            callback: Reads a running total kept elsewhere at collection time instead of
+                counting with inc(); returns a number (no labels) or {label value(s): number}
+        """
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def _new_series(self):
+        return _CounterSeries()
+
+    def inc(self, amount: float = 1):
+        """Increment the unlabelled series"""
+        self.labels().inc(amount)
+
+    def collect(self) -> Dict[Tuple[str, ...], float]:
+        if self.callback is not None:
+            return _collect_callback(self.callback)
+        return {key: series.value for key, series in list(self._series.items())}
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets if b != math.inf))
+
+    def _new_series(self):
+        return _HistogramSeries(self.buckets)
+
+    def observe(self, value: float):
+        """Observe on the unlabelled series"""
+        self.labels().observe(value)
+
+    def collect(self) -> Dict[Tuple[str, ...], Tuple[Tuple[int, ...], float]]:
+        collected = {}
+        for key, series in list(self._series.items()):
+            with series._lock:
+                collected[key] = (tuple(series.counts), series.sum)
+        return collected
+
+
+class Gauge(_Metric):
+    """Value read from a callback at collection time"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Callable[[], Any] = None, merge: str = 'sum'):
+        """
+        Args:
+            callback: Returns a number (no labels) or {label value(s): number}
+            merge: How snapshots of several processes combine: 'sum' (state partitioned
+                between the processes) or 'max' (state every process sees the same)
+        """
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.merge = merge
+
+    def collect(self) -> Dict[Tuple[str, ...], float]:
+        return _collect_callback(self.callback)
+
+
+def _collect_callback(callback: Callable[[], Any]) -> Dict[Tuple[str, ...], float]:
+    try:
+        value = callback()
+    except Exception:
+        return {}
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        return {(): float(value)}
+    return {(key if isinstance(key, tuple) else (str(key),)): float(v) for key, v in value.items()}
+
+
+class Registry:
+    """The set of instruments one process exposes"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                callback: Callable[[], Any] = None) -> Counter:
+        return self._register(Counter(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              callback: Callable[[], Any] = None, merge: str = 'sum') -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, callback, merge))
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Current values of every instrument as plain (picklable) data"""
+        return {
+            metric.name: {
+                'kind': metric.kind,
+                'help': metric.documentation,
+                'labelnames': metric.labelnames,
+                'buckets': getattr(metric, 'buckets', None),
+                'merge': getattr(metric, 'merge', 'sum'),
+                'series': metric.collect()
+            }
+            for metric in self._metrics
+        }
+
+    def render(self) -> str:
+        return render(self.snapshot())
+
+    def reset(self):
+        """
+        Start over from zero, e.g. in a forked worker: it must not report the counts it
+        inherited from its parent, and a lock held by another thread at fork time would
+        never be released in the child.
+        """
+        for metric in self._metrics:
+            metric.reset()
+
+
+def merge(snapshots: List[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """Combine snapshots of several processes: counters and histograms add up, gauges per their merge mode"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.get(name)
+            if target is None:
+                merged[name] = dict(metric, series=dict(metric['series']))
+                continue
+            series = target['series']
+            for key, value in metric['series'].items():
+                current = series.get(key)
+                if current is None:
+                    series[key] = value
+                elif metric['kind'] == 'histogram':
+                    series[key] = (tuple(a + b for a, b in zip(current[0], value[0])), current[1] + value[1])
+                elif metric['kind'] == 'gauge' and metric.get('merge') == 'max':
+                    series[key] = max(current, value)
+                else:
+                    series[key] = current + value
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render(snapshot: Dict[str, Dict[str, Any]]) -> str:
+    """Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for name, metric in snapshot.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        labelnames = metric['labelnames']
+        for key in sorted(metric['series']):
+            value = metric['series'][key]
+            if metric['kind'] == 'histogram':
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(list(metric['buckets']) + [math.inf], counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labelnames, key, ('le', _number(bound)))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labelnames, key)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(labelnames, key)} {cumulative}")
+            else:
+                lines.append(f"{name}{_labels(labelnames, key)} {_number(value)}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,182 @@
+"""
+Micro-batching Request Aggregator
+Collects items submitted concurrently by request threads into one queue and hands
+them to a batch function together. A batch is flushed as soon as it reaches
+max_batch_size items or max_wait_ms after its first item arrived, whichever comes
+first. Each caller waits on its own Future and gets back its own result.
+
+An item may carry a time.monotonic() deadline. Items whose deadline passed before their
+batch ran are handed to the batch function in a call of their own, with that (expired)
+deadline, so it can skip their work; the others get the latest deadline of their batch.
+
+iter_batches applies the same size / deadline rule to a single blocking stream.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+from service_logging import get_logger
+
+log = get_logger('micro_batcher')
+
+
+class MicroBatcher:
+    """Single background thread that drains the queue in batches, preserving arrival order"""
+
+    def __init__(self, process_batch: Callable[..., List[Any]],
+                 max_batch_size: int = 64, max_wait_ms: float = 2.0, name: str = 'micro-batcher'):
+        """
+        Args:
+            process_batch: Called with a list of items and deadline= (the latest deadline of those
+                items, None if one has none); must return one result per item in the same order
+            max_batch_size: Flush once this many items are waiting
+            max_wait_ms: Flush at most this many milliseconds after the first item of a batch arrived
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._stopped = threading.Event()
+
+        # Counters for monitoring the achieved batch sizes
+        self.batches = 0
+        self.items = 0
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any, deadline: Optional[float] = None) -> Future:
+        """Queue one item (deadline: time.monotonic() after which its result is no longer needed)"""
+        if self._stopped.is_set():
+            raise RuntimeError("MicroBatcher is stopped")
+        future: Future = Future()
+        self._queue.put((item, future, deadline))
+        return future
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the worker after flushing what is already queued"""
+        self._stopped.set()
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.items / self.batches if self.batches else 0.0
+
+    def _collect(self) -> List[tuple]:
+        """Block for the first item, then gather more until the batch is full or its deadline passes"""
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Stop requested: flush this batch, the loop exits afterwards
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                if self._stopped.is_set():
+                    return
+                continue
+
+            now = time.monotonic()
+            expired = [entry for entry in batch if entry[2] is not None and entry[2] <= now]
+            if expired:
+                live = [entry for entry in batch if entry[2] is None or entry[2] > now]
+                self._process(expired, max(entry[2] for entry in expired))
+                if not live:
+                    continue
+                batch = live
+            deadlines = [entry[2] for entry in batch]
+            self._process(batch, None if None in deadlines else max(deadlines))
+
+    def _process(self, batch: List[tuple], deadline: Optional[float]):
+        items = [item for item, _, _ in batch]
+        try:
+            results = self.process_batch(items, deadline=deadline)
+            if len(results) != len(items):
+                raise RuntimeError(f"Batch function returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            log.error("❌ Error in micro-batch of %d item(s): %s", len(items), e)
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.items += len(items)
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+
+_END = object()
+
+
+def iter_batches(items: Iterable[Any], max_batch_size: int = 64, max_wait_ms: float = 2.0) -> Iterator[List[Any]]:
+    """
+    Group a blocking iterable (e.g. lines of a request body) into batches. A batch is
+    yielded once it is full or max_wait_ms after its first item, so a slow trickle of
+    items still gets answered promptly. The iterable is read on a background thread
+    through a bounded queue, which keeps memory flat however long the stream is.
+    """
+    max_batch_size = max(1, int(max_batch_size))
+    max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+    pending: "queue.Queue" = queue.Queue(maxsize=max_batch_size * 4)
+    stopped = threading.Event()
+
+    def pump():
+        try:
+            for item in items:
+                while not stopped.is_set():
+                    try:
+                        pending.put(item, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stopped.is_set():
+                    return
+        except Exception as e:
+            log.warning("⚠️ Stream reader stopped: %s", e)
+        finally:
+            while not stopped.is_set():
+                try:
+                    pending.put(_END, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+    threading.Thread(target=pump, name='stream-reader', daemon=True).start()
+    try:
+        finished = False
+        while not finished:
+            item = pending.get()
+            if item is _END:
+                return
+            batch = [item]
+            deadline = time.monotonic() + max_wait
+            while len(batch) < max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = pending.get(timeout=remaining) if remaining > 0 else pending.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _END:
+                    finished = True
+                    break
+                batch.append(item)
+            yield batch
+    finally:
+        stopped.set()
@@ -0,0 +1,262 @@
+"""
+Model Compression for latency-budgeted deployment
+Post-training stage for the forests produced by train_models.py:
+
+  * Tree pruning - greedy forward selection orders the trees by their marginal
+    contribution to held-out accuracy; the first k trees form a sub-forest.
+  * Distillation - small / depth-limited forests and single trees are trained
+    on the full ensemble's predictions.
+
+Every candidate is measured for size, per-row latency and held-out accuracy, and
+the most accurate one that fits both the latency budget and the maximum accuracy
+loss is saved next to the original model.
+
+Usage:
+    python3 model_compression.py --latency-budget-ms 2 --max-accuracy-loss 0.005
+    python3 model_compression.py --backend compiled --samples 40000
+"""
+import argparse
+import copy
+import pickle
+import random
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from packet_features import FEATURE_NAMES
+
+# Distilled student configurations: (n_estimators, max_depth); n_estimators=1 is a single tree
+DISTILL_CONFIGS = [(50, 16), (25, 12), (10, 10), (1, 14), (1, 8)]
+
+# Class mix of the training data in train_models.py
+DATASET_MIX = [
+    ('generate_normal_traffic_features', 200000),
+    ('generate_dos_attack_features', 100000),
+    ('generate_probe_attack_features', 100000),
+    ('generate_brute_force_features', 50000),
+    ('generate_r2l_features', 50000),
+    ('generate_u2r_features', 50000),
+]
+
+
+def generate_dataset(n_samples: int, seed: int):
+    """
+    Fresh labelled data from the training generators, with the training class mix.
+
+    Returns:
+        (X DataFrame with FEATURE_NAMES columns, y_binary, y_multiclass)
+    """
+    import train_models
+
+    random.seed(seed)
+    total = sum(count for _, count in DATASET_MIX)
+    parts = [getattr(train_models, name)(max(1, n_samples * count // total)) for name, count in DATASET_MIX]
+    X = np.vstack([p[0] for p in parts])
+    y_binary = np.hstack([p[1] for p in parts])
+    y_multiclass = np.hstack([p[2] for p in parts])
+    return pd.DataFrame(X, columns=FEATURE_NAMES), y_binary, y_multiclass
+
+
+def tree_probabilities(model, X) -> np.ndarray:
+    """Per-tree class probabilities, shape (n_trees, n_rows, n_classes)"""
+    X = np.asarray(X, dtype=np.float32)
+    return np.stack([est.predict_proba(X).astype(np.float32) for est in model.estimators_])
+
+
+def order_trees_by_contribution(model, X_val, y_val) -> List[int]:
+    """
+    Greedy forward selection: repeatedly add the tree that raises held-out accuracy
+    of the growing sub-forest the most (ties broken by summed probability margin).
+
+    Returns:
+        Indices of all trees, most useful first
+    """
+    proba = tree_probabilities(model, X_val)
+    class_column = {c: i for i, c in enumerate(model.classes_)}
+    y_index = np.array([class_column[c] for c in y_val])
+    rows = np.arange(len(y_index))
+
+    remaining = list(range(len(proba)))
+    running = np.zeros(proba.shape[1:], dtype=np.float32)
+    order = []
+    while remaining:
+        candidates = running[None, :, :] + proba[remaining]
+        correct = candidates.argmax(axis=2) == y_index[None, :]
+        accuracy = correct.mean(axis=1)
+        margin = candidates[:, rows, y_index].sum(axis=1)
+        best = int(np.lexsort((margin, accuracy))[-1])
+        tree = remaining.pop(best)
+        running += proba[tree]
+        order.append(tree)
+    return order
+
+
+def subforest(model, tree_indices: List[int]):
+    """Copy of a fitted forest keeping only the given trees"""
+    pruned = copy.copy(model)
+    pruned.estimators_ = [model.estimators_[i] for i in tree_indices]
+    pruned.n_estimators = len(pruned.estimators_)
+    # Per-training-row weights kept by newer sklearn; only needed for OOB scoring, one float per row
+    if getattr(pruned, '_sample_weight', None) is not None:
+        pruned._sample_weight = None
+    return pruned
+
+
+def distill(teacher, X_transfer: pd.DataFrame, n_estimators: int, max_depth: int, seed: int = 42):
+    """Train a smaller student on the teacher's predicted labels"""
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.tree import DecisionTreeClassifier
+
+    y_teacher = teacher.predict(X_transfer.to_numpy(dtype=np.float32))
+    if n_estimators == 1:
+        student = DecisionTreeClassifier(max_depth=max_depth, min_samples_leaf=2, random_state=seed)
+    else:
+        student = RandomForestClassifier(
+            n_estimators=n_estimators,
+            max_depth=max_depth,
+            min_samples_split=5,
+            min_samples_leaf=2,
+            random_state=seed,
+            n_jobs=-1
+        )
+    return student.fit(X_transfer, y_teacher)
+
+
+def measure_latency_ms(model, X, backend: str = 'sklearn', repeats: int = 300) -> float:
+    """Median milliseconds to score one row, as the prediction service would"""
+    if backend == 'compiled':
+        from compiled_forest import CompiledForest
+        model = CompiledForest.from_sklearn(model)
+    X = np.asarray(X, dtype=np.float32)
+    timings = []
+    for i in range(repeats):
+        row = X[i % len(X):i % len(X) + 1]
+        start = time.perf_counter()
+        model.predict_proba(row)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1e3
+
+
+def model_size_bytes(model) -> int:
+    return len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def count_nodes(model) -> int:
+    estimators = getattr(model, 'estimators_', [model])
+    return int(sum(est.tree_.node_count for est in estimators))
+
+
+def accuracy(model, X, y) -> float:
+    return float(np.mean(model.predict(np.asarray(X, dtype=np.float32)) == y))
+
+
+def compress_model(model, X_val, y_val, X_transfer, X_test, y_test, latency_budget_ms: Optional[float],
+                   max_accuracy_loss: float, backend: str = 'sklearn'):
+    """
+    Build pruned and distilled candidates for one model and pick the best that fits the budgets.
+
+    Returns:
+        (report rows, chosen model or None if no candidate fits)
+    """
+    baseline_accuracy = accuracy(model, X_test, y_test)
+    candidates = [('original', model)]
+
+    if hasattr(model, 'estimators_') and len(model.estimators_) > 1:
+        print(f"   Ranking {len(model.estimators_)} trees by marginal accuracy contribution...")
+        order = order_trees_by_contribution(model, X_val, y_val)
+        k = 1
+        while k < len(order):
+            candidates.append((f'pruned-{k}', subforest(model, order[:k])))
+            k *= 2
+
+    for n_estimators, max_depth in DISTILL_CONFIGS:
+        label = f'distilled-tree-d{max_depth}' if n_estimators == 1 else f'distilled-{n_estimators}x-d{max_depth}'
+        print(f"   Training {label}...")
+        candidates.append((label, distill(model, X_transfer, n_estimators, max_depth)))
+
+    rows = []
+    for label, candidate in candidates:
+        acc = accuracy(candidate, X_test, y_test)
+        rows.append({
+            'candidate': label,
+            'model': candidate,
+            'trees': len(getattr(candidate, 'estimators_', [candidate])),
+            'nodes': count_nodes(candidate),
+            'size_mb': model_size_bytes(candidate) / 1e6,
+            'latency_ms': measure_latency_ms(candidate, X_test, backend),
+            'accuracy': acc,
+            'accuracy_loss': baseline_accuracy - acc,
+        })
+
+    fitting = [
+        row for row in rows[1:]
+        if row['accuracy_loss'] <= max_accuracy_loss
+        and (latency_budget_ms is None or row['latency_ms'] <= latency_budget_ms)
+    ]
+    # Most accurate candidate within budget; among equals, the fastest
+    chosen = min(fitting, key=lambda row: (-row['accuracy'], row['latency_ms']), default=None)
+    for row in rows:
+        row['chosen'] = row is chosen
+    return rows, (chosen['model'] if chosen else None)
+
+
+def print_report(name: str, rows: List[Dict]):
+    print(f"\n📊 {name} model: size / latency / accuracy trade-off")
+    print(f"   {'candidate':<24}{'trees':>6}{'nodes':>10}{'size MB':>10}{'ms/row':>9}{'accuracy':>10}{'loss':>9}")
+    for row in rows:
+        marker = ' ⬅ chosen' if row['chosen'] else ''
+        print(f"   {row['candidate']:<24}{row['trees']:>6}{row['nodes']:>10}{row['size_mb']:>10.2f}"
+              f"{row['latency_ms']:>9.3f}{row['accuracy']:>10.4f}{row['accuracy_loss']:>+9.4f}{marker}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prune / distill trained attack models to a latency budget')
+    parser.add_argument('--binary', default='binary_attack_model.pkl', help='Binary model file')
+    parser.add_argument('--multiclass', default='multiclass_attack_model.pkl', help='Multiclass model file')
+    parser.add_argument('--latency-budget-ms', type=float, default=None,
+                        help='Maximum per-row scoring latency in milliseconds (default: no limit)')
+    parser.add_argument('--max-accuracy-loss', type=float, default=0.005,
+                        help='Maximum held-out accuracy drop versus the full model (default: 0.005)')
+    parser.add_argument('--backend', choices=['sklearn', 'compiled'], default='sklearn',
+                        help='Evaluator used for latency measurement (match ML_BACKEND)')
+    parser.add_argument('--samples', type=int, default=20000,
+                        help='Held-out rows for each of the validation and test splits')
+    parser.add_argument('--suffix', default='.compact', help='Suffix for saved compressed models')
+    parser.add_argument('--seed', type=int, default=1234, help='Seed for the held-out data generators')
+    args = parser.parse_args()
+
+    from inference_engine import load_model
+    import joblib
+
+    print("📊 Generating held-out data...")
+    X_val, y_val_bin, y_val_multi = generate_dataset(args.samples, args.seed)
+    X_test, y_test_bin, y_test_multi = generate_dataset(args.samples, args.seed + 1)
+    X_transfer, _, _ = generate_dataset(args.samples * 5, args.seed + 2)
+
+    for name, path, y_val, y_test in (
+        ('Binary', args.binary, y_val_bin, y_test_bin),
+        ('Multiclass', args.multiclass, y_val_multi, y_test_multi),
+    ):
+        print(f"\n🎯 Compressing {name.lower()} model ({path})...")
+        model = load_model(path)
+        rows, chosen = compress_model(model, X_val, y_val, X_transfer, X_test, y_test,
+                                      args.latency_budget_ms, args.max_accuracy_loss, args.backend)
+        print_report(name, rows)
+        if chosen is None:
+            print("   ⚠️ No candidate fits the latency budget and accuracy loss - keeping the original model")
+            continue
+        root, ext = path.rsplit('.', 1) if '.' in path else (path, 'pkl')
+        output = f"{root}{args.suffix}.{ext}"
+        joblib.dump(chosen, output)
+        print(f"   💾 Saved {output}")
+
+    print("\nTo serve the compressed models, point the prediction service at them:")
+    print("   ML_BINARY_MODEL_PATH=binary_attack_model.compact.pkl \\")
+    print("   ML_MULTICLASS_MODEL_PATH=multiclass_attack_model.compact.pkl \\")
+    print("   USE_ML_MODELS=true python3 prediction_service.py")
+
+
+if __name__ == '__main__':
+    main()
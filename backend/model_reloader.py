@@ -0,0 +1,123 @@
+"""
+Hot Model Reload
+Loads replacement models on a background thread, warms them up and hands them to the
+service in one assignment, so requests in flight keep using the old models until the
+swap and the detectors' sliding windows are never touched. If loading or warm-up
+fails, the old models stay in place.
+
+Reloads are triggered explicitly (POST /reload) or by watching the model files.
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from service_logging import get_logger
+
+log = get_logger('model_reloader')
+
+
+def file_signature(paths: List[str]) -> Tuple:
+    """(mtime, size) of every path, None for missing files"""
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class ModelReloader:
+    """Background load -> warm-up -> swap, one reload at a time"""
+
+    def __init__(self, load: Callable[[], Any], warm_up: Callable[[Any], None],
+                 install: Callable[[Any], None], paths: List[str]):
+        """
+        Args:
+            load: Builds a new engine from the model files (raises on failure)
+            warm_up: Runs a synthetic batch through a new engine (raises if it is unusable)
+            install: Makes a warmed-up engine the live one
+            paths: Model files, watched for changes
+        """
+        self.load = load
+        self.warm_up = warm_up
+        self.install = install
+        self.paths = list(paths)
+        self.generation = 0
+        self.reloads = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_reload_at: Optional[float] = None
+        self._reload_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._loaded_signature = file_signature(self.paths)
+        self._stop = threading.Event()
+
+    def reload(self) -> bool:
+        """Load, warm up and install new models now; returns False (old models kept) on failure"""
+        with self._reload_lock:
+            signature = file_signature(self.paths)
+            started = time.perf_counter()
+            log.info("🔄 Reloading ML models (generation %d)...", self.generation + 1)
+            try:
+                engine = self.load()
+                self.warm_up(engine)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                # Do not retry the same files from the watcher; a new write changes the signature
+                self._loaded_signature = signature
+                log.error("❌ Model reload failed, keeping the current models: %s", e)
+                return False
+
+            self.install(engine)
+            self.generation += 1
+            self.reloads += 1
+            self.last_error = None
+            self.last_reload_at = time.time()
+            self._loaded_signature = signature
+            log.info("✅ Models reloaded and swapped in %.0f ms (generation %d)",
+                     (time.perf_counter() - started) * 1e3, self.generation)
+            return True
+
+    def reload_in_background(self) -> bool:
+        """Start a reload on a background thread; False if one is already running"""
+        if self._thread is not None and self._thread.is_alive():
+            return False
+        self._thread = threading.Thread(target=self.reload, name='model-reload', daemon=True)
+        self._thread.start()
+        return True
+
+    @property
+    def reloading(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def watch(self, interval: float = 5.0):
+        """Poll the model files and reload once a change has been stable for one interval"""
+        def run():
+            previous = file_signature(self.paths)
+            while not self._stop.wait(interval):
+                current = file_signature(self.paths)
+                # Wait until the files stop changing (a copy may still be in progress) and all exist
+                if current == previous and current != self._loaded_signature and None not in current:
+                    log.info("👀 Model files changed: %s", ', '.join(self.paths))
+                    self.reload()
+                previous = current
+
+        threading.Thread(target=run, name='model-watch', daemon=True).start()
+        log.info("👀 Watching model files every %gs: %s", interval, ', '.join(self.paths))
+
+    def stop(self):
+        self._stop.set()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'generation': self.generation,
+            'reloads': self.reloads,
+            'failures': self.failures,
+            'reloading': self.reloading,
+            'last_reload_at': self.last_reload_at,
+            'last_error': self.last_error
+        }
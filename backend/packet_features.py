@@ -0,0 +1,338 @@
+"""
+Packet Feature Extraction
+Turns a sanitized packet (plus the rule-based detection result for it) into the
+78-column CIC-IDS style feature row the ML models were trained on.
+"""
+import math
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from service_logging import get_logger
+
+log = get_logger('packet_features')
+
+# Feature names that the model expects, in training column order
+FEATURE_NAMES = [
+    'Destination Port', 'Flow Duration', 'Total Fwd Packets', 'Total Backward Packets',
+    'Total Length of Fwd Packets', 'Total Length of Bwd Packets', 'Fwd Packet Length Max',
+    'Fwd Packet Length Min', 'Fwd Packet Length Mean', 'Fwd Packet Length Std',
+    'Bwd Packet Length Max', 'Bwd Packet Length Min', 'Bwd Packet Length Mean',
+    'Bwd Packet Length Std', 'Flow Packets/s', 'Flow IAT Mean', 'Flow IAT Std',
+    'Flow IAT Max', 'Flow IAT Min', 'Fwd IAT Total', 'Fwd IAT Mean', 'Fwd IAT Std',
+    'Fwd IAT Max', 'Fwd IAT Min', 'Bwd IAT Total', 'Bwd IAT Mean', 'Bwd IAT Std',
+    'Bwd IAT Max', 'Bwd IAT Min', 'Fwd PSH Flags', 'Bwd PSH Flags', 'Fwd URG Flags',
+    'Bwd URG Flags', 'Fwd Header Length', 'Bwd Header Length', 'Fwd Packets/s',
+    'Bwd Packets/s', 'Min Packet Length', 'Max Packet Length', 'Packet Length Mean',
+    'Packet Length Std', 'Packet Length Variance', 'FIN Flag Count', 'SYN Flag Count',
+    'RST Flag Count', 'PSH Flag Count', 'ACK Flag Count', 'URG Flag Count',
+    'CWE Flag Count', 'ECE Flag Count', 'Down/Up Ratio', 'Average Packet Size',
+    'Avg Fwd Segment Size', 'Avg Bwd Segment Size', 'Fwd Header Length.1',
+    'Fwd Avg Bytes/Bulk', 'Fwd Avg Packets/Bulk', 'Fwd Avg Bulk Rate',
+    'Bwd Avg Bytes/Bulk', 'Bwd Avg Packets/Bulk', 'Bwd Avg Bulk Rate',
+    'Subflow Fwd Packets', 'Subflow Fwd Bytes', 'Subflow Bwd Packets',
+    'Subflow Bwd Bytes', 'Init_Win_bytes_forward', 'Init_Win_bytes_backward',
+    'act_data_pkt_fwd', 'min_seg_size_forward', 'Active Mean', 'Active Std',
+    'Active Max', 'Active Min', 'Idle Mean', 'Idle Std', 'Idle Max', 'Idle Min'
+]
+
+# Column index of every feature, shared by the featurizer and the training script
+FEATURE_INDEX = {name: i for i, name in enumerate(FEATURE_NAMES)}
+N_FEATURES = len(FEATURE_NAMES)
+
+FEATURE_DTYPE = np.float32  # sklearn trees evaluate on float32, so rows need no conversion
+
+_I = FEATURE_INDEX
+DESTINATION_PORT = _I['Destination Port']
+TOTAL_FWD_PACKETS = _I['Total Fwd Packets']
+TOTAL_BWD_PACKETS = _I['Total Backward Packets']
+TOTAL_LEN_FWD = _I['Total Length of Fwd Packets']
+TOTAL_LEN_BWD = _I['Total Length of Bwd Packets']
+FLOW_PACKETS_S = _I['Flow Packets/s']
+FWD_PSH_FLAGS = _I['Fwd PSH Flags']
+BWD_PSH_FLAGS = _I['Bwd PSH Flags']
+FWD_URG_FLAGS = _I['Fwd URG Flags']
+FWD_HEADER_LENGTH = _I['Fwd Header Length']
+BWD_HEADER_LENGTH = _I['Bwd Header Length']
+FWD_PACKETS_S = _I['Fwd Packets/s']
+MIN_PACKET_LENGTH = _I['Min Packet Length']
+MAX_PACKET_LENGTH = _I['Max Packet Length']
+PACKET_LENGTH_MEAN = _I['Packet Length Mean']
+PACKET_LENGTH_STD = _I['Packet Length Std']
+PACKET_LENGTH_VARIANCE = _I['Packet Length Variance']
+SYN_FLAG_COUNT = _I['SYN Flag Count']
+PSH_FLAG_COUNT = _I['PSH Flag Count']
+ACK_FLAG_COUNT = _I['ACK Flag Count']
+URG_FLAG_COUNT = _I['URG Flag Count']
+DOWN_UP_RATIO = _I['Down/Up Ratio']
+AVERAGE_PACKET_SIZE = _I['Average Packet Size']
+AVG_FWD_SEGMENT_SIZE = _I['Avg Fwd Segment Size']
+AVG_BWD_SEGMENT_SIZE = _I['Avg Bwd Segment Size']
+FWD_HEADER_LENGTH_1 = _I['Fwd Header Length.1']
+FWD_AVG_BYTES_BULK = _I['Fwd Avg Bytes/Bulk']
+FWD_AVG_PACKETS_BULK = _I['Fwd Avg Packets/Bulk']
+FWD_AVG_BULK_RATE = _I['Fwd Avg Bulk Rate']
+BWD_AVG_BYTES_BULK = _I['Bwd Avg Bytes/Bulk']
+BWD_AVG_PACKETS_BULK = _I['Bwd Avg Packets/Bulk']
+BWD_AVG_BULK_RATE = _I['Bwd Avg Bulk Rate']
+SUBFLOW_FWD_PACKETS = _I['Subflow Fwd Packets']
+SUBFLOW_FWD_BYTES = _I['Subflow Fwd Bytes']
+SUBFLOW_BWD_PACKETS = _I['Subflow Bwd Packets']
+SUBFLOW_BWD_BYTES = _I['Subflow Bwd Bytes']
+INIT_WIN_BYTES_FORWARD = _I['Init_Win_bytes_forward']
+INIT_WIN_BYTES_BACKWARD = _I['Init_Win_bytes_backward']
+ACT_DATA_PKT_FWD = _I['act_data_pkt_fwd']
+MIN_SEG_SIZE_FORWARD = _I['min_seg_size_forward']
+
+
+def _finite(value, cap: float) -> float:
+    """Convert a detector value to a float capped at `cap`, mapping NaN/inf to 0"""
+    value = min(float(value or 0), cap)
+    if math.isnan(value) or math.isinf(value):
+        return 0.0
+    return value
+
+
+def featurize_packet(packet: Dict[str, Any], attack_detection: Optional[dict] = None,
+                     out: Optional[np.ndarray] = None, flow_features: bool = False) -> np.ndarray:
+    """
+    Write the feature row for one packet.
+
+    Args:
+        packet: Sanitized packet dictionary
+        attack_detection: Result of comprehensive_detector.analyze_packet for this packet,
+            or None if the detector did not run. The featurizer never calls the detector
+            itself, so every packet is counted exactly once in the sliding windows.
+        out: Preallocated row of length N_FEATURES to fill (must be zeroed).
+            A new float32 row is allocated if omitted.
+        flow_features: out already holds the flow columns of the flow this packet was
+            accounted in (FlowTable.update(packet, out=out)); otherwise they are
+            approximated from the packet's own byte counts.
+
+    Returns:
+        The filled row
+    """
+    if out is None:
+        out = np.zeros(N_FEATURES, dtype=FEATURE_DTYPE)
+
+    start_bytes = float(packet.get('start_bytes', 0) or 0)
+    end_bytes = float(packet.get('end_bytes', 0) or 0)
+    frequency = float(packet.get('frequency', 0) or 0)
+
+    if flow_features:
+        # Real per-flow statistics; the detector enhancement below still raises the same columns
+        destination_port = float(out[DESTINATION_PORT])
+        total_fwd_packets = float(out[TOTAL_FWD_PACKETS])
+        total_bwd_packets = float(out[TOTAL_BWD_PACKETS])
+        total_len_fwd = float(out[TOTAL_LEN_FWD])
+        flow_packets_s = float(out[FLOW_PACKETS_S])
+        fwd_packets_s = float(out[FWD_PACKETS_S])
+        fwd_header_length = float(out[FWD_HEADER_LENGTH])
+        min_packet_length = float(out[MIN_PACKET_LENGTH])
+        packet_length_mean = float(out[PACKET_LENGTH_MEAN])
+        syn_flag_count = float(out[SYN_FLAG_COUNT])
+    else:
+        # Features the detector enhancement below can raise are kept as Python floats
+        # until the end so the row is written once, at full precision
+        destination_port = 0.0
+        total_fwd_packets = 0.0
+        total_bwd_packets = 0.0
+        total_len_fwd = start_bytes
+        flow_packets_s = frequency
+        fwd_packets_s = 0.0
+        fwd_header_length = start_bytes
+        min_packet_length = min(start_bytes, end_bytes)
+        packet_length_mean = 0.0
+        syn_flag_count = 0.0
+
+        out[TOTAL_LEN_BWD] = end_bytes
+        out[MAX_PACKET_LENGTH] = max(start_bytes, end_bytes)
+        out[ACT_DATA_PKT_FWD] = 1 if start_bytes > 0 else 0
+        out[MIN_SEG_SIZE_FORWARD] = start_bytes
+        out[FWD_HEADER_LENGTH_1] = start_bytes
+        out[BWD_HEADER_LENGTH] = end_bytes
+
+        # Calculate derived features
+        total_bytes = start_bytes + end_bytes
+        if total_bytes > 0:
+            packet_length_mean = total_bytes / 2
+            variance = ((start_bytes - packet_length_mean) ** 2 + (end_bytes - packet_length_mean) ** 2) / 2
+            out[AVERAGE_PACKET_SIZE] = packet_length_mean
+            out[PACKET_LENGTH_VARIANCE] = variance
+            out[PACKET_LENGTH_STD] = math.sqrt(variance)
+            out[AVG_FWD_SEGMENT_SIZE] = start_bytes
+            out[AVG_BWD_SEGMENT_SIZE] = end_bytes
+            if end_bytes > 0:
+                out[DOWN_UP_RATIO] = start_bytes / end_bytes
+
+        # Protocol specific features
+        protocol = str(packet.get('protocol', '')).upper()
+        if protocol == 'TCP':
+            syn_flag_count = 1.0
+            out[ACK_FLAG_COUNT] = 1
+            out[FWD_PSH_FLAGS] = 1
+            out[BWD_PSH_FLAGS] = 1
+        elif protocol == 'UDP':
+            out[PSH_FLAG_COUNT] = 1
+            out[FWD_PSH_FLAGS] = 1
+        elif protocol == 'ICMP':
+            out[URG_FLAG_COUNT] = 1
+            out[FWD_URG_FLAGS] = 1
+
+        # Port and flow features
+        description = packet.get('description', '')
+        if packet.get('dest_port') is not None:
+            try:
+                destination_port = float(int(packet['dest_port']))
+            except (ValueError, TypeError):
+                pass
+        elif '->' in description:
+            try:
+                destination_port = float(int(description.split('->')[1].strip()))
+            except (ValueError, IndexError):
+                pass
+
+    # ULTRA SHARP: Use ALL attack detector features to enhance ML input
+    if attack_detection and isinstance(attack_detection, dict):
+        try:
+            ps_features = attack_detection.get('port_scan_features') or {}
+            dos_features = attack_detection.get('dos_features') or {}
+            r2l_features = attack_detection.get('r2l_features') or {}
+            u2r_features = attack_detection.get('u2r_features') or {}
+            bf_features = attack_detection.get('brute_force_features') or {}
+
+            # PORT SCAN FEATURES - Map all port scan indicators
+            if ps_features.get('is_port_scan', False) or ps_features.get('port_scan_score', 0) > 0.1:
+                unique_ports = ps_features.get('unique_ports', 0) or 0
+                packets_per_sec = ps_features.get('packets_per_second', 0) or 0
+                port_scan_rate = ps_features.get('port_scan_rate', 0) or 0
+                sequential_score = ps_features.get('sequential_score', 0) or 0
+
+                # High unique ports = port scan signature
+                total_fwd_packets = max(total_fwd_packets, unique_ports * 10)  # Amplify signal
+                flow_packets_s = max(flow_packets_s, packets_per_sec * 2)  # Amplify signal
+                destination_port = 0.0  # Many ports = scan pattern
+                # Sequential ports = strong scan indicator
+                if sequential_score > 0.3:
+                    total_fwd_packets = max(total_fwd_packets, unique_ports * 20)
+                # Port scan rate feature
+                fwd_packets_s = max(fwd_packets_s, port_scan_rate * 5)
+
+            # DOS FEATURES - Map all DoS attack indicators (values capped to prevent overflow)
+            if dos_features.get('is_dos', False) or dos_features.get('dos_score', 0) > 0.1:
+                packets_per_sec = _finite(dos_features.get('packets_per_second', 0), 100000.0)
+                packet_count = _finite(dos_features.get('packet_count', 0), 100000.0)
+                avg_packet_size = _finite(dos_features.get('avg_packet_size', 0), 65535.0)
+                syn_packets = _finite(dos_features.get('syn_packets', 0), 10000.0)
+                bytes_per_sec = _finite(dos_features.get('bytes_per_second', 0), 10000000.0)
+
+                # Extremely high packet rate = DoS (cap amplified values)
+                amplified_pps = min(packets_per_sec * 3, 100000.0)
+                flow_packets_s = max(flow_packets_s, amplified_pps)
+                total_fwd_packets = max(total_fwd_packets, min(packet_count * 2, 100000.0))
+                fwd_packets_s = max(fwd_packets_s, amplified_pps)
+
+                # Small packets at high rate = flood
+                if 0 < avg_packet_size < 200:
+                    min_packet_length = avg_packet_size
+                    packet_length_mean = avg_packet_size
+
+                # SYN flood indicator (cap values)
+                if syn_packets > 20:
+                    syn_flag_count = min(100, syn_packets)
+                    total_fwd_packets = max(total_fwd_packets, min(syn_packets * 5, 50000.0))
+
+                # Bytes per second = bandwidth attack
+                if bytes_per_sec > 0:
+                    total_len_fwd = max(total_len_fwd, min(bytes_per_sec / 10, 1000000.0))
+
+            # R2L FEATURES - Remote to Local attack indicators
+            if r2l_features.get('is_r2l', False) or r2l_features.get('r2l_score', 0) > 0.1:
+                failed_logins = r2l_features.get('failed_logins', 0) or 0
+                privilege_attempts = r2l_features.get('privilege_attempts', 0) or 0
+                suspicious_commands = r2l_features.get('suspicious_commands', 0) or 0
+
+                total_fwd_packets = max(total_fwd_packets, failed_logins * 5)
+                if privilege_attempts > 0:
+                    total_bwd_packets = max(total_bwd_packets, privilege_attempts * 3)
+                if suspicious_commands > 0:
+                    fwd_header_length = max(fwd_header_length, suspicious_commands * 10)
+
+            # U2R FEATURES - User to Root attack indicators
+            if u2r_features.get('is_u2r', False) or u2r_features.get('u2r_score', 0) > 0.1:
+                root_commands = u2r_features.get('root_commands', 0) or 0
+                setuid_attempts = u2r_features.get('setuid_attempts', 0) or 0
+
+                if root_commands > 0:
+                    total_fwd_packets = max(total_fwd_packets, root_commands * 10)
+                if setuid_attempts > 0:
+                    total_bwd_packets = max(total_bwd_packets, setuid_attempts * 8)
+
+            # BRUTE FORCE FEATURES - Login brute force indicators
+            if bf_features.get('is_brute_force', False) or bf_features.get('brute_force_score', 0) > 0.1:
+                failed_attempts = bf_features.get('failed_attempts', 0) or 0
+                login_attempts = bf_features.get('login_attempts', 0) or 0
+                unique_dest_ips = bf_features.get('unique_dest_ips', 0) or 0
+
+                total_fwd_packets = max(total_fwd_packets, failed_attempts * 8)
+                if login_attempts > 0:
+                    flow_packets_s = max(flow_packets_s, login_attempts * 2)
+                # Multiple destinations = distributed brute force
+                if unique_dest_ips > 1:
+                    total_bwd_packets = max(total_bwd_packets, unique_dest_ips * 5)
+
+            # OVERALL ATTACK SCORE - Boost features if ANY attack detected (with capping)
+            if attack_detection.get('is_malicious', False):
+                overall_confidence = max(0.0, min(1.0, float(attack_detection.get('confidence', 0) or 0)))
+                if overall_confidence > 0.7:
+                    flow_packets_s = min(min(flow_packets_s, 50000.0) * 2, 100000.0)
+                    total_fwd_packets = min(min(total_fwd_packets, 50000.0) * 2, 100000.0)
+                    fwd_packets_s = min(min(fwd_packets_s, 50000.0) * 2, 100000.0)
+                elif overall_confidence > 0.5:
+                    flow_packets_s = min(min(flow_packets_s, 50000.0) * 1.5, 100000.0)
+                    total_fwd_packets = min(min(total_fwd_packets, 50000.0) * 1.5, 100000.0)
+        except Exception as e:
+            log.warning("⚠️ Error processing detector features: %s", e)
+
+    out[DESTINATION_PORT] = destination_port
+    out[TOTAL_FWD_PACKETS] = total_fwd_packets
+    out[TOTAL_BWD_PACKETS] = total_bwd_packets
+    out[TOTAL_LEN_FWD] = total_len_fwd
+    out[FLOW_PACKETS_S] = flow_packets_s
+    out[FWD_PACKETS_S] = fwd_packets_s
+    out[FWD_HEADER_LENGTH] = fwd_header_length
+    out[MIN_PACKET_LENGTH] = min_packet_length
+    out[PACKET_LENGTH_MEAN] = packet_length_mean
+    out[SYN_FLAG_COUNT] = syn_flag_count
+
+    if flow is not None:
+        return out
+
+    # Calculate bulk features
+    if start_bytes > 0:
+        out[FWD_AVG_BULK_RATE] = start_bytes
+        out[FWD_AVG_BYTES_BULK] = start_bytes
+        out[FWD_AVG_PACKETS_BULK] = 1
+        out[AVG_FWD_SEGMENT_SIZE] = start_bytes
+    if end_bytes > 0:
+        out[BWD_AVG_BULK_RATE] = end_bytes
+        out[BWD_AVG_BYTES_BULK] = end_bytes
+        out[BWD_AVG_PACKETS_BULK] = 1
+        out[AVG_BWD_SEGMENT_SIZE] = end_bytes
+
+    # Calculate subflow features
+    out[SUBFLOW_FWD_PACKETS] = 1 if start_bytes > 0 else 0
+    out[SUBFLOW_FWD_BYTES] = start_bytes
+    out[SUBFLOW_BWD_PACKETS] = 1 if end_bytes > 0 else 0
+    out[SUBFLOW_BWD_BYTES] = end_bytes
+
+    # Calculate window sizes
+    out[INIT_WIN_BYTES_FORWARD] = start_bytes
+    out[INIT_WIN_BYTES_BACKWARD] = end_bytes
+
+    return out
+
+
+def clean_features(features: np.ndarray) -> np.ndarray:
+    """Replace NaN and +/-inf with 0 in place, in a single pass over the matrix"""
+    return np.nan_to_num(features, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+Offline PCAP Replay
+Scores a capture file through the same detector / model path as the live prediction
+service, as fast as the machine allows: for re-scoring old captures, evaluating a model
+against labelled traffic, or benchmarking without a live sensor.
+
+  * Classic pcap (either byte order, micro- or nanosecond timestamps) and pcapng files
+    are read by a built-in parser (no libpcap / scapy needed).
+  * Every frame becomes the packet dict the Node capture sends: start_ip / end_ip,
+    protocol, "TCP 51000 -> 80" description, frame length, and the per-source
+    packets-this-minute frequency, plus ports, TCP flags / window and the capture time.
+  * The detectors run on capture time instead of the wall clock, so their windows and
+    rates reflect the original traffic, not how fast it is replayed.
+  * With --workers N the packets are partitioned by source IP across N forked worker
+    processes (as in supervisor mode), and several chunks are kept in flight.
+
+Verdicts are written one per packet (NDJSON or CSV), the throughput summary to stderr.
+
+Usage:
+    python3 pcap_replay.py capture.pcap
+    python3 pcap_replay.py capture.pcapng --workers 4 --ml --output verdicts.ndjson
+    python3 pcap_replay.py capture.pcap --format csv --malicious-only --output alerts.csv
+"""
+import argparse
+import csv
+import json
+import mmap
+import os
+import socket
+import struct
+import sys
+import time
+from collections import Counter, deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Link-layer types (https://www.tcpdump.org/linktypes.html)
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+LINKTYPE_RAW_ALIASES = (12, 14)  # DLT_RAW on OpenBSD / other BSDs
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+
+# Same names the Node capture (packetCapture.ts getProtocol) uses
+PROTOCOL_NAMES = {6: 'TCP', 17: 'UDP', 1: 'ICMP', 58: 'ICMP', 2: 'IGMP', 4: 'IPv4', 41: 'IPv6',
+                  47: 'GRE', 50: 'ESP', 51: 'AH'}
+IPV6_EXTENSION_HEADERS = (0, 43, 60)  # Hop-by-hop, routing, destination options
+IPV6_FRAGMENT = 44
+
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_INTERFACE = 1
+PCAPNG_PACKET_OBSOLETE = 2
+PCAPNG_SIMPLE_PACKET = 3
+PCAPNG_ENHANCED_PACKET = 6
+PCAPNG_OPTION_TSRESOL = 9
+
+Frame = Tuple[float, int, bytes, int]  # (epoch seconds, link type, captured bytes, original length)
+
+VERDICT_FIELDS = ['frame', 'timestamp', 'start_ip', 'end_ip', 'protocol', 'src_port', 'dest_port',
+                  'binary_prediction', 'attack_type', 'confidence']
+
+
+class CaptureFormatError(ValueError):
+    """The file is not a pcap / pcapng capture, or is cut short mid-header"""
+
+
+def _pcap_frames(data, endian: str, resolution: float) -> Iterator[Frame]:
+    linktype = struct.unpack_from(endian + 'I', data, 20)[0] & 0xFFFF
+    record = struct.Struct(endian + 'IIII')
+    offset, size = 24, len(data)
+    while offset + 16 <= size:
+        seconds, fraction, captured, original = record.unpack_from(data, offset)
+        offset += 16
+        if offset + captured > size:
+            break  # Truncated last record (capture still being written)
+        yield seconds + fraction * resolution, linktype, data[offset:offset + captured], original
+        offset += captured
+
+
+def _tsresol(options: bytes, endian: str) -> float:
+    """Timestamp unit of a pcapng interface from its if_tsresol option (default microseconds)"""
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack_from(endian + 'HH', options, offset)
+        if code == 0:
+            break
+        if code == PCAPNG_OPTION_TSRESOL and length >= 1:
+            value = options[offset + 4]
+            return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+        offset += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def _pcapng_frames(data) -> Iterator[Frame]:
+    endian = '<'
+    interfaces: List[Tuple[int, float]] = []  # (link type, timestamp unit) per interface of the section
+    last_timestamp = 0.0
+    offset, size = 0, len(data)
+    while offset + 12 <= size:
+        block_type = struct.unpack_from(endian + 'I', data, offset)[0]
+        if block_type == PCAPNG_SECTION_HEADER:
+            # Every section declares its own byte order and interfaces
+            magic = data[offset + 8:offset + 12]
+            endian = '<' if struct.unpack('<I', magic)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            interfaces = []
+        block_length = struct.unpack_from(endian + 'I', data, offset + 4)[0]
+        if block_length < 12 or offset + block_length > size:
+            break
+        body = offset + 8
+        end = offset + block_length - 4
+
+        if block_type == PCAPNG_INTERFACE:
+            linktype = struct.unpack_from(endian + 'H', data, body)[0]
+            interfaces.append((linktype, _tsresol(data[body + 8:end], endian)))
+        elif block_type in (PCAPNG_ENHANCED_PACKET, PCAPNG_PACKET_OBSOLETE):
+            if block_type == PCAPNG_ENHANCED_PACKET:
+                interface, high, low, captured, original = struct.unpack_from(endian + 'IIIII', data, body)
+            else:
+                interface, _, high, low, captured, original = struct.unpack_from(endian + 'HHIIII', data, body)
+            if interface < len(interfaces):
+                linktype, unit = interfaces[interface]
+                last_timestamp = ((high << 32) | low) * unit
+                start = body + 20
+                yield last_timestamp, linktype, data[start:min(start + captured, end)], original
+        elif block_type == PCAPNG_SIMPLE_PACKET and interfaces:
+            # No timestamp in a simple packet block: it inherits the previous packet's
+            original = struct.unpack_from(endian + 'I', data, body)[0]
+            start = body + 4
+            yield last_timestamp, interfaces[0][0], data[start:min(start + original, end)], original
+        offset += block_length
+
+
+def read_frames(path: str) -> Iterator[Frame]:
+    """
+    Frames of a pcap or pcapng file, in file order.
+
+    Raises:
+        CaptureFormatError: If the file is neither
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic = data[:4]
+        if magic in PCAP_MAGIC:
+            if len(data) < 24:
+                raise CaptureFormatError(f"{path}: truncated pcap header")
+            yield from _pcap_frames(data, *PCAP_MAGIC[magic])
+        elif len(data) >= 12 and struct.unpack('<I', magic)[0] == PCAPNG_SECTION_HEADER:
+            yield from _pcapng_frames(data)
+        else:
+            raise CaptureFormatError(f"{path}: not a pcap or pcapng file (magic {magic.hex()})")
+    finally:
+        data.close()
+
+
+def _network_layer(linktype: int, frame: bytes) -> Tuple[int, int]:
+    """(IP version, offset of the IP header) of a frame, (0, 0) if it carries no IP"""
+    if linktype == LINKTYPE_ETHERNET:
+        offset, ethertype = 14, int.from_bytes(frame[12:14], 'big')
+        while ethertype in ETHERTYPE_VLAN and len(frame) >= offset + 4:
+            ethertype = int.from_bytes(frame[offset + 2:offset + 4], 'big')
+            offset += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        offset, ethertype = 16, int.from_bytes(frame[14:16], 'big')
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        offset, ethertype = 20, int.from_bytes(frame[0:2], 'big')
+    elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        # Address family in host (NULL) or network (LOOP) byte order; AF_INET is 2 everywhere
+        family = int.from_bytes(frame[0:4], 'little')
+        if family and not family & 0xFFFF:
+            family >>= 24
+        offset, ethertype = 4, ETHERTYPE_IPV4 if family == 2 else ETHERTYPE_IPV6 if family in (24, 28, 30) else 0
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6) or linktype in LINKTYPE_RAW_ALIASES:
+        version = frame[0] >> 4 if frame else 0
+        offset, ethertype = 0, ETHERTYPE_IPV4 if version == 4 else ETHERTYPE_IPV6 if version == 6 else 0
+    else:
+        return 0, 0
+    if ethertype == ETHERTYPE_IPV4:
+        return 4, offset
+    if ethertype == ETHERTYPE_IPV6:
+        return 6, offset
+    return 0, 0
+
+
+def frame_to_packet(timestamp: float, linktype: int, frame: bytes, length: int) -> Optional[Dict[str, Any]]:
+    """
+    Packet dict for one captured frame, in the form the Node capture sends (frequency is
+    filled in by the caller), or None for frames without an IPv4 / IPv6 header.
+    """
+    version, offset = _network_layer(linktype, frame)
+    if version == 4 and len(frame) >= offset + 20:
+        header = (frame[offset] & 0x0F) * 4
+        protocol = frame[offset + 9]
+        start_ip = socket.inet_ntoa(frame[offset + 12:offset + 16])
+        end_ip = socket.inet_ntoa(frame[offset + 16:offset + 20])
+        # Only the first fragment carries the transport header
+        first_fragment = int.from_bytes(frame[offset + 6:offset + 8], 'big') & 0x1FFF == 0
+        transport = offset + header if first_fragment else -1
+    elif version == 6 and len(frame) >= offset + 40:
+        protocol = frame[offset + 6]
+        start_ip = socket.inet_ntop(socket.AF_INET6, frame[offset + 8:offset + 24])
+        end_ip = socket.inet_ntop(socket.AF_INET6, frame[offset + 24:offset + 40])
+        transport = offset + 40
+        while protocol in IPV6_EXTENSION_HEADERS and len(frame) >= transport + 2:
+            protocol, transport = frame[transport], transport + (frame[transport + 1] + 1) * 8
+        if protocol == IPV6_FRAGMENT and len(frame) >= transport + 8:
+            first_fragment = int.from_bytes(frame[transport + 2:transport + 4], 'big') & 0xFFF8 == 0
+            protocol, transport = frame[transport], transport + 8 if first_fragment else -1
+    else:
+        return None
+
+    name = PROTOCOL_NAMES.get(protocol, f'PROTO_{protocol}')
+    packet = {
+        'start_ip': start_ip,
+        'end_ip': end_ip,
+        'protocol': name,
+        'description': f'{name} packet ({length} bytes)',
+        'start_bytes': min(length, 65535),
+        'end_bytes': min(length, 65535),
+        'timestamp': timestamp,
+    }
+    if protocol in (6, 17) and transport >= 0 and len(frame) >= transport + 4:
+        src_port, dest_port = struct.unpack_from('>HH', frame, transport)
+        packet['src_port'] = src_port
+        packet['dest_port'] = dest_port or None
+        packet['description'] = f'{name} {src_port} -> {dest_port}'
+        if protocol == 6 and len(frame) >= transport + 16:
+            packet['header_length'] = (frame[transport + 12] >> 4) * 4
+            packet['tcp_flags'] = frame[transport + 13]
+            packet['tcp_window'] = int.from_bytes(frame[transport + 14:transport + 16], 'big')
+        elif protocol == 17:
+            packet['header_length'] = 8
+    return packet
+
+
+def read_packets(path: str, stats: Counter) -> Iterator[Dict[str, Any]]:
+    """
+    Packet dicts of a capture, ready for predict_packets(sanitized=True). frequency is the
+    source's packet count in the current capture-time minute, as the Node capture counts it.
+    """
+    frequencies: Dict[Tuple[str, int], int] = {}
+    current_minute = None
+    for index, (timestamp, linktype, frame, length) in enumerate(read_frames(path)):
+        stats['frames'] += 1
+        packet = frame_to_packet(timestamp, linktype, frame, length)
+        if packet is None:
+            stats['skipped'] += 1
+            continue
+        minute = int(timestamp // 60)
+        if minute != current_minute:
+            # Counts of finished minutes are never read again
+            frequencies = {key: count for key, count in frequencies.items() if key[1] >= minute}
+            current_minute = minute
+        key = (packet['start_ip'], minute)
+        frequency = frequencies.get(key, 0) + 1
+        frequencies[key] = frequency
+        packet['frequency'] = float(min(frequency, 1000000))
+        packet['_id'] = str(index)
+        yield packet
+
+
+def _chunks(packets: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for packet in packets:
+        chunk.append(packet)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class VerdictWriter:
+    """Writes one verdict per packet as NDJSON or CSV and counts the verdicts"""
+
+    def __init__(self, stream, fmt: str = 'ndjson', malicious_only: bool = False):
+        self.stream = stream
+        self.malicious_only = malicious_only
+        self.verdicts: Counter = Counter()
+        self._csv = None
+        if fmt == 'csv':
+            self._csv = csv.writer(stream)
+            self._csv.writerow(VERDICT_FIELDS)
+
+    def write(self, packets: List[Dict[str, Any]], results: List[Dict[str, Any]]):
+        for packet, result in zip(packets, results):
+            binary = result.get('binary_prediction', 'benign')
+            self.verdicts[(binary, result.get('attack_type', 'normal'))] += 1
+            if self.stream is None or (self.malicious_only and binary != 'malicious'):
+                continue
+            row = [int(packet['_id']), round(packet['timestamp'], 6), packet['start_ip'], packet['end_ip'],
+                   packet['protocol'], packet.get('src_port'), packet.get('dest_port'), binary,
+                   result.get('attack_type', 'normal'), round(result.get('confidence', {}).get('binary', 0.0), 4)]
+            if self._csv is not None:
+                self._csv.writerow(row)
+            else:
+                record = dict(zip(VERDICT_FIELDS, row))
+                if 'error' in result:
+                    record['error'] = result['error']
+                self.stream.write(json.dumps(record) + '\n')
+
+
+def replay(path: str, writer: VerdictWriter, workers: int = 1, chunk_size: int = 2048,
+           in_flight: int = 4) -> Dict[str, Any]:
+    """
+    Score every packet of a capture in file order (per source with workers > 1).
+    prediction_service must be importable with the environment already set up.
+
+    Returns:
+        Throughput summary
+    """
+    import prediction_service
+    from worker_pool import WorkerPool, fork_available
+
+    # Windows follow capture time; set before forking so every worker inherits it
+    prediction_service.comprehensive_detector.packet_clock = True
+
+    pool = None
+    if workers > 1:
+        if fork_available():
+            # Models (if any) are already loaded here and shared copy-on-write with the workers
+            pool = WorkerPool(workers, init=prediction_service.registry.reset,
+                              handle=lambda packets, deadline=None: prediction_service.predict_packets(
+                                  packets, sanitized=True, deadline=deadline),
+                              fallback=prediction_service._fallback_prediction, max_batch=chunk_size,
+                              timeout=prediction_service.PREDICTION_WORKER_TIMEOUT)
+        else:
+            print("⚠️ Worker processes need fork() - replaying in a single process", file=sys.stderr)
+
+    stats: Counter = Counter()
+    started = time.perf_counter()
+    pending = deque()  # (chunk, gather) in dispatch order
+    try:
+        for chunk in _chunks(read_packets(path, stats), chunk_size):
+            if pool is None:
+                writer.write(chunk, prediction_service.predict_packets(chunk, sanitized=True))
+                continue
+            pending.append((chunk, pool.predict_later(chunk)))
+            if len(pending) >= in_flight:
+                done, gather = pending.popleft()
+                writer.write(done, gather())
+        while pending:
+            done, gather = pending.popleft()
+            writer.write(done, gather())
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    elapsed = time.perf_counter() - started
+
+    scored = sum(writer.verdicts.values())
+    attack_types: Counter = Counter()
+    for (_, attack_type), count in writer.verdicts.items():
+        attack_types[attack_type] += count
+    return {
+        'file': path,
+        'frames': stats['frames'],
+        'packets': scored,
+        'skipped_frames': stats['skipped'],
+        'workers': pool.n_workers if pool is not None else 1,
+        'ml': prediction_service._ml_enabled(),
+        'elapsed_seconds': round(elapsed, 3),
+        'packets_per_second': round(scored / elapsed, 1) if elapsed > 0 else 0.0,
+        'malicious': sum(count for (binary, _), count in writer.verdicts.items() if binary == 'malicious'),
+        'attack_types': dict(attack_types),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a pcap / pcapng capture offline with the IDS detectors and models')
+    parser.add_argument('capture', help='pcap or pcapng file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes, packets partitioned by source IP (default: CPU count)')
+    parser.add_argument('--chunk', type=int, default=2048, help='Packets per dispatched chunk (default: 2048)')
+    parser.add_argument('--in-flight', type=int, default=4,
+                        help='Chunks dispatched ahead of the one being written (default: 4)')
+    parser.add_argument('--ml', action='store_true', help='Load the ML models (USE_ML_MODELS=true)')
+    parser.add_argument('--flow-features', action='store_true',
+                        help='Feed the models real per-flow features (FLOW_FEATURES=true)')
+    parser.add_argument('--output', default='-', help="Verdict file ('-' = stdout, '' = summary only)")
+    parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson', help='Verdict format')
+    parser.add_argument('--malicious-only', action='store_true', help='Write only malicious verdicts')
+    parser.add_argument('--summary', default='', help='Also write the summary as JSON to this file')
+    args = parser.parse_args()
+
+    # prediction_service reads its configuration at import time
+    os.environ['USE_ML_MODELS'] = 'true' if args.ml else os.environ.get('USE_ML_MODELS', 'false')
+    if args.flow_features:
+        os.environ['FLOW_FEATURES'] = 'true'
+    os.environ['DETECTOR_BACKEND'] = 'memory'  # Shared-memory windows run on the wall clock
+    os.environ['MICRO_BATCH'] = 'false'
+
+    if not args.output:
+        stream = None
+    elif args.output == '-':
+        stream = sys.stdout
+    else:
+        stream = open(args.output, 'w', newline='' if args.format == 'csv' else None)
+    try:
+        writer = VerdictWriter(stream, args.format, args.malicious_only)
+        summary = replay(args.capture, writer, max(1, args.workers), max(1, args.chunk), max(1, args.in_flight))
+    except (OSError, CaptureFormatError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if stream is not None and stream is not sys.stdout:
+            stream.close()
+
+    print(f"📊 {summary['packets']} packets ({summary['skipped_frames']} non-IP frames skipped) in "
+          f"{summary['elapsed_seconds']:.2f} s with {summary['workers']} worker(s): "
+          f"{summary['packets_per_second']:.0f} packets/s, {summary['malicious']} malicious", file=sys.stderr)
+    for attack_type, count in sorted(summary['attack_types'].items(), key=lambda item: -item[1]):
+        print(f"   {attack_type}: {count}", file=sys.stderr)
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -23,7 +23,8 @@ class PortScanDetector:
         })
         self.lock = threading.Lock()
         
-        # Cleanup old data periodically
+        # Cleanup old data periodically (add_packet sweeps once per time window)
+        self._last_cleanup = datetime.now()
         self._cleanup_old_data()
     
     def _cleanup_old_data(self):
@@ -59,6 +60,10 @@ class PortScanDetector:
         now = datetime.now()
         cutoff_time = now - timedelta(seconds=self.time_window)
         
+        if now - self._last_cleanup > timedelta(seconds=self.time_window):
+            self._last_cleanup = now
+            self._cleanup_old_data()
+        
         with self.lock:
             data = self.port_tracking[source_ip]
             
@@ -0,0 +1,95 @@
+"""
+Prediction Cache
+Bounded LRU cache of model outputs keyed on feature rows. Steady benign traffic
+produces the same feature row over and over; a cached row skips both forests.
+
+The key is a 16-byte blake2b digest of the row. By default (mantissa_bits=23) rows are
+keyed exactly and a hit returns the models' own output for that row. With fewer
+mantissa_bits, rows are quantized by clearing the low mantissa bits of every float32
+value (relative precision 2^-mantissa_bits at any magnitude) and a hit returns the
+probabilities computed for the first row that fell into the same quantization cell:
+a row close to a split threshold can then get a neighbour's probabilities, so this
+trades verdict fidelity for hit rate.
+
+A cache belongs to one InferenceEngine: a reloaded model comes with a new, empty cache,
+so results of the old models are never served for the new ones.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+FLOAT32_MANTISSA_BITS = 23
+
+
+class PredictionCache:
+    """Thread-safe LRU map from quantized feature row to (binary proba row, multiclass proba row)"""
+
+    def __init__(self, max_entries: int = 65536, mantissa_bits: int = FLOAT32_MANTISSA_BITS):
+        """
+        Args:
+            max_entries: Rows kept; the least recently used row is evicted beyond this
+            mantissa_bits: float32 mantissa bits kept in the key (23 = exact rows, lossless)
+        """
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        self.max_entries = int(max_entries)
+        self.mantissa_bits = max(0, min(int(mantissa_bits), FLOAT32_MANTISSA_BITS))
+        self._mask = np.uint32((0xFFFFFFFF << (FLOAT32_MANTISSA_BITS - self.mantissa_bits)) & 0xFFFFFFFF)
+        self._entries: "OrderedDict[bytes, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def keys(self, features: np.ndarray) -> List[bytes]:
+        """Cache key of every row of a float32 feature matrix"""
+        quantized = np.ascontiguousarray(features, dtype=np.float32).view(np.uint32) & self._mask
+        # -0.0 and +0.0 score the same; give them the same key
+        quantized[quantized == 0x80000000] = 0
+        return [hashlib.blake2b(row.tobytes(), digest_size=16).digest() for row in quantized]
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[Tuple[np.ndarray, np.ndarray]]]:
+        """Cached outputs for each key (None for misses), refreshing the hits' recency"""
+        found = []
+        entries = self._entries
+        with self._lock:
+            for key in keys:
+                value = entries.get(key)
+                if value is not None:
+                    entries.move_to_end(key)
+                found.append(value)
+            n_hits = sum(1 for value in found if value is not None)
+            self.hits += n_hits
+            self.misses += len(keys) - n_hits
+        return found
+
+    def put_many(self, keys: List[bytes], binary_proba: np.ndarray, multiclass_proba: np.ndarray):
+        """Store one output row per key, evicting the least recently used rows beyond max_entries"""
+        entries = self._entries
+        with self._lock:
+            for key, binary_row, multiclass_row in zip(keys, binary_proba, multiclass_proba):
+                # Copies, so a cached row does not keep its whole batch matrix alive
+                entries[key] = (binary_row.copy(), multiclass_row.copy())
+                entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def describe(self) -> Dict[str, object]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'mantissa_bits': self.mantissa_bits,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+        }
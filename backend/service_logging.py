@@ -0,0 +1,156 @@
+"""
+Service Logging
+Leveled logging for the prediction service whose cost per call stays flat however
+many packets are flagged:
+
+- Request threads never write to stdout. Records go into a bounded queue that a
+  background thread drains; when the queue is full the record is dropped (and counted)
+  instead of blocking the request.
+- Every message template (the format string, not the formatted text) is rate limited
+  to LOG_RATE_LIMIT records per second; the next record that gets through says how many
+  similar ones were suppressed.
+- Records at INFO and below can additionally be sampled (LOG_SAMPLE_RATE).
+
+Messages use %-style arguments (log.info("x %s", value)) so that records below the
+configured level, or suppressed ones, are never formatted.
+
+Environment variables:
+    LOG_LEVEL        DEBUG / INFO / WARNING / ERROR (default INFO)
+    LOG_RATE_LIMIT   records per second per message template, 0 = unlimited (default 20)
+    LOG_SAMPLE_RATE  fraction of INFO / DEBUG records kept (default 1.0)
+    LOG_QUEUE_SIZE   records buffered for the writer thread (default 10000)
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+LOGGER_NAME = 'ids'
+MAX_TRACKED_TEMPLATES = 4096
+
+_listener = None
+_handler = None
+_configure_lock = threading.Lock()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger of one module, e.g. get_logger('prediction_service')"""
+    return logging.getLogger(f'{LOGGER_NAME}.{name}')
+
+
+class RateLimitFilter(logging.Filter):
+    """Per message template: at most `rate` records per second, plus optional sampling"""
+
+    def __init__(self, rate: float = 20, sample_rate: float = 1.0):
+        super().__init__()
+        self.rate = float(rate)
+        self.sample_rate = float(sample_rate)
+        self._windows = {}  # template key -> [window second, records passed, records suppressed]
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.sample_rate < 1.0 and record.levelno <= logging.INFO and random.random() >= self.sample_rate:
+            self.suppressed += 1
+            return False
+        if self.rate <= 0:
+            return True
+
+        key = (record.name, record.levelno, record.msg if isinstance(record.msg, str) else type(record.msg))
+        second = int(time.monotonic())
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                if len(self._windows) >= MAX_TRACKED_TEMPLATES:
+                    self._windows.clear()
+                window = self._windows[key] = [second, 0, 0]
+            elif window[0] != second:
+                window[0] = second
+                window[1] = 0
+            if window[1] >= self.rate:
+                window[2] += 1
+                self.suppressed += 1
+                return False
+            window[1] += 1
+            suppressed, window[2] = window[2], 0
+
+        if suppressed:
+            record.msg = f"{record.msg} (+{suppressed} similar suppressed)"
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of waiting when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(level: str = None, rate_limit: float = None, sample_rate: float = None,
+                      queue_size: int = None) -> logging.Handler:
+    """
+    Route the root logger (including Flask / werkzeug) through the rate-limited, non-blocking
+    queue. Arguments default to the LOG_* environment variables. Safe to call more than once.
+    """
+    global _listener, _handler
+    with _configure_lock:
+        if _handler is not None:
+            return _handler
+
+        level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+        rate_limit = float(os.getenv('LOG_RATE_LIMIT', '20')) if rate_limit is None else rate_limit
+        sample_rate = float(os.getenv('LOG_SAMPLE_RATE', '1.0')) if sample_rate is None else sample_rate
+        queue_size = int(os.getenv('LOG_QUEUE_SIZE', '10000')) if queue_size is None else queue_size
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)-7s %(message)s'))
+
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+        handler.addFilter(RateLimitFilter(rate_limit, sample_rate))
+
+        root = logging.getLogger()
+        root.setLevel(getattr(logging, level, logging.INFO))
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+
+        _handler = handler
+        _start_listener(output)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=lambda: _start_listener(output))
+        return handler
+
+
+def _start_listener(output: logging.Handler):
+    """
+    Start the writer thread on a fresh queue. Also runs in forked children (e.g. prediction
+    workers): threads do not survive fork and the parent's queue lock may have been held.
+    """
+    global _listener
+    _handler.queue = queue.Queue(maxsize=_handler.queue.maxsize)
+    for log_filter in _handler.filters:
+        if isinstance(log_filter, RateLimitFilter):
+            log_filter._lock = threading.Lock()
+    _listener = QueueListener(_handler.queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)  # Flush what is still queued at exit
+
+
+def stats() -> dict:
+    """Records dropped because the queue was full / suppressed by rate limiting or sampling"""
+    if _handler is None:
+        return {'dropped': 0, 'suppressed': 0}
+    rate_filter = next((f for f in _handler.filters if isinstance(f, RateLimitFilter)), None)
+    return {'dropped': _handler.dropped, 'suppressed': rate_filter.suppressed if rate_filter else 0}
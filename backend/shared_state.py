@@ -0,0 +1,329 @@
+"""
+Shared-Memory Detector State
+Per-source window counters for the port scan, DoS and brute force detectors, stored in
+a multiprocessing.shared_memory fixed-slot hash table so several prediction processes
+(e.g. behind a plain load balancer) update and read the same windows.
+
+Each slot holds one source: 1-second packet/byte buckets over the 60 s window, login /
+failed-login buckets over the 300 s window, a destination port bitmap, a small set of
+destination addresses and a ring of recent ports for the sequential-scan check. Windows
+therefore have 1-second resolution instead of per-packet timestamps. The verdicts are
+computed by the same scoring functions as the in-process detectors.
+
+Slots are locked individually: an fcntl byte-range lock (one byte per slot) serializes
+processes, and a striped threading.Lock serializes threads of one process (fcntl locks
+are per process). When a probe window is full the least recently seen source is evicted.
+
+Usage:
+    DETECTOR_BACKEND=shared python3 prediction_service.py
+    python3 shared_state.py            # table occupancy
+    python3 shared_state.py --reset    # remove the shared segment
+"""
+import argparse
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from attack_detectors import (ComprehensiveAttackDetector, score_brute_force, score_dos, score_port_scan,
+                              sequential_port_score)
+from service_logging import get_logger
+
+log = get_logger('shared_state')
+
+PACKET_WINDOW = 60      # seconds, port scan + DoS windows (PortScanDetector / DoSDetector)
+LOGIN_WINDOW = 300      # seconds, brute force window (BruteForceDetector)
+MAX_DEST_IPS = 32       # distinct destinations remembered per source; counts saturate here
+SEQUENCE_RING = 256     # recent ports kept for the sequential-scan check
+PROBE_LIMIT = 16        # slots probed (linear probing) before evicting
+THREAD_LOCK_STRIPES = 64
+
+MAGIC = 0x4944535354415445  # 'IDSSTATE'
+VERSION = 1
+HEADER_BYTES = 64
+
+HEADER_DTYPE = np.dtype([
+    ('magic', '<u8'),
+    ('version', '<u4'),
+    ('slot_size', '<u4'),
+    ('n_slots', '<u8'),
+])
+
+SLOT_DTYPE = np.dtype([
+    ('key', '<u8'),                              # source address hash, 0 = free
+    ('last_seen', '<f8'),
+    ('pkt_sec', '<i8', (PACKET_WINDOW,)),        # absolute second held by each bucket
+    ('pkt_count', '<u4', (PACKET_WINDOW,)),
+    ('pkt_bytes', '<u8', (PACKET_WINDOW,)),
+    ('pkt_first', '<f8', (PACKET_WINDOW,)),      # first packet time within the bucket
+    ('login_sec', '<i8', (LOGIN_WINDOW,)),
+    ('login_count', '<u4', (LOGIN_WINDOW,)),
+    ('failed_count', '<u4', (LOGIN_WINDOW,)),
+    ('n_ports', '<u4'),
+    ('n_dest_ips', '<u4'),
+    ('dest_ips', '<u4', (MAX_DEST_IPS,)),        # crc32 of destination addresses
+    ('seq_count', '<u8'),
+    ('seq_port', '<u2', (SEQUENCE_RING,)),
+    ('seq_ts', '<f8', (SEQUENCE_RING,)),
+    ('port_bitmap', 'u1', (65536 // 8,)),
+], align=True)
+
+
+def _source_key(source_ip: str) -> int:
+    key = int.from_bytes(hashlib.blake2b(source_ip.encode('utf-8', 'replace'), digest_size=8).digest(), 'little')
+    return key or 1
+
+
+def _untrack(shm: shared_memory.SharedMemory):
+    """Keep the segment when this process exits; it belongs to every worker, not just its creator"""
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+class SharedDetectorState:
+    """Fixed-slot hash table of per-source window counters in shared memory"""
+
+    def __init__(self, name: str = 'ids_detector_state', n_slots: int = 2048):
+        """
+        Create the segment, or attach to it if another process already did (its size wins).
+
+        Raises:
+            RuntimeError: If an existing segment has an incompatible layout
+        """
+        self.name = name
+        size = HEADER_BYTES + int(n_slots) * SLOT_DTYPE.itemsize
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            created = True
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+            created = False
+        _untrack(self._shm)
+
+        self._header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self._shm.buf)
+        if created:
+            self._header['version'] = VERSION
+            self._header['slot_size'] = SLOT_DTYPE.itemsize
+            self._header['n_slots'] = n_slots
+            self._header['magic'] = MAGIC  # Written last: attachers wait for it
+        else:
+            deadline = time.monotonic() + 5.0
+            while int(self._header['magic']) != MAGIC and time.monotonic() < deadline:
+                time.sleep(0.01)
+            if int(self._header['magic']) != MAGIC:
+                raise RuntimeError(f"Shared detector state '{name}' was never initialized")
+            if int(self._header['version']) != VERSION or int(self._header['slot_size']) != SLOT_DTYPE.itemsize:
+                raise RuntimeError(f"Shared detector state '{name}' has an incompatible layout; "
+                                   f"remove it with: python3 shared_state.py --reset")
+
+        self.n_slots = int(self._header['n_slots'])
+        self.slots = np.ndarray((self.n_slots,), dtype=SLOT_DTYPE, buffer=self._shm.buf, offset=HEADER_BYTES)
+
+        lock_path = os.path.join(tempfile.gettempdir(), f'{name}.lock')
+        self._lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._thread_locks = [threading.Lock() for _ in range(THREAD_LOCK_STRIPES)]
+        self.evictions = 0  # In this process
+
+        action = "Created" if created else "Attached to"
+        log.info("🧠 %s shared detector state '%s': %d slots, %.1f MB",
+                 action, name, self.n_slots, self._shm.size / 1e6)
+
+    @contextmanager
+    def _locked(self, index: int):
+        with self._thread_locks[index % THREAD_LOCK_STRIPES]:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX, 1, index)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, index)
+
+    def _reset_slot(self, index: int, key: int):
+        slot = self.slots[index]
+        slot.fill(0)
+        slot['key'] = key
+
+    def record(self, source_ip: str, dest_ip: str, dest_port, packet_size: int,
+               is_login_attempt: bool, is_failed: bool, now: float = None):
+        """
+        Add one packet to its source's windows and read back the detector features.
+
+        Returns:
+            (port_scan_features, dos_features, brute_force_features)
+        """
+        now = time.time() if now is None else float(now)
+        key = _source_key(source_ip)
+        home = key % self.n_slots
+
+        oldest_index, oldest_seen = home, float('inf')
+        for probe in range(min(PROBE_LIMIT, self.n_slots)):
+            index = (home + probe) % self.n_slots
+            with self._locked(index):
+                slot_key = int(self.slots['key'][index])
+                if slot_key == 0:
+                    self._reset_slot(index, key)
+                    slot_key = key
+                if slot_key == key:
+                    return self._update(index, dest_ip, dest_port, packet_size, is_login_attempt, is_failed, now)
+                last_seen = float(self.slots['last_seen'][index])
+            if last_seen < oldest_seen:
+                oldest_index, oldest_seen = index, last_seen
+
+        # Probe window full: take over the least recently seen source
+        with self._locked(oldest_index):
+            if int(self.slots['key'][oldest_index]) != key:
+                self._reset_slot(oldest_index, key)
+                self.evictions += 1
+            return self._update(oldest_index, dest_ip, dest_port, packet_size, is_login_attempt, is_failed, now)
+
+    def _update(self, index: int, dest_ip: str, dest_port, packet_size: int,
+                is_login_attempt: bool, is_failed: bool, now: float):
+        """Caller holds the slot lock"""
+        slot = self.slots[index]
+        slot['last_seen'] = now
+        second = int(now // 1)
+
+        # Packet / byte buckets (port scan + DoS)
+        bucket = second % PACKET_WINDOW
+        pkt_sec, pkt_count, pkt_bytes, pkt_first = slot['pkt_sec'], slot['pkt_count'], slot['pkt_bytes'], slot['pkt_first']
+        if pkt_sec[bucket] != second:
+            pkt_sec[bucket] = second
+            pkt_count[bucket] = 0
+            pkt_bytes[bucket] = 0
+            pkt_first[bucket] = now
+        pkt_count[bucket] += 1
+        pkt_bytes[bucket] += packet_size
+
+        # Destination addresses
+        dest_ips = slot['dest_ips']
+        n_dest_ips = int(slot['n_dest_ips'])
+        dest_hash = zlib.crc32(dest_ip.encode('utf-8', 'replace')) or 1
+        if n_dest_ips < MAX_DEST_IPS and dest_hash not in dest_ips[:n_dest_ips]:
+            dest_ips[n_dest_ips] = dest_hash
+            n_dest_ips += 1
+            slot['n_dest_ips'] = n_dest_ips
+
+        # Destination ports
+        n_ports = int(slot['n_ports'])
+        if dest_port:
+            bitmap = slot['port_bitmap']
+            byte, bit = dest_port >> 3, 1 << (dest_port & 7)
+            if not bitmap[byte] & bit:
+                bitmap[byte] |= bit
+                n_ports += 1
+                slot['n_ports'] = n_ports
+            seq_count = int(slot['seq_count'])
+            slot['seq_port'][seq_count % SEQUENCE_RING] = dest_port
+            slot['seq_ts'][seq_count % SEQUENCE_RING] = now
+            slot['seq_count'] = seq_count + 1
+
+        # Login buckets (brute force)
+        login_sec, login_count, failed_count = slot['login_sec'], slot['login_count'], slot['failed_count']
+        if is_login_attempt:
+            bucket = second % LOGIN_WINDOW
+            if login_sec[bucket] != second:
+                login_sec[bucket] = second
+                login_count[bucket] = 0
+                failed_count[bucket] = 0
+            login_count[bucket] += 1
+            if is_failed:
+                failed_count[bucket] += 1
+
+        # Read back the windows; a bucket counts if any part of its second is inside the window
+        recent = pkt_sec > now - PACKET_WINDOW - 1
+        packet_count = int(pkt_count[recent].sum())
+        total_bytes = int(pkt_bytes[recent].sum())
+        time_span = (now - float(pkt_first[recent].min())) or 1
+
+        n_sequence = min(int(slot['seq_count']), SEQUENCE_RING)
+        seq_recent = slot['seq_ts'][:n_sequence] > now - PACKET_WINDOW
+        sequential_score = sequential_port_score(slot['seq_port'][:n_sequence][seq_recent].tolist())
+
+        login_recent = login_sec > now - LOGIN_WINDOW - 1
+        login_attempts = int(login_count[login_recent].sum())
+        failed_attempts = int(failed_count[login_recent].sum())
+
+        return (
+            score_port_scan(n_ports, n_dest_ips, packet_count, time_span, sequential_score),
+            score_dos(packet_count, total_bytes, time_span, n_dest_ips, 0),
+            score_brute_force(login_attempts, failed_attempts, 0, n_ports)
+        )
+
+    def occupancy(self) -> int:
+        return int(np.count_nonzero(self.slots['key']))
+
+    def close(self):
+        del self.slots, self._header
+        self._shm.close()
+        os.close(self._lock_fd)
+
+    def unlink(self):
+        """Remove the segment for every process (it disappears once all of them close it)"""
+        try:
+            # SharedMemory.unlink() unregisters from the resource tracker; register first to match
+            from multiprocessing import resource_tracker
+            resource_tracker.register(self._shm._name, 'shared_memory')
+        except Exception:
+            pass
+        self._shm.unlink()
+
+
+class SharedMemoryAttackDetector(ComprehensiveAttackDetector):
+    """ComprehensiveAttackDetector whose port scan / DoS / brute force windows live in shared memory"""
+
+    def __init__(self, state: SharedDetectorState, **bounds):
+        super().__init__(**bounds)
+        self.state = state
+
+    @classmethod
+    def from_env(cls, **bounds) -> 'SharedMemoryAttackDetector':
+        return cls(SharedDetectorState(
+            os.getenv('DETECTOR_SHM_NAME', 'ids_detector_state'),
+            int(os.getenv('DETECTOR_SHM_SLOTS', '2048'))
+        ), **bounds)
+
+    def _update_and_get_features(self, source_ip: str, dest_ip: str, dest_port, packet_size: int,
+                                 protocol: str, is_login_attempt: bool, is_failed: bool, is_syn: bool = False):
+        # The slot layout has no SYN buckets; shared windows report syn_packets as 0
+        port_scan_features, dos_features, brute_force_features = self.state.record(
+            source_ip, dest_ip, dest_port, packet_size, is_login_attempt, is_failed
+        )
+        # R2L / U2R windows are not fed by analyze_packet and no in-process SourceState is
+        # created here, so they always read empty
+        return (port_scan_features, dos_features, self.r2l_detector._default_features(),
+                self.u2r_detector._default_features(), brute_force_features)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or remove the shared detector state')
+    parser.add_argument('--name', default=os.getenv('DETECTOR_SHM_NAME', 'ids_detector_state'))
+    parser.add_argument('--reset', action='store_true', help='Remove the shared segment')
+    args = parser.parse_args()
+
+    try:
+        shm = shared_memory.SharedMemory(name=args.name)
+    except FileNotFoundError:
+        print(f"No shared detector state named '{args.name}'")
+        return
+    _untrack(shm)
+    shm.close()
+
+    state = SharedDetectorState(args.name)
+    print(f"🧠 Shared detector state '{args.name}': {state.occupancy()} of {state.n_slots} slots in use")
+    if args.reset:
+        state.unlink()
+        print(f"🗑️ Removed shared detector state '{args.name}'")
+    state.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@ import { Cap } from 'cap';
 import { Packet as PacketModel, IPacket } from '../models/Packet';
 import { getIO } from '../socket';
 import axios from 'axios';
+import { PredictionSocketClient } from './predictionSocket';
 
 // Track packet frequencies for status determination with automatic cleanup
 const packetFrequencies: { [key: string]: { count: number; timestamp: number } } = {};
@@ -90,6 +91,7 @@ export class PacketCaptureService {
   private linkType: string;
   private buffer: Buffer;
   private predictionServiceUrl: string;
+  private predictionSocket: PredictionSocketClient | null; // Set when PREDICTION_SOCKET is configured
   private packetHandler: ((nbytes: number, trunc: boolean) => void) | null = null;
   private userId: string;
   private packetCount: number = 0; // Track total packets for sampling
@@ -100,6 +102,9 @@ export class PacketCaptureService {
     this.linkType = 'ETHERNET';
     this.buffer = Buffer.alloc(65535);
     this.predictionServiceUrl = 'http://127.0.0.1:5002/predict';
+    this.predictionSocket = process.env.PREDICTION_SOCKET
+      ? new PredictionSocketClient(process.env.PREDICTION_SOCKET, 10000)
+      : null;
     this.userId = userId;
 
     // Initialize the capture device
@@ -459,12 +464,20 @@ export class PacketCaptureService {
         // Queue the request if we're at max capacity
         const makePredictionRequest = async () => {
           try {
-            const response = await axios.post(this.predictionServiceUrl, {
-              packet: packetData
-            }, { 
-              timeout: 10000, // Increased timeout to 10 seconds
-              validateStatus: () => true // Don't throw on HTTP errors
-            });
+            // Prefer the persistent Unix socket; the HTTP endpoint returns the same JSON.
+            // The socket has no status line: a verdict carrying an error (e.g. a request shed
+            // by admission control, 429 over HTTP) is a failed request, not a benign verdict
+            const response = this.predictionSocket
+              ? await this.predictionSocket.predict({ packet: packetData }).then((data) => ({
+                  status: data && data.error ? 503 : 200,
+                  data
+                }))
+              : await axios.post(this.predictionServiceUrl, {
+                  packet: packetData
+                }, { 
+                  timeout: 10000, // Increased timeout to 10 seconds
+                  validateStatus: () => true // Don't throw on HTTP errors
+                });
 
             if (response.status >= 200 && response.status < 300 && response.data) {
               recordSuccess();
@@ -514,7 +527,8 @@ export class PacketCaptureService {
               });
             } else {
               // HTTP error response
-              throw new Error(`Prediction service returned status ${response.status}`);
+              const detail = response.data?.error ? `: ${response.data.error}` : '';
+              throw new Error(`Prediction service returned status ${response.status}${detail}`);
             }
           } catch (err: any) {
             recordFailure();
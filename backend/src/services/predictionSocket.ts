@@ -0,0 +1,97 @@
+import net from 'net';
+
+// Client for the prediction service's Unix domain socket (backend/uds_server.py).
+// Frames: payload_length u32 LE | request_id u32 LE | kind u8 | JSON payload.
+// Requests are pipelined on one long-lived connection and matched to answers by request_id.
+
+const HEADER_BYTES = 9;
+const KIND_JSON = 0;
+
+type Pending = {
+  resolve: (value: any) => void;
+  reject: (err: Error) => void;
+  timer: NodeJS.Timeout;
+};
+
+export class PredictionSocketClient {
+  private socket: net.Socket | null = null;
+  private connected = false;
+  private buffer: Buffer = Buffer.alloc(0);
+  private pending = new Map<number, Pending>();
+  private nextId = 1;
+
+  constructor(private path: string, private timeoutMs: number = 10000) {}
+
+  private connect(): net.Socket {
+    if (this.socket) return this.socket;
+    const socket = net.createConnection(this.path);
+    socket.on('connect', () => {
+      this.connected = true;
+      console.info('[prediction-socket] connected to', this.path);
+    });
+    socket.on('data', (chunk: Buffer) => this.onData(chunk));
+    socket.on('error', (err) => {
+      console.warn('[prediction-socket] error:', err?.message || err);
+    });
+    socket.on('close', () => {
+      this.socket = null;
+      this.connected = false;
+      this.buffer = Buffer.alloc(0);
+      const pending = this.pending;
+      this.pending = new Map();
+      for (const entry of pending.values()) {
+        clearTimeout(entry.timer);
+        entry.reject(new Error('Prediction socket closed'));
+      }
+    });
+    this.socket = socket;
+    return socket;
+  }
+
+  private onData(chunk: Buffer) {
+    this.buffer = this.buffer.length ? Buffer.concat([this.buffer, chunk]) : chunk;
+    while (this.buffer.length >= HEADER_BYTES) {
+      const length = this.buffer.readUInt32LE(0);
+      if (this.buffer.length < HEADER_BYTES + length) break;
+      const requestId = this.buffer.readUInt32LE(4);
+      const payload = this.buffer.subarray(HEADER_BYTES, HEADER_BYTES + length);
+      this.buffer = this.buffer.subarray(HEADER_BYTES + length);
+
+      const entry = this.pending.get(requestId);
+      if (!entry) continue;
+      this.pending.delete(requestId);
+      clearTimeout(entry.timer);
+      try {
+        entry.resolve(JSON.parse(payload.toString('utf8')));
+      } catch (err: any) {
+        entry.reject(err);
+      }
+    }
+  }
+
+  isConnected(): boolean {
+    return this.connected;
+  }
+
+  // Same body and answer as POST /predict: a packet ({ packet }) or a list of packets
+  predict(body: any): Promise<any> {
+    const socket = this.connect();
+    const requestId = this.nextId;
+    this.nextId = this.nextId >= 0xffffffff ? 1 : this.nextId + 1;
+
+    const payload = Buffer.from(JSON.stringify(body), 'utf8');
+    const header = Buffer.alloc(HEADER_BYTES);
+    header.writeUInt32LE(payload.length, 0);
+    header.writeUInt32LE(requestId, 4);
+    header.writeUInt8(KIND_JSON, 8);
+
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        this.pending.delete(requestId);
+        reject(new Error(`Prediction socket timeout after ${this.timeoutMs}ms`));
+      }, this.timeoutMs);
+      this.pending.set(requestId, { resolve, reject, timer });
+      socket.write(Buffer.concat([header, payload]));
+    });
+  }
+}
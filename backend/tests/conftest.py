@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The service modules are imported by file name, as prediction_service.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,131 @@
+"""Admission control: priority eviction, cancelled waiters, shed reasons and slot hand-off"""
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, Overloaded
+
+
+def wait_for(predicate, timeout=2.0):
+    limit = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < limit, 'condition not reached'
+        time.sleep(0.001)
+
+
+class Waiter(threading.Thread):
+    """acquire() on a thread; outcome is 'admitted' or the Overloaded reason"""
+
+    def __init__(self, controller, priority=False, deadline=None):
+        super().__init__(daemon=True)
+        self.controller = controller
+        self.priority = priority
+        self.deadline = deadline
+        self.outcome = None
+
+    def run(self):
+        try:
+            self.controller.acquire(priority=self.priority, deadline=self.deadline)
+            self.outcome = 'admitted'
+        except Overloaded as e:
+            self.outcome = e.reason
+
+
+def enqueue(controller, **kwargs):
+    """Start a waiter and return once it is queued"""
+    queued = controller.snapshot()['queued']
+    waiter = Waiter(controller, **kwargs)
+    waiter.start()
+    wait_for(lambda: controller.snapshot()['queued'] == queued + 1 or waiter.outcome is not None)
+    return waiter
+
+
+def test_priority_waiter_evicts_the_newest_ordinary_waiter():
+    controller = AdmissionController(max_in_flight=1, max_queue=2, queue_timeout_ms=5000)
+    controller.acquire()
+    oldest = enqueue(controller)
+    newest = enqueue(controller)
+
+    flagged = Waiter(controller, priority=True)
+    flagged.start()
+    newest.join(2)
+    assert newest.outcome == 'evicted'
+    wait_for(lambda: controller.snapshot()['queued'] == 2)
+
+    # The flagged request is served first, then the remaining ordinary one
+    controller.release()
+    flagged.join(2)
+    assert flagged.outcome == 'admitted' and oldest.outcome is None
+    controller.release()
+    oldest.join(2)
+    assert oldest.outcome == 'admitted'
+    assert controller.shed == {'evicted': 1}
+
+
+def test_full_queue_without_ordinary_waiters_sheds_the_priority_request():
+    controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout_ms=5000)
+    controller.acquire()
+    queued = enqueue(controller, priority=True)
+
+    with pytest.raises(Overloaded) as excinfo:
+        controller.acquire(priority=True)
+    assert excinfo.value.reason == 'queue_full'
+    controller.release()
+    queued.join(2)
+    assert queued.outcome == 'admitted'
+
+
+def test_release_skips_a_cancelled_waiter():
+    controller = AdmissionController(max_in_flight=1, max_queue=2, queue_timeout_ms=5000)
+    controller.acquire()
+    gave_up = enqueue(controller, deadline=time.monotonic() + 0.05)
+    patient = enqueue(controller)
+    gave_up.join(2)
+    assert gave_up.outcome == 'deadline'
+    assert controller.snapshot() == {'in_flight': 1, 'queued': 1}
+
+    # The cancelled waiter is still in the heap ahead of the patient one
+    controller.release()
+    patient.join(2)
+    assert patient.outcome == 'admitted'
+    assert controller.snapshot() == {'in_flight': 1, 'queued': 0}
+
+
+def test_shed_reason_is_queue_timeout_unless_the_deadline_passed():
+    controller = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout_ms=30)
+    controller.acquire()
+
+    with pytest.raises(Overloaded) as excinfo:
+        controller.acquire(deadline=time.monotonic() + 5)
+    assert excinfo.value.reason == 'queue_timeout'
+    with pytest.raises(Overloaded) as excinfo:
+        controller.acquire(deadline=time.monotonic() + 0.01)
+    assert excinfo.value.reason == 'deadline'
+    with pytest.raises(Overloaded) as excinfo:
+        controller.acquire()
+    assert excinfo.value.reason == 'queue_timeout'
+
+    assert controller.shed == {'queue_timeout': 2, 'deadline': 1}
+    assert controller.snapshot() == {'in_flight': 1, 'queued': 0}
+
+
+def test_handed_off_slot_keeps_in_flight_exact():
+    controller = AdmissionController(max_in_flight=2, max_queue=4, queue_timeout_ms=5000)
+    controller.acquire()
+    controller.acquire()
+    waiters = [enqueue(controller) for _ in range(2)]
+
+    controller.release()
+    wait_for(lambda: sum(waiter.outcome == 'admitted' for waiter in waiters) == 1)
+    assert controller.snapshot() == {'in_flight': 2, 'queued': 1}
+    controller.release()
+    for waiter in waiters:
+        waiter.join(2)
+        assert waiter.outcome == 'admitted'
+    assert controller.snapshot() == {'in_flight': 2, 'queued': 0}
+
+    controller.release()
+    controller.release()
+    assert controller.snapshot() == {'in_flight': 0, 'queued': 0}
+    assert controller.admitted == 4
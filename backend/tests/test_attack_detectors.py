@@ -0,0 +1,123 @@
+"""
+Window semantics of ComprehensiveAttackDetector, driven with pinned packet timestamps.
+Windows are 1-second buckets: a bucket leaves the 60 s packet window (300 s login window)
+once the current packet falls 60 (300) buckets after it, regardless of the fraction.
+"""
+import pytest
+
+from attack_detectors import ComprehensiveAttackDetector, pin_detector_time
+
+T0 = 1_700_000_000.0  # On a bucket boundary
+
+
+@pytest.fixture
+def detector():
+    detector = ComprehensiveAttackDetector(lock_stripes=1)
+    detector.packet_clock = True
+    yield detector
+    pin_detector_time(None)
+
+
+def packet(timestamp, dest_port, size=60, tcp_flags=None, description='', source='10.0.0.1'):
+    return {'start_ip': source, 'end_ip': '10.0.0.2', 'protocol': 'TCP', 'start_bytes': size,
+            'end_bytes': 0, 'dest_port': dest_port, 'timestamp': timestamp, 'tcp_flags': tcp_flags,
+            'description': description}
+
+
+def test_sequential_port_scan_is_probe(detector):
+    for i in range(30):
+        result = detector.analyze_packet(packet(T0 + i * 0.05, 1000 + i))
+
+    features = result['port_scan_features']
+    assert features['unique_ports'] == 30
+    assert features['sequential_score'] == 1.0
+    assert features['is_port_scan']
+    assert result['attack_type'] == 'probe'
+    assert result['is_malicious']
+
+
+def test_port_scan_window_expires(detector):
+    for i in range(30):
+        detector.analyze_packet(packet(T0 + i * 0.05, 1000 + i))
+
+    # 60 buckets later only the new packet is in the window
+    result = detector.analyze_packet(packet(T0 + 61.45, 2000))
+    features = result['port_scan_features']
+    assert features['packets_per_second'] == 1.0
+    assert features['sequential_score'] == 0.0
+    assert not features['is_port_scan']
+    assert not result['is_malicious']
+
+
+def test_small_packet_flood_is_dos(detector):
+    for i in range(200):
+        result = detector.analyze_packet(packet(T0 + i * 0.005, 5000))
+
+    features = result['dos_features']
+    assert features['packet_count'] == 200
+    assert features['is_dos']
+    assert result['attack_type'] == 'dos'
+
+
+def test_dos_window_edge(detector):
+    for i in range(200):
+        detector.analyze_packet(packet(T0 + i * 0.005, 5000))
+
+    # Bucket T0 is still the oldest bucket of the window 59 buckets later
+    result = detector.analyze_packet(packet(T0 + 59.5, 5000))
+    assert result['dos_features']['packet_count'] == 201
+    assert not result['dos_features']['is_dos']
+
+    # ... and leaves it with the 60th
+    result = detector.analyze_packet(packet(T0 + 60.0, 5000))
+    assert result['dos_features']['packet_count'] == 2
+    assert not result['is_malicious']
+
+
+def test_syn_flood_counts_syn_without_ack(detector):
+    for i in range(80):
+        result = detector.analyze_packet(packet(T0 + i * 0.025, 8080, size=200, tcp_flags=0x02))
+
+    features = result['dos_features']
+    assert features['syn_packets'] == 80
+    assert features['is_dos']
+    assert result['attack_type'] == 'dos'
+
+
+def test_syn_ack_is_not_counted(detector):
+    for i in range(80):
+        result = detector.analyze_packet(packet(T0 + i * 0.025, 8080, size=200, tcp_flags=0x12))
+
+    features = result['dos_features']
+    assert features['syn_packets'] == 0
+    assert not features['is_dos']
+    assert not result['is_malicious']
+
+
+def test_failed_logins_are_brute_force_until_they_expire(detector):
+    for i in range(20):
+        result = detector.analyze_packet(packet(T0 + i * 10, 22, description='login failed'))
+
+    features = result['brute_force_features']
+    assert features['failed_attempts'] == 20
+    assert features['is_brute_force']
+    assert result['attack_type'] == 'brute_force'
+
+    # The first failure is still in the 300 s window 299 buckets later
+    result = detector.analyze_packet(packet(T0 + 299.5, 22))
+    assert result['brute_force_features']['login_attempts'] == 21
+    assert result['brute_force_features']['failed_attempts'] == 20
+
+    # ... and gone 300 buckets later
+    result = detector.analyze_packet(packet(T0 + 300.0, 22))
+    assert result['brute_force_features']['login_attempts'] == 21
+    assert result['brute_force_features']['failed_attempts'] == 19
+
+
+def test_sources_have_separate_windows(detector):
+    for i in range(200):
+        detector.analyze_packet(packet(T0 + i * 0.005, 5000))
+
+    result = detector.analyze_packet(packet(T0 + 1.0, 5000, source='10.0.0.9'))
+    assert result['dos_features']['packet_count'] == 1
+    assert not result['is_malicious']
@@ -0,0 +1,90 @@
+"""CompiledForest.predict_proba against sklearn's, on rows around the models' own thresholds"""
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('sklearn')
+from sklearn.base import clone
+from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+from sklearn.tree import DecisionTreeClassifier
+import joblib
+
+from compiled_forest import CompiledForest, compile_forest, synthetic_rows
+from inference_engine import _load_compiled
+
+
+def training_data(n_classes, n_rows=600, n_features=12, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_rows, n_features)).astype(np.float32) * 100
+    y = (np.abs(X[:, 0] + X[:, 1] * X[:, 2] / 100) // 40).astype(int) % n_classes
+    return X, y
+
+
+@pytest.mark.parametrize('model', [
+    RandomForestClassifier(n_estimators=25, random_state=0),
+    RandomForestClassifier(n_estimators=10, max_depth=4, random_state=0),
+    ExtraTreesClassifier(n_estimators=25, random_state=0),
+    DecisionTreeClassifier(random_state=0),
+])
+@pytest.mark.parametrize('n_classes', [2, 6])
+def test_predict_proba_matches_sklearn(model, n_classes):
+    X, y = training_data(n_classes)
+    model = clone(model).fit(X, y)
+    compiled = CompiledForest.from_sklearn(model)
+
+    rows = np.vstack([X, synthetic_rows(model, 2000)])
+    np.testing.assert_allclose(compiled.predict_proba(rows), model.predict_proba(rows), rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(compiled.predict(rows), model.predict(rows))
+
+
+def test_single_rows_and_blocks_agree():
+    X, y = training_data(6)
+    model = RandomForestClassifier(n_estimators=15, random_state=1).fit(X, y)
+    compiled = compile_forest(model)
+
+    batch = compiled.predict_proba(X)
+    singles = np.vstack([compiled.predict_proba(X[i:i + 1]) for i in range(50)])
+    np.testing.assert_array_equal(singles, batch[:50])
+
+
+def test_memory_mapped_artifact_round_trip(tmp_path):
+    X, y = training_data(2)
+    model = RandomForestClassifier(n_estimators=10, random_state=2).fit(X, y)
+    path = str(tmp_path / 'model.compiled.joblib')
+    compile_forest(model).save(path)
+
+    loaded = CompiledForest.load(path)
+    np.testing.assert_allclose(loaded.predict_proba(X), model.predict_proba(X), rtol=0, atol=1e-12)
+
+
+def test_rejects_models_that_are_not_tree_ensembles():
+    with pytest.raises(ValueError):
+        CompiledForest.from_sklearn(object())
+
+
+def test_rejects_wrong_feature_count():
+    X, y = training_data(2)
+    compiled = CompiledForest.from_sklearn(DecisionTreeClassifier(random_state=0).fit(X, y))
+    with pytest.raises(ValueError):
+        compiled.predict_proba(X[:, :5])
+
+
+def test_artifact_is_rebuilt_for_a_replaced_model_with_the_same_mtime(tmp_path):
+    X, y = training_data(2)
+    path = str(tmp_path / 'model.pkl')
+    old = RandomForestClassifier(n_estimators=5, random_state=3).fit(X, y)
+    joblib.dump(old, path)
+    _load_compiled(path, 'Test')
+    stat = os.stat(path)
+
+    # Replace the model but keep its timestamps, as cp -p / rsync -t / tar do
+    new = RandomForestClassifier(n_estimators=7, random_state=4).fit(X, y)
+    joblib.dump(new, path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    compiled = _load_compiled(path, 'Test')
+    assert compiled.n_trees == 7
+    np.testing.assert_allclose(compiled.predict_proba(X), new.predict_proba(X), rtol=0, atol=1e-12)
+    # The rebuilt artifact is reused as long as the model file does not change
+    assert _load_compiled(path, 'Test').n_trees == 7
@@ -0,0 +1,172 @@
+"""Capture parser: small pcap / pcapng files built in memory, decoded to packet dicts"""
+import socket
+import struct
+
+import pytest
+
+from pcap_replay import (LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL, LINKTYPE_RAW, frame_to_packet,
+                         read_frames)
+
+SRC4, DST4 = '192.0.2.10', '198.51.100.20'
+SRC6, DST6 = '2001:db8::10', '2001:db8::20'
+
+
+def tcp(src_port=40000, dst_port=80, flags=0x02, window=65535):
+    return struct.pack('>HHIIBBHHH', src_port, dst_port, 1, 0, 5 << 4, flags, window, 0, 0)
+
+
+def udp(src_port=5353, dst_port=53):
+    return struct.pack('>HHHH', src_port, dst_port, 8, 0)
+
+
+def ipv4(payload, protocol, fragment_offset=0):
+    header = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(payload), 1, fragment_offset, 64, protocol, 0,
+                         socket.inet_aton(SRC4), socket.inet_aton(DST4))
+    return header + payload
+
+
+def ipv6(payload, next_header):
+    return struct.pack('>IHBB16s16s', 6 << 28, len(payload), next_header, 64,
+                       socket.inet_pton(socket.AF_INET6, SRC6), socket.inet_pton(socket.AF_INET6, DST6)) + payload
+
+
+def hop_by_hop(next_header):
+    return struct.pack('>BB6x', next_header, 0)
+
+
+def fragment_header(next_header, offset, more):
+    return struct.pack('>BBHI', next_header, 0, offset << 3 | more, 7)
+
+
+def ethernet(payload, ethertype=0x0800, vlan=None):
+    header = b'\x00\x11\x22\x33\x44\x55' + b'\x66\x77\x88\x99\xaa\xbb'
+    if vlan is not None:
+        header += struct.pack('>HH', 0x8100, vlan)
+    return header + struct.pack('>H', ethertype) + payload
+
+
+def sll(payload, ethertype=0x0800):
+    return struct.pack('>HHH8sH', 0, 1, 6, b'\x66\x77\x88\x99\xaa\xbb\x00\x00', ethertype) + payload
+
+
+def pcap(records, endian='<', nanoseconds=False, linktype=LINKTYPE_ETHERNET):
+    """records: (seconds, fraction, frame)"""
+    data = struct.pack(endian + 'IHHiIII', 0xA1B23C4D if nanoseconds else 0xA1B2C3D4, 2, 4, 0, 0, 65535, linktype)
+    for seconds, fraction, frame in records:
+        data += struct.pack(endian + 'IIII', seconds, fraction, len(frame), len(frame)) + frame
+    return data
+
+
+def pcapng_block(block_type, body):
+    length = 12 + len(body)
+    return struct.pack('<II', block_type, length) + body + struct.pack('<I', length)
+
+
+def pcapng(interfaces, packets):
+    """interfaces: (link type, if_tsresol byte or None); packets: (interface, timestamp units, frame)"""
+    data = pcapng_block(0x0A0D0D0A, struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1))
+    for linktype, tsresol in interfaces:
+        options = b''
+        if tsresol is not None:
+            options = struct.pack('<HHB3x', 9, 1, tsresol) + struct.pack('<HH', 0, 0)
+        data += pcapng_block(1, struct.pack('<HHI', linktype, 0, 65535) + options)
+    for interface, units, frame in packets:
+        padded = frame + b'\x00' * (-len(frame) % 4)
+        data += pcapng_block(6, struct.pack('<IIIII', interface, units >> 32, units & 0xFFFFFFFF,
+                                            len(frame), len(frame)) + padded)
+    return data
+
+
+def frames_of(tmp_path, data, name='capture.pcap'):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return list(read_frames(str(path)))
+
+
+def packets_of(tmp_path, data, name='capture.pcap'):
+    return [frame_to_packet(*frame) for frame in frames_of(tmp_path, data, name)]
+
+
+def tcp_syn_packet(start_ip, end_ip, length, timestamp):
+    return {
+        'start_ip': start_ip, 'end_ip': end_ip, 'protocol': 'TCP', 'description': 'TCP 40000 -> 80',
+        'start_bytes': length, 'end_bytes': length, 'timestamp': timestamp,
+        'src_port': 40000, 'dest_port': 80, 'header_length': 20, 'tcp_flags': 0x02, 'tcp_window': 65535,
+    }
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_classic_pcap_in_either_byte_order(tmp_path, endian):
+    frame = ethernet(ipv4(tcp(), 6))
+    packets = packets_of(tmp_path, pcap([(1700000000, 250000, frame)], endian=endian))
+    assert packets == [tcp_syn_packet(SRC4, DST4, len(frame), 1700000000.25)]
+
+
+def test_classic_pcap_nanosecond_timestamps(tmp_path):
+    frames = frames_of(tmp_path, pcap([(1700000000, 123456789, ethernet(ipv4(udp(), 17)))], nanoseconds=True))
+    assert frames[0][0] == pytest.approx(1700000000.123456789, abs=1e-6)
+
+
+def test_pcapng_enhanced_packets_use_each_interface_tsresol(tmp_path):
+    ethernet_frame, raw_frame = ethernet(ipv4(tcp(), 6)), ipv4(tcp(), 6)
+    data = pcapng(
+        [(LINKTYPE_ETHERNET, 9), (LINKTYPE_RAW, 0x80 | 10)],  # Nanoseconds, then 2^-10 s
+        [(0, 1700000000_500000000, ethernet_frame), (1, 1700000000 * 1024 + 256, raw_frame)]
+    )
+    frames = frames_of(tmp_path, data, 'capture.pcapng')
+    assert [(linktype, length) for _, linktype, _, length in frames] == \
+        [(LINKTYPE_ETHERNET, len(ethernet_frame)), (LINKTYPE_RAW, len(raw_frame))]
+    assert frames[0][0] == pytest.approx(1700000000.5)
+    assert frames[1][0] == pytest.approx(1700000000.25)
+    assert [frame_to_packet(*frame) for frame in frames] == [
+        tcp_syn_packet(SRC4, DST4, len(ethernet_frame), frames[0][0]),
+        tcp_syn_packet(SRC4, DST4, len(raw_frame), frames[1][0]),
+    ]
+
+
+def test_vlan_tagged_frame(tmp_path):
+    frame = ethernet(ipv4(udp(), 17), vlan=42)
+    packet = packets_of(tmp_path, pcap([(1700000000, 0, frame)]))[0]
+    assert packet['start_ip'] == SRC4 and packet['end_ip'] == DST4
+    assert (packet['protocol'], packet['src_port'], packet['dest_port']) == ('UDP', 5353, 53)
+    assert packet['header_length'] == 8
+
+
+def test_linux_cooked_frame(tmp_path):
+    frame = sll(ipv4(tcp(), 6))
+    packets = packets_of(tmp_path, pcap([(1700000000, 0, frame)], linktype=LINKTYPE_LINUX_SLL))
+    assert packets == [tcp_syn_packet(SRC4, DST4, len(frame), 1700000000.0)]
+
+
+def test_ipv6_extension_headers_are_skipped(tmp_path):
+    frame = ethernet(ipv6(hop_by_hop(6) + tcp(), 0), ethertype=0x86DD)
+    packets = packets_of(tmp_path, pcap([(1700000000, 0, frame)]))
+    assert packets == [tcp_syn_packet(SRC6, DST6, len(frame), 1700000000.0)]
+
+
+def test_ipv6_fragments_carry_ports_only_in_the_first(tmp_path):
+    first = ethernet(ipv6(fragment_header(17, 0, 1) + udp(), 44), ethertype=0x86DD)
+    later = ethernet(ipv6(fragment_header(17, 185, 0) + b'\x00' * 16, 44), ethertype=0x86DD)
+    first_packet, later_packet = packets_of(tmp_path, pcap([(1700000000, 0, first), (1700000000, 1, later)]))
+    assert (first_packet['protocol'], first_packet['src_port'], first_packet['dest_port']) == ('UDP', 5353, 53)
+    assert later_packet['protocol'] == 'UDP' and 'src_port' not in later_packet
+    assert later_packet['description'] == f'UDP packet ({len(later)} bytes)'
+
+
+def test_ipv4_fragments_carry_ports_only_in_the_first(tmp_path):
+    later = ethernet(ipv4(b'\x00' * 16, 17, fragment_offset=185))
+    packet = packets_of(tmp_path, pcap([(1700000000, 0, later)]))[0]
+    assert packet['protocol'] == 'UDP' and 'src_port' not in packet
+
+
+def test_non_ip_frame_is_skipped(tmp_path):
+    arp = ethernet(b'\x00' * 28, ethertype=0x0806)
+    assert packets_of(tmp_path, pcap([(1700000000, 0, arp)])) == [None]
+
+
+def test_truncated_last_record_is_dropped(tmp_path):
+    frame = ethernet(ipv4(tcp(), 6))
+    data = pcap([(1700000000, 0, frame), (1700000001, 0, frame)])
+    frames = frames_of(tmp_path, data[:-10])
+    assert len(frames) == 1
+    assert frames[0] == (1700000000.0, LINKTYPE_ETHERNET, frame, len(frame))
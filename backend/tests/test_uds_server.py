@@ -0,0 +1,58 @@
+"""Pipelined Unix socket transport: ordering and back-pressure on a slow scorer"""
+import socket
+import threading
+import time
+
+import pytest
+
+from uds_server import UnixSocketClient, UnixSocketServer
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='No Unix domain sockets')
+
+
+def fallback(packet, error):
+    return {'error': error}
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / 'ids.sock')
+
+
+def test_pipelined_frames_are_answered_in_order(socket_path):
+    server = UnixSocketServer(socket_path, lambda packets, sanitized: [{'n': p['n']} for p in packets], fallback)
+    server.start()
+    client = UnixSocketClient(socket_path)
+    try:
+        futures = [client.submit({'n': i}) for i in range(100)]
+        assert [future.result(timeout=5)['n'] for future in futures] == list(range(100))
+    finally:
+        client.close()
+        server.stop()
+
+
+def test_reader_stops_decoding_while_the_scorer_is_behind(socket_path):
+    release = threading.Event()
+
+    def slow_score(packets, sanitized):
+        release.wait(5)
+        return [{'n': p['n']} for p in packets]
+
+    server = UnixSocketServer(socket_path, slow_score, fallback, max_batch=1, max_pending=2)
+    decoded = []
+    decode = server._decode
+    server._decode = lambda *frame: decoded.append(frame[0]) or decode(*frame)
+    server.start()
+    client = UnixSocketClient(socket_path)
+    try:
+        futures = [client.submit({'n': i}) for i in range(50)]
+        time.sleep(0.3)
+        # One frame being scored, max_pending queued, one decoded and waiting for room
+        assert len(decoded) <= 4
+        release.set()
+        assert [future.result(timeout=5)['n'] for future in futures] == list(range(50))
+        assert len(decoded) == 50
+    finally:
+        release.set()
+        client.close()
+        server.stop()
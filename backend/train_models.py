@@ -10,33 +10,10 @@ from sklearn.metrics import classification_report, accuracy_score, confusion_mat
 import joblib
 import pickle
 from attack_detectors import comprehensive_detector
+from packet_features import FEATURE_NAMES
 import random
 from datetime import datetime, timedelta
 
-# Feature names that the model expects (from preprocess_packet)
-FEATURE_NAMES = [
-    'Destination Port', 'Flow Duration', 'Total Fwd Packets', 'Total Backward Packets',
-    'Total Length of Fwd Packets', 'Total Length of Bwd Packets', 'Fwd Packet Length Max',
-    'Fwd Packet Length Min', 'Fwd Packet Length Mean', 'Fwd Packet Length Std',
-    'Bwd Packet Length Max', 'Bwd Packet Length Min', 'Bwd Packet Length Mean',
-    'Bwd Packet Length Std', 'Flow Packets/s', 'Flow IAT Mean', 'Flow IAT Std',
-    'Flow IAT Max', 'Flow IAT Min', 'Fwd IAT Total', 'Fwd IAT Mean', 'Fwd IAT Std',
-    'Fwd IAT Max', 'Fwd IAT Min', 'Bwd IAT Total', 'Bwd IAT Mean', 'Bwd IAT Std',
-    'Bwd IAT Max', 'Bwd IAT Min', 'Fwd PSH Flags', 'Bwd PSH Flags', 'Fwd URG Flags',
-    'Bwd URG Flags', 'Fwd Header Length', 'Bwd Header Length', 'Fwd Packets/s',
-    'Bwd Packets/s', 'Min Packet Length', 'Max Packet Length', 'Packet Length Mean',
-    'Packet Length Std', 'Packet Length Variance', 'FIN Flag Count', 'SYN Flag Count',
-    'RST Flag Count', 'PSH Flag Count', 'ACK Flag Count', 'URG Flag Count',
-    'CWE Flag Count', 'ECE Flag Count', 'Down/Up Ratio', 'Average Packet Size',
-    'Avg Fwd Segment Size', 'Avg Bwd Segment Size', 'Fwd Header Length.1',
-    'Fwd Avg Bytes/Bulk', 'Fwd Avg Packets/Bulk', 'Fwd Avg Bulk Rate',
-    'Bwd Avg Bytes/Bulk', 'Bwd Avg Packets/Bulk', 'Bwd Avg Bulk Rate',
-    'Subflow Fwd Packets', 'Subflow Fwd Bytes', 'Subflow Bwd Packets',
-    'Subflow Bwd Bytes', 'Init_Win_bytes_forward', 'Init_Win_bytes_backward',
-    'act_data_pkt_fwd', 'min_seg_size_forward', 'Active Mean', 'Active Std',
-    'Active Max', 'Active Min', 'Idle Mean', 'Idle Std', 'Idle Max', 'Idle Min'
-]
-
 def generate_normal_traffic_features(n_samples=200000):
     """Generate features for normal network traffic - MORE DIVERSE SAMPLES"""
     data = []
@@ -608,7 +585,9 @@ def train_models():
     print("   - binary_attack_model.pkl")
     print("   - multiclass_attack_model.pkl")
     print("\n🎉 Training complete! Your models are ready to use.")
-    print("\n⚠️  IMPORTANT: Restart the prediction service after replacing the model files!")
+    print("   For smaller / faster models: python3 model_compression.py --latency-budget-ms <ms>")
+    print("\n⚠️  IMPORTANT: Load the new model files into the running prediction service:")
+    print("   curl -X POST http://127.0.0.1:5002/reload   (or run it with MODEL_WATCH=true)")
 
 if __name__ == '__main__':
     try:
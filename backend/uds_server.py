@@ -0,0 +1,330 @@
+"""
+Unix Domain Socket Transport
+Persistent, pipelined transport between co-located processes (capture service ->
+prediction service) without TCP or HTTP parsing on the hot path.
+
+Every message is one frame: a 9-byte little-endian header followed by the payload.
+
+    payload_length u4 | request_id u4 | kind u1 | payload
+
+    KIND_JSON    payload is a JSON packet object (answered with one verdict object)
+                 or a list of packets (answered with a list of verdicts), like /predict
+    KIND_BINARY  payload is PACKET_RECORD rows, answered with VERDICT_RECORD rows,
+                 like /predict/binary (see wire_format.py)
+
+Responses carry the request_id and kind of their request. A client may send any number
+of frames without waiting; frames of one connection are answered in the order they were
+sent, and frames that are already waiting are scored together in one batch. At most
+max_pending decoded frames wait per connection; beyond that the server stops reading
+and the socket buffer pushes back on the client.
+
+Usage:
+    PREDICTION_SOCKET=/tmp/ids_prediction.sock python3 prediction_service.py
+
+    client = UnixSocketClient('/tmp/ids_prediction.sock')
+    verdict = client.predict({'start_ip': '10.0.0.5', 'end_ip': '10.0.0.1', ...})
+"""
+import itertools
+import json
+import os
+import queue
+import socket
+import stat
+import struct
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import wire_format
+from service_logging import get_logger
+
+log = get_logger('uds_server')
+
+FRAME_HEADER = struct.Struct('<IIB')
+KIND_JSON = 0
+KIND_BINARY = 1
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+def _recv_exact(conn: socket.socket, n: int) -> Optional[bytes]:
+    """Read exactly n bytes, or None if the peer closed the connection first"""
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        chunk = conn.recv_into(view[received:], n - received)
+        if not chunk:
+            return None
+        received += chunk
+    return bytes(buf)
+
+
+def read_frame(conn: socket.socket) -> Optional[Tuple[int, int, bytes]]:
+    """
+    Read one frame.
+
+    Returns:
+        (request_id, kind, payload), or None on a clean end of stream
+
+    Raises:
+        ValueError: If the frame is larger than MAX_FRAME_BYTES
+    """
+    header = _recv_exact(conn, FRAME_HEADER.size)
+    if header is None:
+        return None
+    length, request_id, kind = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise ValueError(f"Frame of {length} bytes exceeds the {MAX_FRAME_BYTES}-byte limit")
+    payload = _recv_exact(conn, length) if length else b''
+    if payload is None:
+        return None
+    return request_id, kind, payload
+
+
+def pack_frame(request_id: int, kind: int, payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(len(payload), request_id & 0xFFFFFFFF, kind) + payload
+
+
+class _Request:
+    """One decoded frame: its packets, and how to turn their results back into a payload"""
+
+    def __init__(self, request_id: int, kind: int):
+        self.request_id = request_id
+        self.kind = kind
+        self.packets: List[Any] = []
+        self.sanitized = False
+        self.single = False
+        self.packet_ids = None
+        self.response: Optional[bytes] = None  # Set when the frame is answered without scoring
+
+
+class UnixSocketServer:
+    """Accepts long-lived connections on a Unix socket and scores their frames in order"""
+
+    def __init__(self, path: str, score: Callable[[List[Any], bool], List[Dict[str, Any]]],
+                 fallback: Callable[[Any, str], Dict[str, Any]], max_batch: int = 256,
+                 max_pending: Optional[int] = None):
+        """
+        Args:
+            path: Socket file (an existing socket file at this path is replaced)
+            score: Scores (packets, sanitized) and returns one result per packet in order
+            fallback: Builds the result for a packet that could not be scored, from (packet, error message)
+            max_batch: Maximum packets from pipelined frames of one connection scored together
+            max_pending: Decoded frames waiting to be scored per connection (default 4 * max_batch)
+        """
+        self.path = path
+        self.score = score
+        self.fallback = fallback
+        self.max_batch = int(max_batch)
+        self.max_pending = max(1, int(max_pending)) if max_pending is not None else 4 * self.max_batch
+        self.connections = 0
+        self.frames = 0
+        self._sock: Optional[socket.socket] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if os.path.exists(self.path):
+            if not stat.S_ISSOCK(os.stat(self.path).st_mode):
+                raise RuntimeError(f"{self.path} exists and is not a socket")
+            os.unlink(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        os.chmod(self.path, 0o660)
+        self._sock.listen(64)
+        threading.Thread(target=self._accept_loop, name='uds-accept', daemon=True).start()
+        log.info("🔌 Listening on unix socket %s", self.path)
+
+    def stop(self):
+        self._stopped.set()
+        if self._sock is not None:
+            self._sock.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def describe(self) -> Dict[str, Any]:
+        return {'path': self.path, 'connections': self.connections, 'frames': self.frames}
+
+    def _accept_loop(self):
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            pending: "queue.Queue" = queue.Queue(maxsize=self.max_pending)
+            closed = threading.Event()  # Set once the scorer stopped taking frames
+            threading.Thread(target=self._read_loop, args=(conn, pending, closed),
+                             name='uds-reader', daemon=True).start()
+            threading.Thread(target=self._score_loop, args=(conn, pending, closed),
+                             name='uds-scorer', daemon=True).start()
+
+    def _read_loop(self, conn: socket.socket, pending: "queue.Queue", closed: threading.Event):
+        """
+        Decode frames as they arrive so the client never waits for earlier answers, up to
+        max_pending frames ahead of the scorer; then wait, leaving the rest in the socket
+        """
+        try:
+            while True:
+                frame = read_frame(conn)
+                if frame is None:
+                    break
+                if not _put(pending, self._decode(*frame), closed):
+                    return
+        except (OSError, ValueError) as e:
+            log.warning("⚠️ Unix socket connection closed: %s", e)
+        finally:
+            _put(pending, None, closed)
+
+    def _decode(self, request_id: int, kind: int, payload: bytes) -> _Request:
+        req = _Request(request_id, kind)
+        try:
+            if kind == KIND_BINARY:
+                records = wire_format.decode_packets(payload)
+                req.packet_ids = records['packet_id']
+                req.packets = wire_format.records_to_packets(records)
+                req.sanitized = True
+            elif kind == KIND_JSON:
+                data = json.loads(payload)
+                if isinstance(data, dict) and 'packet' in data:
+                    data = data['packet']
+                req.single = isinstance(data, dict)
+                req.packets = [data] if req.single else data
+                if not isinstance(req.packets, list):
+                    raise ValueError('Invalid data format')
+            else:
+                raise ValueError(f'Unknown frame kind {kind}')
+        except ValueError as e:
+            req.kind = KIND_JSON
+            req.response = json.dumps(self.fallback(None, str(e))).encode()
+        return req
+
+    def _encode(self, req: _Request, results: List[Dict[str, Any]]) -> bytes:
+        if req.kind == KIND_BINARY:
+            return wire_format.encode_verdicts(req.packet_ids, results)
+        return json.dumps(results[0] if req.single else results).encode()
+
+    def _score_loop(self, conn: socket.socket, pending: "queue.Queue", closed: threading.Event):
+        """Answer frames in order, scoring frames that are already waiting as one batch"""
+        try:
+            while True:
+                req = pending.get()
+                if req is None:
+                    return
+                batch = [req]
+                n_packets = len(req.packets)
+                stopping = False
+                while n_packets < self.max_batch:
+                    try:
+                        req = pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    if req is None:
+                        stopping = True
+                        break
+                    batch.append(req)
+                    n_packets += len(req.packets)
+
+                self._answer(conn, batch)
+                if stopping:
+                    return
+        except OSError as e:
+            log.warning("⚠️ Unix socket connection closed: %s", e)
+        finally:
+            closed.set()
+            conn.close()
+
+    def _answer(self, conn: socket.socket, batch: List[_Request]):
+        # Raw JSON packets and already-sanitized binary packets are scored in separate calls
+        for sanitized in (False, True):
+            group = [req for req in batch if req.response is None and req.sanitized == sanitized]
+            packets = [packet for req in group for packet in req.packets]
+            if not packets:
+                continue
+            try:
+                results = self.score(packets, sanitized)
+            except Exception as e:
+                log.error("❌ Error scoring %d packet(s) from unix socket: %s", len(packets), e)
+                results = [self.fallback(packet, f'Server error: {e}') for packet in packets]
+            offset = 0
+            for req in group:
+                req.response = self._encode(req, results[offset:offset + len(req.packets)])
+                offset += len(req.packets)
+
+        conn.sendall(b''.join(pack_frame(req.request_id, req.kind, req.response) for req in batch))
+        self.frames += len(batch)
+
+
+def _put(pending: "queue.Queue", item: Any, closed: threading.Event) -> bool:
+    """Queue an item for the scorer, waiting while the queue is full; False if the scorer is gone"""
+    while not closed.is_set():
+        try:
+            pending.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+class UnixSocketClient:
+    """Pipelined client: any number of requests in flight on one connection"""
+
+    def __init__(self, path: str, timeout: float = 10.0):
+        self.timeout = timeout
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._send_lock = threading.Lock()
+        self._pending: Dict[int, Future] = {}
+        self._pending_lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+        threading.Thread(target=self._read_responses, name='uds-client-reader', daemon=True).start()
+
+    def _read_responses(self):
+        error: Exception = ConnectionError('Prediction socket closed')
+        try:
+            while True:
+                frame = read_frame(self._sock)
+                if frame is None:
+                    break
+                request_id, kind, payload = frame
+                with self._pending_lock:
+                    future = self._pending.pop(request_id, None)
+                if future is not None:
+                    future.set_result(wire_format.decode_verdicts(payload) if kind == KIND_BINARY
+                                      else json.loads(payload))
+        except (OSError, ValueError) as e:
+            error = e
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(error)
+
+    def submit(self, payload: Any, kind: int = KIND_JSON) -> Future:
+        """
+        Send one request without waiting. payload is a packet dict or list of packets for
+        KIND_JSON, PACKET_RECORD bytes for KIND_BINARY. The Future resolves to the verdict(s).
+        """
+        request_id = next(self._request_ids) & 0xFFFFFFFF
+        body = payload if kind == KIND_BINARY else json.dumps(payload).encode()
+        future: Future = Future()
+        with self._pending_lock:
+            self._pending[request_id] = future
+        try:
+            with self._send_lock:
+                self._sock.sendall(pack_frame(request_id, kind, body))
+        except OSError as e:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            future.set_exception(e)
+        return future
+
+    def predict(self, payload: Any, kind: int = KIND_JSON) -> Any:
+        return self.submit(payload, kind).result(timeout=self.timeout)
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
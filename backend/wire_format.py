@@ -0,0 +1,164 @@
+"""
+Compact Binary Wire Format
+Fixed-layout little-endian records for POST /predict/binary. The request body is a
+plain concatenation of PACKET_RECORD rows and is decoded with numpy.frombuffer, with
+no per-field parsing; the response body holds one VERDICT_RECORD per packet, in
+request order.
+
+Usage (client side):
+    body = encode_packets([{'start_ip': '10.0.0.5', 'end_ip': '10.0.0.1', 'protocol': 'TCP',
+                            'dest_port': 22, 'start_bytes': 60, 'end_bytes': 60}])
+    verdicts = decode_verdicts(requests.post(url, data=body).content)
+"""
+from typing import Any, Dict, List
+
+import numpy as np
+
+from inference_engine import ATTACK_TYPE_NAMES
+
+CONTENT_TYPE = 'application/octet-stream'
+
+# flags bits
+FLAG_LOGIN_FAILED = 0x01  # Authentication failure seen (same as 'failed'/'denied'/'refused' in a description)
+
+PACKET_RECORD = np.dtype([
+    ('packet_id', '<u8'),     # Echoed back in the verdict
+    ('timestamp', '<f8'),     # Capture time, epoch seconds (flow timing with FLOW_FEATURES; 0 = arrival time)
+    ('src_ip', '<u4'),        # IPv4 a.b.c.d as (a << 24) | (b << 16) | (c << 8) | d
+    ('dst_ip', '<u4'),
+    ('src_port', '<u2'),
+    ('dst_port', '<u2'),      # 0 = unknown
+    ('protocol', 'u1'),       # IP protocol number (6 TCP, 17 UDP, 1 ICMP, ...)
+    ('flags', 'u1'),
+    ('tcp_flags', 'u1'),      # TCP header flag bits (FIN 0x01 ... CWR 0x80), 0 = none / unknown
+    ('reserved', 'u1'),
+    ('start_bytes', '<u4'),
+    ('end_bytes', '<u4'),
+    ('frequency', '<f4'),
+])
+
+# Attack type codes in verdicts: ATTACK_TYPE_NAMES order, then the two fallback labels
+ATTACK_TYPE_CODES = ATTACK_TYPE_NAMES + ['unknown_attack', 'unknown']
+_ATTACK_TYPE_CODE = {name: code for code, name in enumerate(ATTACK_TYPE_CODES)}
+
+VERDICT_RECORD = np.dtype([
+    ('packet_id', '<u8'),
+    ('is_malicious', 'u1'),
+    ('attack_type', 'u1'),    # Index into ATTACK_TYPE_CODES
+    ('error', 'u1'),          # 1 if the packet could not be scored (verdict is the safe default)
+    ('reserved', 'u1'),
+    ('binary_confidence', '<f4'),
+    ('multiclass_confidence', '<f4'),
+    ('probabilities', '<f4', (len(ATTACK_TYPE_NAMES),)),  # ATTACK_TYPE_NAMES order
+])
+
+# Protocol names as reported by the Node capture service (packetCapture.ts getProtocol)
+PROTOCOL_NAMES = {6: 'TCP', 17: 'UDP', 1: 'ICMP', 2: 'IGMP', 4: 'IPv4', 41: 'IPv6', 47: 'GRE', 50: 'ESP', 51: 'AH'}
+PROTOCOL_NUMBERS = {name.upper(): number for number, name in PROTOCOL_NAMES.items()}
+
+
+def decode_packets(body: bytes) -> np.ndarray:
+    """
+    View a request body as PACKET_RECORD rows (zero-copy).
+
+    Raises:
+        ValueError: If the body is not a whole number of records
+    """
+    if len(body) % PACKET_RECORD.itemsize:
+        raise ValueError(f"Body length {len(body)} is not a multiple of the "
+                         f"{PACKET_RECORD.itemsize}-byte packet record")
+    return np.frombuffer(body, dtype=PACKET_RECORD)
+
+
+def _ip_strings(addresses: np.ndarray) -> List[str]:
+    """Dotted-quad strings for u32 addresses, formatting each distinct address once"""
+    unique, inverse = np.unique(addresses, return_inverse=True)
+    names = [f"{a >> 24}.{(a >> 16) & 255}.{(a >> 8) & 255}.{a & 255}" for a in unique.tolist()]
+    return [names[i] for i in inverse.tolist()]
+
+
+def records_to_packets(records: np.ndarray) -> List[Dict[str, Any]]:
+    """
+    Packet dictionaries for the detectors, already in sanitize_packet's value ranges.
+    Columns are converted in bulk; every packet carries dest_port / login_failed
+    instead of a description to parse.
+    """
+    start_bytes = np.minimum(records['start_bytes'], 65535).tolist()
+    end_bytes = np.minimum(records['end_bytes'], 65535).tolist()
+    frequency = np.nan_to_num(records['frequency'].astype(np.float64), nan=1.0)
+    frequency = np.clip(np.where(frequency == 0, 1.0, frequency), 0, 1000000).tolist()  # 0 means 1, as in sanitize_packet
+    protocols = [PROTOCOL_NAMES.get(p, f'PROTO_{p}') for p in records['protocol'].tolist()]
+    dest_ports = records['dst_port'].tolist()
+    src_ports = records['src_port'].tolist()
+    timestamps = records['timestamp'].tolist()
+    tcp_flags = records['tcp_flags'].tolist()
+    login_failed = (records['flags'] & FLAG_LOGIN_FAILED).astype(bool).tolist()
+
+    return [
+        {
+            '_id': packet_id,
+            'start_ip': start_ip,
+            'end_ip': end_ip,
+            'protocol': protocol,
+            'description': '',
+            'dest_port': dest_port or None,
+            'src_port': src_port,
+            'timestamp': timestamp,
+            'tcp_flags': flags,
+            'login_failed': failed,
+            'start_bytes': sb,
+            'end_bytes': eb,
+            'frequency': freq,
+        }
+        for packet_id, start_ip, end_ip, protocol, dest_port, src_port, timestamp, flags, failed, sb, eb, freq in zip(
+            records['packet_id'].tolist(), _ip_strings(records['src_ip']), _ip_strings(records['dst_ip']),
+            protocols, dest_ports, src_ports, timestamps, tcp_flags, login_failed, start_bytes, end_bytes, frequency
+        )
+    ]
+
+
+def encode_verdicts(packet_ids: np.ndarray, results: List[Dict[str, Any]]) -> bytes:
+    """Pack predict_packets results into VERDICT_RECORD rows"""
+    out = np.zeros(len(results), dtype=VERDICT_RECORD)
+    out['packet_id'] = packet_ids
+    out['is_malicious'] = [r.get('binary_prediction') == 'malicious' for r in results]
+    out['attack_type'] = [_ATTACK_TYPE_CODE.get(r.get('attack_type'), _ATTACK_TYPE_CODE['unknown']) for r in results]
+    out['error'] = ['error' in r for r in results]
+    confidence = [r.get('confidence') or {} for r in results]
+    out['binary_confidence'] = [c.get('binary', 0.0) for c in confidence]
+    out['multiclass_confidence'] = [c.get('multiclass', 0.0) for c in confidence]
+    out['probabilities'] = [
+        [(r.get('attack_type_probabilities') or {}).get(name, 0.0) for name in ATTACK_TYPE_NAMES]
+        for r in results
+    ]
+    return out.tobytes()
+
+
+def decode_verdicts(body: bytes) -> np.ndarray:
+    """View a /predict/binary response as VERDICT_RECORD rows"""
+    return np.frombuffer(body, dtype=VERDICT_RECORD)
+
+
+def ip_to_int(address: str) -> int:
+    a, b, c, d = (int(part) for part in address.split('.'))
+    return (a << 24) | (b << 16) | (c << 8) | d
+
+
+def encode_packets(packets: List[Dict[str, Any]]) -> bytes:
+    """Client-side helper: pack packet dictionaries (JSON field names) into PACKET_RECORD rows"""
+    out = np.zeros(len(packets), dtype=PACKET_RECORD)
+    for i, packet in enumerate(packets):
+        row = out[i]
+        row['packet_id'] = int(packet.get('packet_id', i))
+        row['timestamp'] = float(packet.get('timestamp', 0.0))
+        row['src_ip'] = ip_to_int(packet.get('start_ip', '0.0.0.0'))
+        row['dst_ip'] = ip_to_int(packet.get('end_ip', '0.0.0.0'))
+        row['src_port'] = int(packet.get('src_port', 0))
+        row['dst_port'] = int(packet.get('dest_port') or 0)
+        row['protocol'] = PROTOCOL_NUMBERS.get(str(packet.get('protocol', 'TCP')).upper(), 0)
+        row['flags'] = FLAG_LOGIN_FAILED if packet.get('login_failed') else 0
+        row['tcp_flags'] = int(packet.get('tcp_flags') or 0)
+        row['start_bytes'] = int(packet.get('start_bytes', 0))
+        row['end_bytes'] = int(packet.get('end_bytes', 0))
+        row['frequency'] = float(packet.get('frequency', 1))
+    return out.tobytes()
@@ -0,0 +1,306 @@
+"""
+Prediction Worker Pool
+Supervisor mode for multi-core sensors. N forked worker processes each own their own
+models and ComprehensiveAttackDetector state; the front process only parses requests
+and routes every packet by a hash of its start_ip. All packets of one source therefore
+reach the same worker, in arrival order, and its sliding windows stay complete.
+A request's time.monotonic() deadline travels with its packets (the clock is shared
+by the processes), so workers skip the work of requests nobody waits for any more.
+
+Workers that die are restarted (their shard of detector state starts over empty).
+collect_stats() asks every worker for its stats (e.g. a metrics snapshot) in between batches.
+"""
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from service_logging import get_logger
+
+log = get_logger('worker_pool')
+
+
+def routing_key(packet: Any) -> str:
+    """Source address used for affinity, matching what sanitize_packet will make of it"""
+    if not isinstance(packet, dict):
+        return ''
+    return str(packet.get('start_ip', '0.0.0.0'))
+
+
+def worker_index(source_ip: str, n_workers: int) -> int:
+    """Stable shard for a source address (crc32, identical in every process and across restarts)"""
+    return zlib.crc32(source_ip.encode('utf-8', 'replace')) % n_workers
+
+
+def fork_available() -> bool:
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def _worker_loop(conn, init: Callable[[], None], handle: Callable[..., List[Any]], max_batch: int,
+                 inherited: List[Any] = (), stats: Optional[Callable[[], Any]] = None):
+    """
+    Worker process body: score incoming packet lists in order. Requests that are already
+    waiting in the pipe are merged into one handle() call (up to max_batch packets), with
+    the latest of their deadlines; requests whose deadline already passed are handed to
+    handle() on their own, with that deadline, so it can skip their work.
+    A request without packets asks for stats() instead.
+    """
+    # Close the front-process pipe ends inherited through fork, so the worker sees EOF
+    # (and exits) when the front process goes away
+    for inherited_conn in inherited:
+        inherited_conn.close()
+    init()
+    stopping = False
+    while not stopping:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+
+        requests, stats_requests = [], []
+        n_packets = 0
+        while True:
+            if message[1] is None:
+                stats_requests.append(message[0])
+            else:
+                requests.append(message)
+                n_packets += len(message[1])
+            if n_packets >= max_batch or not conn.poll():
+                break
+            message = conn.recv()
+            if message is None:
+                stopping = True
+                break
+
+        for request_id in stats_requests:
+            try:
+                snapshot, error = (stats(), None) if stats is not None else (None, 'No stats in this worker')
+            except Exception as e:
+                snapshot, error = None, str(e)
+            try:
+                conn.send((request_id, snapshot, error))
+            except (BrokenPipeError, OSError):
+                return
+        if not requests:
+            continue
+
+        now = time.monotonic()
+        expired = [request for request in requests if request[2] is not None and request[2] <= now]
+        if expired:
+            requests = [request for request in requests if request[2] is None or request[2] > now]
+            if not _handle_requests(conn, handle, expired, max(request[2] for request in expired)):
+                return
+        if requests:
+            deadlines = [request[2] for request in requests]
+            if not _handle_requests(conn, handle, requests, None if None in deadlines else max(deadlines)):
+                return
+
+
+def _handle_requests(conn, handle: Callable[..., List[Any]], requests: List[tuple], deadline: Optional[float]) -> bool:
+    """Score merged requests in one handle() call and answer each; False once the pipe is gone"""
+    packets = [packet for _, batch, _ in requests for packet in batch]
+    try:
+        results, error = handle(packets, deadline=deadline), None
+    except Exception as e:
+        log.error("❌ Worker error on batch of %d packet(s): %s", len(packets), e)
+        results, error = None, str(e)
+
+    offset = 0
+    for request_id, batch, _ in requests:
+        chunk = results[offset:offset + len(batch)] if results is not None else None
+        offset += len(batch)
+        try:
+            conn.send((request_id, chunk, error))
+        except (BrokenPipeError, OSError):
+            return False
+    return True
+
+
+class _Worker:
+    """Front-process handle of one worker: its pipe, in-flight requests and response reader"""
+
+    def __init__(self, index: int, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.pending: Dict[int, Future] = {}
+        self.pending_lock = threading.Lock()
+
+    def fail_pending(self, error: Exception):
+        with self.pending_lock:
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+
+class WorkerPool:
+    """Forks the workers, routes packets to them by source and reassembles results in input order"""
+
+    def __init__(self, n_workers: int, init: Callable[[], None], handle: Callable[..., List[Any]],
+                 fallback: Callable[[Any, str], Any], max_batch: int = 256, timeout: float = 30.0,
+                 stats: Optional[Callable[[], Any]] = None):
+        """
+        Args:
+            n_workers: Number of worker processes
+            init: Run once in each worker after fork (e.g. load the models)
+            handle: Scores a list of packets in a worker, one result per packet in order; called
+                with deadline= (time.monotonic() after which nobody waits for them, or None)
+            fallback: Builds the result for a packet whose worker failed, from (packet, error message)
+            max_batch: Maximum packets a worker merges into one handle() call
+            timeout: Seconds to wait for a worker's answer
+            stats: Run in a worker by collect_stats(); must return picklable data
+        """
+        if not fork_available():
+            raise RuntimeError("Worker processes require the 'fork' start method")
+        self.n_workers = int(n_workers)
+        self.init = init
+        self.handle = handle
+        self.fallback = fallback
+        self.max_batch = int(max_batch)
+        self.timeout = float(timeout)
+        self.stats = stats
+        self.restarts = 0
+        self._context = multiprocessing.get_context('fork')
+        self._request_ids = itertools.count()
+        self._shutdown = False
+        self._workers: List[_Worker] = []
+        for index in range(self.n_workers):
+            self._workers.append(self._start(index))
+
+    def _start(self, index: int) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        inherited = [parent_conn] + [worker.conn for worker in self._workers if worker.index != index]
+        process = self._context.Process(
+            target=_worker_loop,
+            args=(child_conn, self.init, self.handle, self.max_batch, inherited, self.stats),
+            name=f'prediction-worker-{index}',
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(index, process, parent_conn)
+        threading.Thread(target=self._read_responses, args=(worker,),
+                         name=f'prediction-worker-{index}-reader', daemon=True).start()
+        log.info("👷 Started prediction worker %d (pid %d)", index, process.pid)
+        return worker
+
+    def _read_responses(self, worker: _Worker):
+        while True:
+            try:
+                request_id, results, error = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            with worker.pending_lock:
+                future = worker.pending.pop(request_id, None)
+            if future is None:
+                continue
+            if results is None:
+                future.set_exception(RuntimeError(error or 'Worker failed'))
+            else:
+                future.set_result(results)
+
+        worker.fail_pending(RuntimeError(f"Prediction worker {worker.index} exited"))
+        if not self._shutdown:
+            worker.process.join(1)
+            log.warning("⚠️ Prediction worker %d died (exit code %s), restarting...",
+                        worker.index, worker.process.exitcode)
+            self.restarts += 1
+            self._workers[worker.index] = self._start(worker.index)
+
+    def submit(self, index: int, packets: Optional[List[Any]], deadline: Optional[float] = None) -> Future:
+        """Send packets to one worker; the Future resolves to their results (packets=None: its stats)"""
+        worker = self._workers[index]
+        request_id = next(self._request_ids)
+        future: Future = Future()
+        with worker.pending_lock:
+            worker.pending[request_id] = future
+        try:
+            with worker.send_lock:
+                worker.conn.send((request_id, packets, deadline))
+        except (BrokenPipeError, OSError) as e:
+            with worker.pending_lock:
+                worker.pending.pop(request_id, None)
+            future.set_exception(e)
+        return future
+
+    def predict(self, packets: List[Any], deadline: Optional[float] = None) -> List[Any]:
+        """Score packets on their source's worker, returning results in input order"""
+        return self.predict_later(packets, deadline)()
+
+    def predict_later(self, packets: List[Any], deadline: Optional[float] = None) -> Callable[[], List[Any]]:
+        """
+        Send packets to their workers without waiting; the returned function waits for the
+        results (in input order). Batches sent one after another are scored in that order,
+        so a caller can keep several in flight. deadline is passed on to handle().
+        """
+        groups: Dict[int, List[int]] = {}
+        for i, packet in enumerate(packets):
+            groups.setdefault(worker_index(routing_key(packet), self.n_workers), []).append(i)
+
+        futures = {index: self.submit(index, [packets[i] for i in positions], deadline)
+                   for index, positions in groups.items()}
+
+        def gather() -> List[Any]:
+            results: List[Any] = [None] * len(packets)
+            for index, positions in groups.items():
+                try:
+                    worker_results = futures[index].result(timeout=self.timeout)
+                except Exception as e:
+                    log.warning("⚠️ Prediction worker %d failed: %s", index, e)
+                    worker_results = [self.fallback(packets[i], f'Prediction worker failed: {e}') for i in positions]
+                for i, result in zip(positions, worker_results):
+                    results[i] = result
+            return results
+
+        return gather
+
+    def collect_stats(self, timeout: float = 5.0) -> List[Any]:
+        """stats() of every worker that answers within the timeout (workers answer between batches)"""
+        futures = [self.submit(worker.index, None) for worker in self._workers]
+        collected = []
+        for index, future in enumerate(futures):
+            try:
+                collected.append(future.result(timeout=timeout))
+            except Exception as e:
+                log.warning("⚠️ No stats from prediction worker %d: %s", index, e)
+        return collected
+
+    def signal_workers(self, signum: int) -> int:
+        """Send a signal to every live worker (e.g. SIGHUP to reload models); returns how many"""
+        signalled = 0
+        for worker in self._workers:
+            if worker.process.is_alive():
+                try:
+                    os.kill(worker.process.pid, signum)
+                    signalled += 1
+                except OSError:
+                    pass
+        return signalled
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'workers': self.n_workers,
+            'alive': sum(1 for w in self._workers if w.process.is_alive()),
+            'restarts': self.restarts
+        }
+
+    def shutdown(self, timeout: float = 5.0):
+        self._shutdown = True
+        for worker in self._workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self._workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()